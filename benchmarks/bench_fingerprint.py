@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""
+A repeatable throughput benchmark suite of :mod:`pygitrepo.pkg.fingerprint`.
+
+It measures every combination of file size, chunk size, hash algorithm and
+I/O strategy, and writes the results as json, so regressions can be caught
+and the default settings can be chosen from data.
+
+I/O strategies:
+
+- ``legacy``: the ``f.read(chunk_size)`` loop ``of_file`` used to have,
+    every read allocates a new bytes object.
+- ``readinto``: ``of_file`` reading into one reusable buffer.
+- ``mmap``: ``of_file`` hashing a read only memory map.
+
+Usage::
+
+    # run the suite, write results to json
+    python benchmarks/bench_fingerprint.py --output bench.json
+
+    # run the suite, fail if any throughput is 10% lower than the baseline
+    python benchmarks/bench_fingerprint.py --baseline bench.json --tolerance 0.1
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+
+from pygitrepo.pkg.fingerprint import FingerPrint, KB, MB
+
+STRATEGIES = ["legacy", "readinto", "mmap"]
+DEFAULT_SIZES = [1 * MB, 16 * MB, 64 * MB]
+DEFAULT_CHUNK_SIZES = [1 * KB, 64 * KB, 1 * MB, None]  # None = auto
+DEFAULT_ALGORITHMS = sorted(FingerPrint._mapper)
+
+
+def legacy_of_file(abspath, algorithm="md5", chunk_size=1024):
+    """
+    The ``of_file`` implementation before the mmap / readinto engine.
+    """
+    m = FingerPrint._mapper[algorithm]()
+    with open(abspath, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            m.update(data)
+    return m.hexdigest()
+
+
+def make_hash_func(strategy, algorithm, chunk_size):
+    """
+    :rtype: typing.Callable[[str], str]
+    """
+    if strategy == "legacy":
+        return lambda path: legacy_of_file(
+            path, algorithm=algorithm, chunk_size=chunk_size or 1024)
+
+    fp = FingerPrint(algorithm)
+    if strategy == "readinto":
+        fp.mmap_threshold = sys.maxsize
+    elif strategy == "mmap":
+        fp.mmap_threshold = 1
+    else:  # pragma: no cover
+        raise ValueError(strategy)
+    return lambda path: fp.of_file(path, chunk_size=chunk_size, use_cache=False)
+
+
+def make_file(dir_path, size):
+    path = os.path.join(dir_path, "bench-{}.bin".format(size))
+    with open(path, "wb") as f:
+        for _ in range(size // MB):
+            f.write(os.urandom(MB))
+        f.write(os.urandom(size % MB))
+    return path
+
+
+def timeit(func, repeat=3):
+    """
+    Return the best elapsed time in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        st = time.time()
+        func()
+        elapse = time.time() - st
+        if best is None or elapse < best:
+            best = elapse
+    return best
+
+
+def result_key(result):
+    return "{size}|{chunk_size}|{algorithm}|{strategy}".format(**result)
+
+
+def run_suite(sizes=None,
+              chunk_sizes=None,
+              algorithms=None,
+              strategies=None,
+              repeat=3,
+              verbose=True):
+    """
+    :rtype: dict
+    :return: ``{"meta": {...}, "results": [...], "best": {...}}``
+    """
+    sizes = sizes or DEFAULT_SIZES
+    chunk_sizes = chunk_sizes or DEFAULT_CHUNK_SIZES
+    algorithms = algorithms or DEFAULT_ALGORITHMS
+    strategies = strategies or STRATEGIES
+
+    results = list()
+    dir_tmp = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            path = make_file(dir_tmp, size)
+            for algorithm in algorithms:
+                expected = FingerPrint(algorithm).of_file(path, use_cache=False)
+                for strategy in strategies:
+                    for chunk_size in chunk_sizes:
+                        func = make_hash_func(strategy, algorithm, chunk_size)
+                        assert func(path) == expected
+                        seconds = timeit(lambda: func(path), repeat=repeat)
+                        result = dict(
+                            size=size,
+                            chunk_size=chunk_size,
+                            algorithm=algorithm,
+                            strategy=strategy,
+                            seconds=seconds,
+                            gbps=size / max(seconds, 1e-9) / 1024 ** 3,
+                        )
+                        results.append(result)
+                        if verbose:
+                            print("{:>8} {:>10} {:>8} {:>8}: {:.3f} GB/s".format(
+                                "{:.1f}MB".format(size / float(MB)),
+                                "auto" if chunk_size is None else chunk_size,
+                                algorithm,
+                                strategy,
+                                result["gbps"],
+                            ))
+            os.remove(path)
+    finally:
+        shutil.rmtree(dir_tmp)
+
+    # the fastest chunk size and strategy for each file size and algorithm
+    best = dict()
+    for result in results:
+        key = "{size}|{algorithm}".format(**result)
+        if key not in best or result["gbps"] > best[key]["gbps"]:
+            best[key] = result
+
+    return dict(
+        meta=dict(
+            time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            machine=platform.machine(),
+            processor=platform.processor(),
+            cpu_count=multiprocessing.cpu_count(),
+            repeat=repeat,
+        ),
+        results=results,
+        best=best,
+    )
+
+
+def find_regressions(report, baseline, tolerance=0.1):
+    """
+    Compare a report with a baseline report, return results whose throughput
+    dropped more than ``tolerance``.
+
+    :rtype: typing.List[typing.Tuple[dict, dict]]
+    :return: list of (baseline result, new result)
+    """
+    baseline_results = {
+        result_key(result): result
+        for result in baseline["results"]
+    }
+    regressions = list()
+    for result in report["results"]:
+        old = baseline_results.get(result_key(result))
+        if old is None:
+            continue
+        if result["gbps"] < old["gbps"] * (1 - tolerance):
+            regressions.append((old, result))
+    return regressions
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    if value.endswith("KB"):
+        return int(value[:-2]) * KB
+    if value.endswith("MB"):
+        return int(value[:-2]) * MB
+    return int(value)
+
+
+def parse_chunk_size(value):
+    if value.strip().lower() == "auto":
+        return None
+    return parse_size(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", nargs="+", type=parse_size)
+    parser.add_argument("--chunk-sizes", nargs="+", type=parse_chunk_size)
+    parser.add_argument("--algorithms", nargs="+", choices=DEFAULT_ALGORITHMS)
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the report to this json file")
+    parser.add_argument("--baseline", help="compare with this json report")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    report = run_suite(
+        sizes=args.sizes,
+        chunk_sizes=args.chunk_sizes,
+        algorithms=args.algorithms,
+        strategies=args.strategies,
+        repeat=args.repeat,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, tolerance=args.tolerance)
+        for old, new in regressions:
+            print("regression {}: {:.3f} GB/s -> {:.3f} GB/s".format(
+                result_key(new), old["gbps"], new["gbps"]))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
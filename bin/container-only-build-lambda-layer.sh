@@ -15,5 +15,16 @@ if [ -e "${dir_build_lambda}/python" ]; then
 fi
 
 pip install -r "${dir_project_root}/requirements.txt" -t "${dir_build_lambda}/python"
-cd "${dir_build_lambda}" || exit
-zip "${dir_build_lambda}/layer.zip" * -r -9 -q -x python/boto3\* python/botocore\* python/s3transfer\* python/setuptools\* python/easy_install.py python/pip\* python/wheel\* python/twine\* python/_pytest\* python/pytest\*;
+excludes=("python/boto3*" "python/botocore*" "python/s3transfer*" "python/setuptools*" "python/easy_install.py" "python/pip*" "python/wheel*" "python/twine*" "python/_pytest*" "python/pytest*")
+# pgr build-lambda-layer copies the zero dependency zipkit.py here, it
+# deflates members with all CPU cores. pygitrepo is not installed in the image.
+if [ -e "${dir_build_lambda}/zipkit.py" ]; then
+    reproducible=()
+    if [ "${AWS_LAMBDA_BUILD_REPRODUCIBLE}" = "true" ]; then
+        reproducible=("--reproducible")
+    fi
+    python "${dir_build_lambda}/zipkit.py" "${dir_build_lambda}/layer.zip" "${dir_build_lambda}/python" -p "python/" -l 9 "${reproducible[@]}" -x "${excludes[@]}"
+else
+    cd "${dir_build_lambda}" || exit
+    zip "${dir_build_lambda}/layer.zip" python -r -9 -q -x "${excludes[@]}"
+fi
@@ -36,4 +36,6 @@ repo_config.read_pygitrepo_config_file()
 # actions.build_lambda_layer(repo_config)
 # actions.upload_lambda_layer(repo_config)
 # actions.deploy_lambda_layer(repo_config)
+# actions.build_lambda_deploy_pkg(repo_config)
+# actions.upload_lambda_deploy_pkg(repo_config)
 # actions.chalice_deploy(repo_config)
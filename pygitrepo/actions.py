@@ -12,13 +12,34 @@ try:
 except ImportError:  # pragma: no cover
     pass
 
+import io
 import os
+import sys
+import json
+import uuid
+import glob
+import shutil
+import tempfile
 import subprocess
 import functools
-from zipfile import ZipFile
+import zipfile
+from collections import OrderedDict
 
 from .pkg.mini_six import input
-from .pkg.fingerprint import fingerprint
+from .pkg.fingerprint import (
+    FingerPrint, FingerPrintCache, Digest,
+    HashingWriter, sidecar_path, read_sidecar,
+)
+from .pkg.chunkstore import ChunkStore, LocalDirBackend
+from .pkg.importgraph import ImportGraph, module_name_of
+from .pkg.s3stream import StreamingUpload, TeeWriter, Boto3Target, LocalDirTarget
+from .pkg import pycompile, zipkit
+from .pkg.importtime import profile_import, find_module, heaviest, format_tree
+from .pkg.zipkit import (
+    build_zip, compare_policies, zip_report, splice_zips, strip_layer_prefix,
+    CompressionPolicy,
+    ZIP_STORED, ZIP_BZIP2, ZIP_LZMA,
+)
 from .repo_config import RepoConfig
 from .operation_system import (
     IS_WINDOWS, IS_MACOS, IS_LINUX,
@@ -39,6 +60,17 @@ from .color_print import (
     pgr_print, pgr_print_done, print_path, print_line, colorful_path,
 )
 
+# https://docs.aws.amazon.com/lambda/latest/dg/gettingstarted-limits.html
+LAMBDA_ZIPPED_SIZE_LIMIT = 50 * 1024 * 1024
+LAMBDA_UNZIPPED_SIZE_LIMIT = 250 * 1024 * 1024
+
+# a module taking more than this share of the handler import time is flagged
+IMPORT_TIME_HEAVY_RATIO = 0.1
+
+# large build artifacts are hashed by upload and deploy steps again and again,
+# cache the digest of unchanged files in ``~/.cache/pygitrepo``
+fingerprint = FingerPrint(cache=FingerPrintCache())
+
 
 def subcommand(
     name=None,
@@ -902,30 +934,672 @@ class Actions(object):
             )
         )
 
-        # filter all python source code need to add to the zip
+        to_zip_list = self._lambda_source_to_zip_list(config)
+
+        if _dry_run is False:
+            self._write_lambda_source_zip(config, to_zip_list)
+
+        pgr_print_done(indent=1)
+
+    def _write_lambda_source_zip(self, config, to_zip_list, upload=None, keep_local=True):
+        """
+        Build the lambda source zip to ``path_lambda_build_source``, and / or
+        stream it to an upload.
+
+        :type config: RepoConfig
+        :type to_zip_list: typing.List[typing.Tuple[str, str]]
+        :type upload: StreamingUpload
+        :type keep_local: bool
+        :param keep_local: write the zip to disk. If False, the zip already
+            on disk, if any, is left as it is.
+        :rtype: HashingWriter
+        :return: the digests of the zip
+        """
+        makedir_if_not_exists(config.dir_lambda_build)
+        dir_pycache = tempfile.mkdtemp(prefix="pgr-pycache-")
+        try:
+            if config.AWS_LAMBDA_BUILD_PRECOMPILE.get_value():
+                to_zip_list = to_zip_list + self._precompile_lambda_source(
+                    config, to_zip_list, dir_pycache)
+            return self._write_lambda_source_zip_members(
+                config, to_zip_list, upload=upload, keep_local=keep_local)
+        finally:
+            shutil.rmtree(dir_pycache, ignore_errors=True)
+
+    def _write_lambda_source_zip_members(self, config, to_zip_list, upload, keep_local):
+        """
+        The part of :meth:`_write_lambda_source_zip` after precompile.
+
+        :rtype: HashingWriter
+        """
+        # members of unchanged files are copied from the previous build
+        # as they are, only new or changed files are compressed. Without a
+        # new local zip the existing one is only read, it stays as it is
+        if keep_local:
+            path_previous = config.path_lambda_build_source + ".previous"
+            remove_if_exists(path_previous)
+            if os.path.exists(config.path_lambda_build_source):
+                os.rename(config.path_lambda_build_source, path_previous)
+            remove_if_exists(sidecar_path(config.path_lambda_build_source))
+        else:
+            path_previous = config.path_lambda_build_source
+
+        # fingerprint the zip while it is written, so upload doesn't
+        # need to read it again
+        f_out = None
+        try:
+            if keep_local:
+                f_out = io.open(config.path_lambda_build_source, "wb")
+            sinks = [sink for sink in [f_out, upload] if sink is not None]
+            writer = HashingWriter(TeeWriter(sinks), ["md5", "sha256"], s3_etag=True)
+            stats = build_zip(
+                writer, to_zip_list,
+                previous=path_previous,
+                reproducible=config.AWS_LAMBDA_BUILD_REPRODUCIBLE.get_value(),
+                policy=self._lambda_compression_policy(config),
+            )
+        finally:
+            if f_out is not None:
+                f_out.close()
+            if keep_local:
+                remove_if_exists(path_previous)
+        if keep_local:
+            writer.write_sidecar(config.path_lambda_build_source)
+        pgr_print(
+            "{tab}{n_reused} files reused from the previous build, "
+            "{n_compressed} files compressed".format(tab=TAB, **stats)
+        )
+        return writer
+
+    def _lambda_upload_target(self, config, bucket):
+        """
+        Where :meth:`build_upload_lambda_source_code` streams the zip to.
+        A ``file://`` ``AWS_LAMBDA_S3_ENDPOINT_URL`` is a local directory,
+        otherwise a boto3 S3 client is used.
+
+        :type config: RepoConfig
+        :type bucket: str
+        :return: None if boto3 is not installed.
+        """
+        endpoint_url = config.AWS_LAMBDA_S3_ENDPOINT_URL.get_value()
+        if endpoint_url and endpoint_url.startswith("file://"):
+            return LocalDirTarget(os.path.join(endpoint_url[len("file://"):], bucket))
+        try:
+            import boto3
+        except ImportError:
+            return None
+        session = boto3.session.Session(
+            profile_name=config.AWS_LAMBDA_DEPLOY_AWS_PROFILE.get_value())
+        return Boto3Target(session.client("s3", endpoint_url=endpoint_url), bucket)
+
+    @subcommand(
+        help="Build AWS Lambda source code zip and stream it to S3 while it is built.",
+    )
+    def build_upload_lambda_source_code(self, config, _dry_run=False, **kwargs):
+        """
+        :type config: RepoConfig
+        """
+        bucket, prefix = split_s3_uri(config.s3_uri_lambda_deploy_versioned_source_dir)
+        target = self._lambda_upload_target(config, bucket)
+        if target is None:
+            pgr_print(
+                "{yellow}boto3 is not installed, build then upload{reset}".format(
+                    yellow=Fore.YELLOW,
+                    reset=Style.RESET_ALL,
+                )
+            )
+            self.build_lambda_source_code(config, _dry_run=_dry_run, **kwargs)
+            self.upload_lambda_source_code(config, _dry_run=_dry_run, **kwargs)
+            return
+
+        pgr_print(
+            "{cyan}build lambda source code and stream it to {reset}{s3_uri}".format(
+                cyan=Fore.CYAN,
+                reset=Style.RESET_ALL,
+                s3_uri=config.s3_uri_lambda_deploy_versioned_source_dir,
+            )
+        )
+        to_zip_list = self._lambda_source_to_zip_list(config)
+        if _dry_run is False:
+            # the final key is the md5 of the zip, parts go to a staging key
+            # until the zip is complete
+            upload = StreamingUpload(target, s3_key_smart_join(
+                parts=[prefix, "staging", "{}.zip".format(uuid.uuid4().hex)],
+                is_dir=False,
+            ))
+            try:
+                writer = self._write_lambda_source_zip(
+                    config, to_zip_list,
+                    upload=upload,
+                    keep_local=config.AWS_LAMBDA_BUILD_KEEP_LOCAL_ZIP.get_value(),
+                )
+            except Exception:
+                upload.abort()
+                raise
+            digests = writer.digests
+            key = s3_key_smart_join(
+                parts=[prefix, "{}.zip".format(digests["md5"].hex)],
+                is_dir=False,
+            )
+            uploaded = upload.commit(
+                key,
+                metadata={"code-sha256": digests["sha256"].b64},
+                etag=writer.s3_etag,
+            )
+            pgr_print(
+                "{cyan}{tab}{action} {reset}{s3_uri}{cyan}, {n_parts} parts streamed, "
+                "CodeSha256 = {reset}{code_sha256}".format(
+                    cyan=Fore.CYAN,
+                    tab=TAB,
+                    reset=Style.RESET_ALL,
+                    action="uploaded to" if uploaded else "already uploaded to",
+                    s3_uri=join_s3_uri(bucket, key),
+                    n_parts=upload.n_parts,
+                    code_sha256=digests["sha256"].b64,
+                )
+            )
+        pgr_print_done(indent=1)
+
+    def _lambda_source_to_zip_list(self, config):
+        """
+        Find all python source code need to add to the lambda source zip,
+        files ignored by ``.pgrignore`` and ``IGNORE_PATTERNS`` are skipped.
+
+        :type config: RepoConfig
+        :rtype: typing.List[typing.Tuple[str, str]]
+        :return: (source path, archive path) pairs
+        """
         to_zip_list = list()
-        for dirname, _, basename_list in os.walk(config.dir_python_lib):
-            # ignore __pycache__
-            if dirname.endswith("__pycache__"):
+        archive_dir = os.path.relpath(config.dir_python_lib, config.dir_project_root)
+        # excluded sub directories are pruned
+        for relpath in config.ignore_matcher.walk(config.dir_python_lib, persist=True):
+            parts = relpath.split("/")
+            to_zip_list.append((
+                os.path.join(config.dir_python_lib, *parts),
+                os.path.join(archive_dir, *parts),
+            ))
+        if config.AWS_LAMBDA_BUILD_TREE_SHAKE.get_value():
+            to_zip_list = self._tree_shake_lambda_source(config, to_zip_list)
+        return to_zip_list
+
+    def _tree_shake_lambda_source(self, config, to_zip_list):
+        """
+        Remove the package modules the lambda handlers never import.
+
+        :type config: RepoConfig
+        :type to_zip_list: typing.List[typing.Tuple[str, str]]
+        :rtype: typing.List[typing.Tuple[str, str]]
+        """
+        graph = ImportGraph.from_dir(
+            config.dir_project_root,
+            config.PACKAGE_NAME.get_value(),
+            relpath_list=[
+                archive_path.replace(os.sep, "/")
+                for _, archive_path in to_zip_list
+            ],
+        )
+        entry_modules, entry_files = list(), list()
+        for handler in config.AWS_LAMBDA_HANDLER_MODULES.get_value() \
+                or [os.path.relpath(config.path_aws_chalice_app_py, config.dir_project_root)]:
+            if handler.endswith(".py"):
+                entry_files.append(os.path.join(config.dir_project_root, handler))
+            else:
+                entry_modules.append(handler)
+        reachable = graph.reachable(
+            entry_modules=entry_modules,
+            entry_files=entry_files,
+            allowlist=config.AWS_LAMBDA_BUILD_KEEP_MODULES.get_value() or [],
+        )
+        shaken_list = [
+            (source_path, archive_path)
+            for source_path, archive_path in to_zip_list
+            if (not archive_path.endswith(".py"))
+            or (module_name_of(archive_path.replace(os.sep, "/")) in reachable)
+        ]
+        pgr_print(
+            "{tab}tree shaking keeps {n_reachable} of {n_modules} modules".format(
+                tab=TAB,
+                n_reachable=len(reachable),
+                n_modules=len(graph.modules),
+            )
+        )
+        if not reachable:
+            pgr_print(
+                "{tab}{yellow}the lambda handlers don't import any module of "
+                "the package, check AWS_LAMBDA_HANDLER_MODULES{reset}".format(
+                    tab=TAB,
+                    yellow=Fore.YELLOW,
+                    reset=Style.RESET_ALL,
+                )
+            )
+        return shaken_list
+
+    def _lambda_precompile_python(self, config):
+        """
+        Find a python interpreter that has the same major and minor version
+        as the lambda runtime, pyc from other version can't be loaded.
+
+        :type config: RepoConfig
+        :rtype: str
+        :return: path to the interpreter, None if not found
+        """
+        target = "{}.{}".format(
+            config.DEV_PY_VER_MAJOR.get_value(),
+            config.DEV_PY_VER_MINOR.get_value(),
+        )
+        if "{}.{}".format(*sys.version_info[:2]) == target:
+            return sys.executable
+        for python in [config.path_venv_bin_python, config.path_bin_global_python]:
+            try:
+                version = subprocess.check_output([
+                    python, "-c",
+                    "import sys; print('{}.{}'.format(*sys.version_info[:2]))",
+                ]).decode("utf-8").strip()
+            except Exception:
                 continue
-            for basename in basename_list:
-                # ignore .pyc, .pyo,
-                if basename.endswith(".pyc") or basename.endswith(".pyo"):
-                    continue
-                source_path = os.path.join(dirname, basename)
-                archive_path = os.path.relpath(source_path, config.dir_project_root)
-                to_zip_list.append((source_path, archive_path))
+            if version == target:
+                return python
+        return None
+
+    def _run_pycompile(self, python, *args, **kwargs):
+        """
+        Run the :mod:`pygitrepo.pkg.pycompile` script with another python.
+
+        :type python: str
+        :rtype: str
+        :return: stdout
+        """
+        script = os.path.splitext(pycompile.__file__)[0] + ".py"
+        p = subprocess.Popen(
+            [python, script] + list(args),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        stdout, _ = p.communicate(kwargs.get("stdin", b""))
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, script)
+        return stdout.decode("utf-8")
+
+    def _precompile_lambda_source(self, config, to_zip_list, dir_pycache):
+        """
+        Byte compile the ``.py`` files of the lambda source in parallel.
+
+        :type config: RepoConfig
+        :type to_zip_list: typing.List[typing.Tuple[str, str]]
+        :type dir_pycache: str
+        :param dir_pycache: a temp dir to write pyc to, the caller removes it.
+        :rtype: typing.List[typing.Tuple[str, str]]
+        :return: (pyc path, pyc archive path) pairs, empty if there is no
+            python of the lambda runtime version.
+        """
+        python = self._lambda_precompile_python(config)
+        if python is None:
+            pgr_print(
+                "{tab}{yellow}no python{major}.{minor} found, skip precompile{reset}".format(
+                    tab=TAB,
+                    yellow=Fore.YELLOW,
+                    reset=Style.RESET_ALL,
+                    major=config.DEV_PY_VER_MAJOR.get_value(),
+                    minor=config.DEV_PY_VER_MINOR.get_value(),
+                )
+            )
+            return []
+        to_compile_list = [
+            (source_path, archive_path.replace(os.sep, "/"))
+            for source_path, archive_path in to_zip_list
+            if source_path.endswith(".py")
+        ]
+        stdout = self._run_pycompile(
+            python, "compile", dir_pycache,
+            stdin=json.dumps(to_compile_list).encode("utf-8"),
+        )
+        pyc_list = [tuple(pair) for pair in json.loads(stdout)]
+        pgr_print("{tab}{n} files precompiled by {python}".format(
+            tab=TAB, n=len(pyc_list), python=python,
+        ))
+        return pyc_list
 
+    @subcommand(
+        help="Compare the cold start import time of lambda source with and without precompiled pyc.",
+    )
+    def report_lambda_cold_start(self, config, _dry_run=False, **kwargs):
+        """
+        :type config: RepoConfig
+        """
+        pgr_print(
+            "{cyan}compare cold start import time of {reset}{package}".format(
+                cyan=Fore.CYAN,
+                reset=Style.RESET_ALL,
+                package=config.PACKAGE_NAME.get_value(),
+            )
+        )
         if _dry_run is False:
-            makedir_if_not_exists(config.dir_lambda_build)
-            remove_if_exists(config.path_lambda_build_source)
+            to_zip_list = self._lambda_source_to_zip_list(config)
+            dir_tmp = tempfile.mkdtemp(prefix="pgr-cold-start-")
+            try:
+                pyc_list = self._precompile_lambda_source(
+                    config, to_zip_list, os.path.join(dir_tmp, "pycache"))
+                results = list()
+                if pyc_list:
+                    python = self._lambda_precompile_python(config)
+                    for name, file_list in [
+                        ("source", to_zip_list),
+                        ("precompiled", to_zip_list + pyc_list),
+                    ]:
+                        # lay out the files the same way lambda extracts the zip
+                        dir_extract = os.path.join(dir_tmp, name)
+                        for source_path, archive_path in file_list:
+                            target_path = os.path.join(dir_extract, archive_path)
+                            makedir_if_not_exists(os.path.dirname(target_path))
+                            shutil.copyfile(source_path, target_path)
+                        seconds = float(self._run_pycompile(
+                            python, "import-time",
+                            dir_extract, config.PACKAGE_NAME.get_value(),
+                        ))
+                        results.append((name, seconds))
+            finally:
+                shutil.rmtree(dir_tmp, ignore_errors=True)
+            for name, seconds in results:
+                pgr_print(
+                    "{tab}{cyan}{name:<12}{reset}{ms:8.1f} ms".format(
+                        tab=TAB,
+                        cyan=Fore.CYAN,
+                        reset=Style.RESET_ALL,
+                        name=name,
+                        ms=seconds * 1000,
+                    )
+                )
+        pgr_print_done(indent=1)
 
-            with ZipFile(config.path_lambda_build_source, "w") as f:
-                for source_path, archive_path in to_zip_list:
-                    f.write(source_path, archive_path)
+    @subcommand(
+        help="Profile the import time of lambda handlers from the built source and layer zip.",
+    )
+    def report_lambda_import_time(self, config, _dry_run=False, **kwargs):
+        """
+        :type config: RepoConfig
+        """
+        pgr_print(
+            "{cyan}profile lambda handler import time with {reset}{python}".format(
+                cyan=Fore.CYAN,
+                reset=Style.RESET_ALL,
+                python=config.path_venv_bin_python,
+            )
+        )
+        for path in [config.path_venv_bin_python, config.path_lambda_build_source]:
+            if not os.path.exists(path):
+                pgr_print(
+                    "{red}{tab}{path} {cyan}not found!".format(
+                        tab=TAB,
+                        red=Fore.RED,
+                        cyan=Fore.CYAN,
+                        path=path,
+                    )
+                )
+                return
+        if not os.path.exists(config.path_lambda_build_layer):
+            pgr_print(
+                "{yellow}{tab}{path} not found, dependencies are imported "
+                "from the virtualenv{reset}".format(
+                    yellow=Fore.YELLOW,
+                    tab=TAB,
+                    reset=Style.RESET_ALL,
+                    path=config.path_lambda_build_layer,
+                )
+            )
 
+        if _dry_run is False:
+            # lambda extracts the source zip to /var/task and layers to /opt
+            dir_tmp = tempfile.mkdtemp(prefix="pgr-lambda-")
+            try:
+                dir_task = os.path.join(dir_tmp, "var", "task")
+                dir_opt = os.path.join(dir_tmp, "opt")
+                for path, dir_extract in [
+                    (config.path_lambda_build_source, dir_task),
+                    (config.path_lambda_build_layer, dir_opt),
+                ]:
+                    makedir_if_not_exists(dir_extract)
+                    if os.path.exists(path):
+                        with zipfile.ZipFile(path) as f:
+                            f.extractall(dir_extract)
+                sys_path_dirs = [dir_task] \
+                    + sorted(glob.glob(os.path.join(
+                        dir_opt, "python", "lib", "python*", "site-packages"))) \
+                    + [os.path.join(dir_opt, "python")]
+
+                for module in self._lambda_handler_modules(config, dir_task):
+                    self._report_import_time(config, sys_path_dirs, module)
+            finally:
+                shutil.rmtree(dir_tmp, ignore_errors=True)
         pgr_print_done(indent=1)
 
+    def _lambda_handler_modules(self, config, dir_task):
+        """
+        Module names of the lambda handlers, handler scripts like
+        ``lambda_app/app.py`` are copied to the root of ``dir_task``.
+
+        :type config: RepoConfig
+        :type dir_task: str
+        :rtype: typing.List[str]
+        """
+        modules = list()
+        for handler in config.AWS_LAMBDA_HANDLER_MODULES.get_value() \
+                or [os.path.relpath(config.path_aws_chalice_app_py, config.dir_project_root)]:
+            if handler.endswith(".py"):
+                basename = os.path.basename(handler)
+                shutil.copyfile(
+                    os.path.join(config.dir_project_root, handler),
+                    os.path.join(dir_task, basename),
+                )
+                modules.append(basename[:-len(".py")])
+            else:
+                modules.append(handler)
+        return modules
+
+    def _report_import_time(self, config, sys_path_dirs, module):
+        """
+        :type config: RepoConfig
+        :type sys_path_dirs: typing.List[str]
+        :type module: str
+        """
+        try:
+            roots = profile_import(config.path_venv_bin_python, sys_path_dirs, module)
+        except subprocess.CalledProcessError as e:
+            pgr_print(
+                "{red}{tab}failed to import {reset}{module}{red}:{reset}\n{error}".format(
+                    red=Fore.RED,
+                    tab=TAB,
+                    reset=Style.RESET_ALL,
+                    module=module,
+                    error="\n".join(e.output.strip().splitlines()[-5:]),
+                )
+            )
+            return
+        node = find_module(roots, module)
+        if node is None:
+            pgr_print(
+                "{yellow}{tab}no import time of {reset}{module}{yellow}, "
+                "-X importtime requires Python3.7+{reset}".format(
+                    yellow=Fore.YELLOW,
+                    tab=TAB,
+                    reset=Style.RESET_ALL,
+                    module=module,
+                )
+            )
+            return
+
+        pgr_print(
+            "{cyan}{tab}import {reset}{module}{cyan} takes {reset}{ms:.1f} ms".format(
+                cyan=Fore.CYAN,
+                tab=TAB,
+                reset=Style.RESET_ALL,
+                module=module,
+                ms=node.cumulative_us / 1000.0,
+            )
+        )
+        pgr_print("{tab}{:>13} {:>13}  module".format("cumulative", "self", tab=TAB))
+        # modules taking less than 1% are hidden
+        for line in format_tree([node], min_us=node.cumulative_us // 100):
+            pgr_print("{tab}{line}".format(tab=TAB, line=line))
+
+        pgr_print("{cyan}{tab}heaviest modules by self time:".format(cyan=Fore.CYAN, tab=TAB))
+        for heavy in heaviest([node], top=10):
+            is_heavy = heavy.self_us >= node.cumulative_us * IMPORT_TIME_HEAVY_RATIO
+            pgr_print(
+                "{tab}{color}{ms:>10.1f} ms {percent:>5.1f}%  {name}{reset}".format(
+                    tab=TAB,
+                    color=Fore.RED if is_heavy else "",
+                    reset=Style.RESET_ALL,
+                    ms=heavy.self_us / 1000.0,
+                    percent=100.0 * heavy.self_us / max(node.cumulative_us, 1),
+                    name=heavy.name,
+                )
+            )
+
+    def _lambda_compression_policy(self, config):
+        """
+        :type config: RepoConfig
+        :rtype: CompressionPolicy
+        """
+        policy_config = config.AWS_LAMBDA_BUILD_COMPRESSION_POLICY.get_value()
+        if policy_config is None:
+            return CompressionPolicy.default_policy()
+        return CompressionPolicy.from_config(policy_config)
+
+    @subcommand(
+        help="Compare the build time and size of lambda source zip with different compression policies.",
+    )
+    def report_lambda_compression(self, config, _dry_run=False, **kwargs):
+        """
+        :type config: RepoConfig
+        """
+        pgr_print(
+            "{cyan}compare compression policies on {reset}{path}".format(
+                cyan=Fore.CYAN,
+                reset=Style.RESET_ALL,
+                path=config.dir_python_lib,
+            )
+        )
+        to_zip_list = self._lambda_source_to_zip_list(config)
+        policies = OrderedDict([
+            ("configured", self._lambda_compression_policy(config)),
+            ("stored", CompressionPolicy(default=(ZIP_STORED, None))),
+            ("deflate-1", CompressionPolicy.default_policy(compresslevel=1)),
+            ("deflate-6", CompressionPolicy.default_policy(compresslevel=6)),
+            ("deflate-9", CompressionPolicy.default_policy(compresslevel=9)),
+        ])
+        for name, compress_type in [("bzip2", ZIP_BZIP2), ("lzma", ZIP_LZMA)]:
+            try:
+                policies[name] = CompressionPolicy(default=(compress_type, None))
+            except RuntimeError:  # pragma: no cover
+                pass
+        if _dry_run is False:
+            for result in compare_policies(to_zip_list, policies):
+                pgr_print(
+                    "{tab}{cyan}{name:<12}{reset}{seconds:8.3f} sec {size:>12,} bytes {ratio:7.1%}".format(
+                        tab=TAB,
+                        cyan=Fore.CYAN,
+                        reset=Style.RESET_ALL,
+                        **result
+                    )
+                )
+        pgr_print_done(indent=1)
+
+    @subcommand(
+        help="Report where the bytes of lambda source and layer zip come from.",
+    )
+    def lambda_report(self, config, _dry_run=False, **kwargs):
+        """
+        :type config: RepoConfig
+        """
+        pgr_print(
+            "{cyan}report lambda artifacts composition to {reset}{path}".format(
+                cyan=Fore.CYAN,
+                reset=Style.RESET_ALL,
+                path=config.path_lambda_build_report,
+            )
+        )
+        reports = OrderedDict()
+        for name, path in [
+            ("source", config.path_lambda_build_source),
+            ("layer", config.path_lambda_build_layer),
+        ]:
+            if os.path.exists(path):
+                reports[name] = zip_report(path)
+            else:
+                pgr_print("{tab}{path} not found, skip".format(tab=TAB, path=path))
+
+        total_file_size = sum(report["file_size"] for report in reports.values())
+        for name, report in reports.items():
+            pgr_print(
+                "{tab}{cyan}{name}{reset}: {n_members} files, {size:,} bytes zipped "
+                "({zipped:.1%} of the limit), {file_size:,} bytes unzipped".format(
+                    tab=TAB,
+                    cyan=Fore.CYAN,
+                    reset=Style.RESET_ALL,
+                    name=name,
+                    zipped=float(report["size"]) / LAMBDA_ZIPPED_SIZE_LIMIT,
+                    **report
+                )
+            )
+            for title, key in [
+                ("package", "by_package"),
+                ("file type", "by_file_type"),
+                ("file", "largest"),
+            ]:
+                pgr_print(
+                    "{tab}{tab}largest by {title} (zipped, unzipped bytes):".format(
+                        tab=TAB, title=title,
+                    )
+                )
+                for group in report[key][:10]:
+                    pgr_print(
+                        "{tab}{tab}{tab}{compress_size:>14,} {file_size:>14,}  {name}".format(
+                            tab=TAB, **group
+                        )
+                    )
+        pgr_print(
+            "{tab}{file_size:,} bytes unzipped in total, "
+            "{unzipped:.1%} of the {limit} MB limit".format(
+                tab=TAB,
+                file_size=total_file_size,
+                unzipped=float(total_file_size) / LAMBDA_UNZIPPED_SIZE_LIMIT,
+                limit=LAMBDA_UNZIPPED_SIZE_LIMIT // (1024 * 1024),
+            )
+        )
+
+        if _dry_run is False and reports:
+            with io.open(config.path_lambda_build_report, "wb") as f:
+                f.write(json.dumps(
+                    OrderedDict([
+                        ("package_name", config.PACKAGE_NAME.get_value()),
+                        ("package_version", config.package_version),
+                        ("unzipped_size_limit", LAMBDA_UNZIPPED_SIZE_LIMIT),
+                        ("zipped_size_limit", LAMBDA_ZIPPED_SIZE_LIMIT),
+                        ("artifacts", reports),
+                    ]),
+                    indent=4,
+                ).encode("utf-8"))
+        pgr_print_done(indent=1)
+
+    def _lambda_zip_digests(self, path):
+        """
+        Compute all digests the deploy steps need in one pass over the zip.
+
+        - ``md5``: hex digest is the S3 object name.
+        - ``sha256``: base64 digest is the AWS Lambda ``CodeSha256``.
+
+        Digests recorded by the build step are used if the zip didn't change.
+
+        :type path: str
+        :rtype: typing.Dict[str, pygitrepo.pkg.fingerprint.Digest]
+        """
+        recorded = read_sidecar(path)
+        if recorded is not None and ("md5" in recorded) and ("sha256" in recorded):
+            return {
+                "md5": Digest.from_hex(recorded["md5"]),
+                "sha256": Digest.from_hex(recorded["sha256"]),
+            }
+        return fingerprint.of_file_multi(path, ["md5", "sha256"])
+
     def _upload_lambda_zip(
         self,
         config,
@@ -936,7 +1610,7 @@ class Actions(object):
     ):
         """
         :type config: RepoConfig
-        :param source_or_layer: "source code" or "layer"
+        :param source_or_layer: "source code", "layer" or "deployment package"
         """
         pgr_print(
             "{cyan}upload lambda {source_or_layer} from {reset}{path} {cyan}to AWS S3".format(
@@ -950,34 +1624,52 @@ class Actions(object):
             s3_uri_lambda_deploy_versioned_dir = config.s3_uri_lambda_deploy_versioned_source_dir
         elif source_or_layer == "layer":
             s3_uri_lambda_deploy_versioned_dir = config.s3_uri_lambda_deploy_versioned_layer_dir
+        elif source_or_layer == "deployment package":
+            s3_uri_lambda_deploy_versioned_dir = config.s3_uri_lambda_deploy_versioned_deploy_pkg_dir
         else:
             raise ValueError
 
         if os.path.exists(path):
-            source_md5 = fingerprint.of_file(path)
+            digests = self._lambda_zip_digests(path)
             bucket, prefix = split_s3_uri(s3_uri_lambda_deploy_versioned_dir)
             key = s3_key_smart_join(
-                parts=[prefix, "{}.zip".format(source_md5)],
+                parts=[prefix, "{}.zip".format(digests["md5"].hex)],
                 is_dir=False,
             )
             s3_uri = join_s3_uri(bucket, key)
             pgr_print(
-                "{cyan}{tab}upload to {reset}{s3_uri}".format(
+                "{cyan}{tab}upload to {reset}{s3_uri}{cyan}, CodeSha256 = {reset}{code_sha256}".format(
                     cyan=Fore.CYAN,
                     tab=TAB,
                     reset=Style.RESET_ALL,
                     s3_uri=s3_uri,
+                    code_sha256=digests["sha256"].b64,
                 )
             )
+            # the key is the md5 of the zip, the same key with the same ETag
+            # means the same artifact is already uploaded
+            if _dry_run is False \
+                    and self._get_s3_etag(config, s3_uri) == self._local_s3_etag(path):
+                pgr_print(
+                    "{cyan}{tab}already uploaded, skip".format(
+                        cyan=Fore.CYAN,
+                        tab=TAB,
+                    )
+                )
+                pgr_print_done(indent=1)
+                return
+
             args = [
                 "aws", "s3", "cp",
                 path, s3_uri,
+                "--metadata", "code-sha256={}".format(digests["sha256"].b64),
             ]
             aws_profile = config.AWS_LAMBDA_DEPLOY_AWS_PROFILE.get_value()
             if aws_profile is not None:
                 args.extend(["--profile", aws_profile])
             if _dry_run is False:
                 subprocess.call(args)
+                self._verify_s3_etag(config, path, s3_uri)
             pgr_print_done(indent=1)
         else:
             pgr_print(
@@ -989,6 +1681,89 @@ class Actions(object):
                 )
             )
 
+    def _get_s3_etag(self, config, s3_uri):
+        """
+        :type config: RepoConfig
+        :type s3_uri: str
+        :rtype: str
+        :return: the ETag of a S3 object, None if it doesn't exist or we
+            cannot get it.
+        """
+        bucket, key = split_s3_uri(s3_uri)
+        args = [
+            "aws", "s3api", "head-object",
+            "--bucket", bucket,
+            "--key", key,
+            "--query", "ETag",
+            "--output", "text",
+        ]
+        aws_profile = config.AWS_LAMBDA_DEPLOY_AWS_PROFILE.get_value()
+        if aws_profile is not None:
+            args.extend(["--profile", aws_profile])
+        try:
+            with open(os.devnull, "w") as devnull:
+                return subprocess.check_output(args, stderr=devnull) \
+                    .decode("utf-8").strip().strip('"')
+        except (subprocess.CalledProcessError, OSError):
+            return None
+
+    def _local_s3_etag(self, path):
+        """
+        The S3 ETag of a local zip, recorded by the build step if possible.
+
+        :type path: str
+        :rtype: str
+        """
+        recorded = read_sidecar(path)
+        if recorded is not None and ("s3_etag" in recorded):
+            return recorded["s3_etag"]
+        return fingerprint.of_file_s3_etag(path)
+
+    def _verify_s3_etag(self, config, path, s3_uri):
+        """
+        Compare the ETag of the uploaded S3 object with the ETag computed
+        from the local file, so we know the upload is good without
+        downloading it. It assumes the default ``aws s3 cp`` multipart
+        settings (8MB threshold and part size).
+
+        :type config: RepoConfig
+        :type path: str
+        :type s3_uri: str
+        """
+        remote_etag = self._get_s3_etag(config, s3_uri)
+        if remote_etag is None:
+            pgr_print(
+                "{yellow}{tab}cannot get the ETag of {reset}{s3_uri}".format(
+                    yellow=Fore.YELLOW,
+                    tab=TAB,
+                    reset=Style.RESET_ALL,
+                    s3_uri=s3_uri,
+                )
+            )
+            return
+        local_etag = self._local_s3_etag(path)
+        if remote_etag == local_etag:
+            pgr_print(
+                "{cyan}{tab}verified, S3 ETag matches local file {reset}{etag}".format(
+                    cyan=Fore.CYAN,
+                    tab=TAB,
+                    reset=Style.RESET_ALL,
+                    etag=local_etag,
+                )
+            )
+        else:
+            pgr_print(
+                "{yellow}{tab}S3 ETag {reset}{remote_etag} {yellow}doesn't match "
+                "local file {reset}{local_etag}{yellow}, the upload may be "
+                "corrupted or used non default multipart settings".format(
+                    yellow=Fore.YELLOW,
+                    tab=TAB,
+                    reset=Style.RESET_ALL,
+                    remote_etag=remote_etag,
+                    local_etag=local_etag,
+                )
+            )
+
     @subcommand(
         help="Upload AWS Lambda source code zip file to S3.",
     )
@@ -1004,6 +1779,65 @@ class Actions(object):
             **kwargs
         )
 
+    @subcommand(
+        help="Combine AWS Lambda layer zip and source code zip into one deployment package.",
+    )
+    def build_lambda_deploy_pkg(self, config, _dry_run=False, **kwargs):
+        """
+        :type config: RepoConfig
+        """
+        pgr_print(
+            "{cyan}build lambda deployment package at {reset}{path}".format(
+                cyan=Fore.CYAN,
+                reset=Style.RESET_ALL,
+                path=config.path_lambda_build_deploy_package,
+            )
+        )
+        if not os.path.exists(config.path_lambda_build_layer):
+            pgr_print(
+                "{red}{tab}{path} {cyan}not found! run build-lambda-layer first".format(
+                    tab=TAB,
+                    red=Fore.RED,
+                    cyan=Fore.CYAN,
+                    path=config.path_lambda_build_layer,
+                )
+            )
+            return
+        # unchanged source files are reused from the previous build
+        self.build_lambda_source_code(config, _dry_run=_dry_run, **kwargs)
+
+        if _dry_run is False:
+            # members are copied as they are, nothing is compressed again,
+            # source code wins over a dependency of the same path
+            remove_if_exists(sidecar_path(config.path_lambda_build_deploy_package))
+            with io.open(config.path_lambda_build_deploy_package, "wb") as f:
+                writer = HashingWriter(f, ["md5", "sha256"], s3_etag=True)
+                stats = splice_zips(writer, [
+                    (config.path_lambda_build_layer, strip_layer_prefix),
+                    (config.path_lambda_build_source, None),
+                ])
+            writer.write_sidecar(config.path_lambda_build_deploy_package)
+            pgr_print(
+                "{tab}{n_members} files, {n_overridden} dependency files "
+                "overridden by source code".format(tab=TAB, **stats)
+            )
+        pgr_print_done(indent=1)
+
+    @subcommand(
+        help="Upload AWS Lambda deployment package zip file to S3.",
+    )
+    def upload_lambda_deploy_pkg(self, config, _dry_run=False, **kwargs):
+        """
+        :type config: RepoConfig
+        """
+        self._upload_lambda_zip(
+            config,
+            source_or_layer="deployment package",
+            path=config.path_lambda_build_deploy_package,
+            _dry_run=_dry_run,
+            **kwargs
+        )
+
     def _find_docker(self):
         """
         Find the absolute path of the docker executable
@@ -1047,15 +1881,23 @@ class Actions(object):
         )
 
         if _dry_run is False:
+            # pygitrepo is not installed in the container, zipkit has no
+            # dependency, the container script runs a copy of it
+            path_zipkit = os.path.join(config.dir_lambda_build, "zipkit.py")
+            shutil.copyfile(os.path.splitext(zipkit.__file__)[0] + ".py", path_zipkit)
             subprocess.call([
                 path_bin_docker, "run",
                 "-v", "{}:{}".format(
                     config.dir_project_root,
                     config.AWS_LAMBDA_BUILD_DOCKER_IMAGE_WORKSPACE_DIR.get_value(),
                 ),
+                "-e", "AWS_LAMBDA_BUILD_REPRODUCIBLE={}".format(
+                    "true" if config.AWS_LAMBDA_BUILD_REPRODUCIBLE.get_value() else "false"
+                ),
                 "--rm", config.AWS_LAMBDA_BUILD_DOCKER_IMAGE.get_value(),
                 "bash", container_only_build_lbd_layer_script_path,
             ])
+            remove_if_exists(path_zipkit)
 
     @subcommand(
         help="Upload AWS Lambda layer zip file to S3.",
@@ -1086,10 +1928,10 @@ class Actions(object):
             )
         )
         if os.path.exists(config.path_lambda_build_layer):
-            source_md5 = fingerprint.of_file(config.path_lambda_build_layer)
+            digests = self._lambda_zip_digests(config.path_lambda_build_layer)
             bucket, prefix = split_s3_uri(config.s3_uri_lambda_deploy_versioned_layer_dir)
             key = s3_key_smart_join(
-                parts=[prefix, "{}.zip".format(source_md5)],
+                parts=[prefix, "{}.zip".format(digests["md5"].hex)],
                 is_dir=False,
             )
             s3_console_url = make_s3_console_url(bucket=bucket, prefix=key)
@@ -1118,7 +1960,15 @@ class Actions(object):
             if aws_profile is not None:
                 args.extend(["--profile", aws_profile])
             if _dry_run is False:
-                subprocess.call(args)
+                if self._latest_layer_code_sha256(config) == digests["sha256"].b64:
+                    pgr_print(
+                        "{cyan}{tab}the latest layer version has the same CodeSha256, skip".format(
+                            cyan=Fore.CYAN,
+                            tab=TAB,
+                        )
+                    )
+                else:
+                    subprocess.call(args)
             pgr_print(
                 "{cyan}{tab}open {reset}{url} {cyan}to view layer".format(
                     cyan=Fore.CYAN,
@@ -1138,6 +1988,38 @@ class Actions(object):
                 )
             )
 
+    def _latest_layer_code_sha256(self, config):
+        """
+        :type config: RepoConfig
+        :rtype: str
+        :return: the ``CodeSha256`` of the latest lambda layer version, None
+            if there is no version or we cannot get it.
+        """
+        aws_profile = config.AWS_LAMBDA_DEPLOY_AWS_PROFILE.get_value()
+        profile_args = list()
+        if aws_profile is not None:
+            profile_args = ["--profile", aws_profile]
+        try:
+            with open(os.devnull, "w") as devnull:
+                version = subprocess.check_output([
+                    "aws", "lambda", "list-layer-versions",
+                    "--layer-name", config.aws_lambda_layer_name,
+                    "--max-items", "1",
+                    "--query", "LayerVersions[0].Version",
+                    "--output", "text",
+                ] + profile_args, stderr=devnull).decode("utf-8").strip()
+                if not version.isdigit():
+                    return None
+                return subprocess.check_output([
+                    "aws", "lambda", "get-layer-version",
+                    "--layer-name", config.aws_lambda_layer_name,
+                    "--version-number", version,
+                    "--query", "Content.CodeSha256",
+                    "--output", "text",
+                ] + profile_args, stderr=devnull).decode("utf-8").strip()
+        except (subprocess.CalledProcessError, OSError):
+            return None
+
     @subcommand(
         name="bud-lambda-layer",
         help="** Build, upload and deploy a new AWS lambda layer.",
@@ -1150,6 +2032,64 @@ class Actions(object):
         self.upload_lambda_layer(config, _dry_run=_dry_run, **kwargs)
         self.deploy_lambda_layer(config, _dry_run=_dry_run, **kwargs)
 
+    @subcommand(
+        help="Store lambda source and layer zip in the local chunk store, report how many new bytes the build introduced.",
+    )
+    def store_lambda_artifacts(self, config, _dry_run=False, **kwargs):
+        """
+        Deduplicate successive builds of ``source.zip`` and ``layer.zip``
+        with content defined chunking, each version is stored as
+        ``source/${md5}`` or ``layer/${md5}``.
+
+        :type config: RepoConfig
+        """
+        pgr_print(
+            "{cyan}store lambda artifacts in {reset}{dir_store}".format(
+                cyan=Fore.CYAN,
+                reset=Style.RESET_ALL,
+                dir_store=config.dir_lambda_chunk_store,
+            )
+        )
+        store = ChunkStore(LocalDirBackend(config.dir_lambda_chunk_store))
+        for kind, path in [
+            ("source", config.path_lambda_build_source),
+            ("layer", config.path_lambda_build_layer),
+        ]:
+            if not os.path.exists(path):
+                pgr_print(
+                    "{red}{tab}{path} {cyan}not found!".format(
+                        tab=TAB,
+                        red=Fore.RED,
+                        cyan=Fore.CYAN,
+                        path=path,
+                    )
+                )
+                continue
+            name = "{}/{}".format(kind, self._lambda_zip_digests(path)["md5"].hex)
+            if store.has_file(name):
+                pgr_print(
+                    "{cyan}{tab}skip, {reset}{name} {cyan}already stored".format(
+                        cyan=Fore.CYAN,
+                        tab=TAB,
+                        reset=Style.RESET_ALL,
+                        name=name,
+                    )
+                )
+                continue
+            if _dry_run is False:
+                report = store.put_file(path, name)
+                pgr_print(
+                    "{cyan}{tab}stored {reset}{name}{cyan}, {reset}{new_bytes}"
+                    "{cyan} of {reset}{size} {cyan}bytes are new "
+                    "({n_new_chunks} of {n_chunks} chunks)".format(
+                        cyan=Fore.CYAN,
+                        tab=TAB,
+                        reset=Style.RESET_ALL,
+                        **report
+                    )
+                )
+        pgr_print_done(indent=1)
+
     def _ensure_chalice_lambda_app_dir(self, config):
         """
         :type config: RepoConfig
@@ -1186,6 +2126,7 @@ class Actions(object):
         copy_python_code(
             config.dir_python_lib,
             config.dir_aws_chalice_vendor_source,
+            matcher=config.ignore_matcher,
         )
 
         # invoke chalice cli
@@ -9,6 +9,8 @@ import os
 import shutil
 from re import findall
 
+from .pkg.ignore import IgnoreMatcher
+
 
 def split_s3_uri(s3_uri):
     """
@@ -179,29 +181,23 @@ def makedir_if_not_exists(abspath):
     os.makedirs(abspath)
 
 
-def copy_python_code(from_dir, to_dir):
+def copy_python_code(from_dir, to_dir, matcher=None):
     """
     Copy all python source code from one directory to another. Skip
-    ``__pycache__``, ``.pyc`` and ``.pyo`` files.
+    ``__pycache__``, ``.pyc`` and ``.pyo`` files, and files the ``matcher``
+    ignores.
 
     :type from_dir: str
     :type to_dir: str
+    :type matcher: IgnoreMatcher
+    :param matcher: default ignores ``__pycache__``, ``.pyc`` and ``.pyo``.
     """
+    if matcher is None:
+        matcher = IgnoreMatcher()
     remove_if_exists(to_dir)
-    pycache = "__pycache__"
-    for dirname, _, basename_list in os.walk(from_dir):
-        relpath = os.path.relpath(dirname, from_dir)
-        target_dir = os.path.abspath(os.path.join(to_dir, relpath))
-        if target_dir.endswith(pycache):
-            continue
-        else:
-            makedir_if_not_exists(target_dir)
-        for basename in basename_list:
-            # ignore .pyc, the compiled byte code
-            # and .pyo, the optimized import cache
-            if basename.endswith(".pyc") or basename.endswith(".pyo"):
-                continue
-            else:
-                source_path = os.path.join(dirname, basename)
-                target_path = os.path.join(target_dir, basename)
-                shutil.copyfile(source_path, target_path)
+    makedir_if_not_exists(to_dir)
+    for relpath in matcher.walk(from_dir):
+        source_path = os.path.join(from_dir, *relpath.split("/"))
+        target_path = os.path.join(to_dir, *relpath.split("/"))
+        makedir_if_not_exists(os.path.dirname(target_path))
+        shutil.copyfile(source_path, target_path)
@@ -13,10 +13,13 @@ Example::
     >>> fingerprint.of_text("Hello World")
     >>> fingerprint.of_pyobj(dict(a=1, b=2, c=3))
     >>> fingerprint.of_file("fingerprint.py")
+    >>> fingerprint.of_dir("my_package")
+    >>> fingerprint.of_files(["a.txt", "b.txt"], workers=4)
+    >>> await fingerprint.aof_file("layer.zip") # in a coroutine, Python3 only
 
 You can switch the hash algorithm to use::
 
-    >>> fingerprint.use("md5") # also "sha1", "sha256", "sha512"
+    >>> fingerprint.use("md5") # also "sha1", "sha256", "sha512", "blake2b", "blake2s"
 
 **中文文档**
 
@@ -24,15 +27,495 @@ You can switch the hash algorithm to use::
 均使用相同的Python大版本(2/3)。
 """
 
-from pygitrepo.pkg.mini_six import PY2, PY3, text_type, binary_type
+from pygitrepo.pkg.mini_six import PY2, PY3, text_type, binary_type, integer_types
+from pygitrepo.pkg.ignore import IgnoreMatcher
+from pygitrepo.pkg.inventory import get_inventory
+import io
+import os
+import json
+import mmap
+import time
 import pickle
+import struct
+import fnmatch
+import base64
 import hashlib
+import binascii
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 if PY2:  # pragma: no cover
     default_pk_protocol = 2
 elif PY3:  # pragma: no cover
     default_pk_protocol = 2
 
+KB = 1024
+MB = 1024 * KB
+
+MIN_CHUNK_SIZE = 64 * KB
+"""
+The smallest buffer size :meth:`FingerPrint.of_file` picks automatically.
+"""
+
+MAX_CHUNK_SIZE = 1 * MB
+"""
+The largest buffer size :meth:`FingerPrint.of_file` picks automatically.
+"""
+
+DEFAULT_MMAP_THRESHOLD = 4 * MB
+"""
+Files at least this large are hashed from a read only memory map instead of
+being copied into a buffer.
+"""
+
+DEFAULT_EXCLUDE = ("__pycache__", "*.pyc", "*.pyo")
+"""
+Base name patterns :meth:`FingerPrint.of_dir` skips by default. It is the same
+rule the lambda source code build uses.
+"""
+
+S3_DEFAULT_PART_SIZE = 8 * MB
+"""
+The default ``multipart_chunksize`` and ``multipart_threshold`` of ``aws s3 cp``.
+"""
+
+S3_MAX_PARTS = 10000
+"""
+An AWS S3 multipart upload has at most 10000 parts.
+"""
+
+QUICK_WINDOW_SIZE = 64 * KB
+"""
+Bytes each sampled window has in :meth:`FingerPrint.of_file_quick`.
+"""
+
+QUICK_N_WINDOWS = 16
+"""
+How many windows :meth:`FingerPrint.of_file_quick` samples, includes head and tail.
+"""
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "pygitrepo", "fingerprint-cache.json",
+)
+"""
+Where :class:`FingerPrintCache` stores digests by default.
+"""
+
+NO_CACHE_ENV_VAR = "PYGITREPO_NO_FINGERPRINT_CACHE"
+"""
+Set this environment variable to any non empty value to bypass all
+:class:`FingerPrintCache`.
+"""
+
+# memoryview over a mmap object (and ``memoryview.release``) is Python3 only
+_HAS_MMAP_VIEW = PY3
+
+
+class HashCancelled(Exception):
+    """
+    Raised in the hashing thread when the ``cancel_event`` is set.
+    """
+
+
+_shared_executor = None
+_shared_executor_lock = threading.Lock()
+
+
+def get_shared_executor():
+    """
+    The thread pool executor all ``FingerPrint.aof_*`` methods use by default,
+    it is created on first use. Python3 only.
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _shared_executor
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _shared_executor = ThreadPoolExecutor(
+                max_workers=multiprocessing.cpu_count())
+        return _shared_executor
+
+
+def auto_chunk_size(size):
+    """
+    Pick a read buffer size for a file of ``size`` bytes. Small files are
+    read in one call, large files use a buffer between
+    :data:`MIN_CHUNK_SIZE` and :data:`MAX_CHUNK_SIZE`.
+
+    :type size: int
+    :rtype: int
+    """
+    if size <= MIN_CHUNK_SIZE:
+        return max(size, 1)
+    return min(max(size // 64, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+
+def _is_excluded(basename, exclude):
+    for pattern in exclude:
+        if fnmatch.fnmatch(basename, pattern):
+            return True
+    return False
+
+
+def walk_files(dir_path, exclude=DEFAULT_EXCLUDE):
+    """
+    Find all files under a directory, skip files and sub directories whose
+    base name matches any of the ``exclude`` patterns.
+
+    :type dir_path: text_type
+    :type exclude: typing.Union[typing.Iterable[str], IgnoreMatcher]
+    :param exclude: base name patterns, or a compiled ``.pgrignore`` matcher.
+    :rtype: typing.List[str]
+    :return: sorted relative paths, always use ``/`` as separator.
+    """
+    if isinstance(exclude, IgnoreMatcher):
+        return exclude.walk(dir_path)
+    exclude = list(exclude)
+
+    def prune(relpath, is_dir):
+        return _is_excluded(relpath.rsplit("/", 1)[-1], exclude)
+
+    inventory = get_inventory(
+        dir_path,
+        prune=prune,
+        prune_key=json.dumps(["exclude", exclude]),
+    )
+    return inventory.walk(prune=prune)
+
+
+def _stat_signature(abspath):
+    """
+    :rtype: typing.List[int]
+    :return: [size, mtime_ns, inode] of a file
+    """
+    st = os.stat(abspath)
+    try:
+        mtime_ns = st.st_mtime_ns
+    except AttributeError:  # pragma: no cover
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return [st.st_size, mtime_ns, st.st_ino]
+
+
+_LENGTH = struct.Struct(">Q")
+_pack_length = _LENGTH.pack
+_FLUSH_ITEMS = 4096
+
+
+def _tagged(tag, payload):
+    return tag + _pack_length(len(payload)) + payload
+
+
+class StructEncoder(object):
+    """
+    A canonical, type tagged binary encoding of Python data, streamed into
+    ``write`` in batches, the whole encoding is never built in memory.
+
+    - ``None``, ``bool``, ``int``, ``float``, text and bytes are encoded by
+      value, ``float`` uses ``float.hex()`` so it is exact.
+    - ``list`` and ``tuple`` are encoded item by item.
+    - ``dict`` items are sorted by the encoding of their keys, ``set``
+      items by the digest of their encoding, so insertion order and hash
+      randomization don't change the result.
+    - any other object is encoded as its pickle, tagged with its class.
+
+    Unlike pickle, the encoding of built-in types doesn't depend on the
+    Python version. Note that in Python2 ``str`` is bytes.
+
+    :type write: typing.Callable[[binary_type], None]
+    :type pk_protocol: int
+    """
+
+    def __init__(self, write, pk_protocol=default_pk_protocol):
+        self._write = write
+        self.pk_protocol = pk_protocol
+        self._buffer = list()
+        self._stack = set()
+
+    def flush(self):
+        """
+        Write what is buffered.
+        """
+        if self._buffer:
+            self._write(b"".join(self._buffer))
+            del self._buffer[:]
+
+    def _to_bytes(self, obj):
+        if type(obj) is text_type:  # the most common dict key
+            data = obj.encode("utf-8")
+            return b"s" + _pack_length(len(data)) + data
+        encoder = StructEncoder(None, pk_protocol=self.pk_protocol)
+        encoder._stack = self._stack
+        encoder._encode(obj)
+        return b"".join(encoder._buffer)
+
+    def encode(self, obj):
+        """
+        :param obj: any python object
+        """
+        self._encode(obj)
+        if self._write is not None:
+            self.flush()
+
+    def _encode(self, obj):
+        append = self._buffer.append
+        klass = type(obj)
+        if klass is text_type:
+            data = obj.encode("utf-8")
+            append(b"s")
+            append(_pack_length(len(data)))
+            append(data)
+        elif obj is None:
+            append(b"N")
+        elif obj is True:
+            append(b"T")
+        elif obj is False:
+            append(b"F")
+        elif isinstance(obj, integer_types):
+            data = str(int(obj)).encode("ascii")
+            append(b"i")
+            append(_pack_length(len(data)))
+            append(data)
+        elif isinstance(obj, float):
+            data = float(obj).hex().encode("ascii")
+            append(b"f")
+            append(_pack_length(len(data)))
+            append(data)
+        elif isinstance(obj, text_type):
+            append(_tagged(b"s", obj.encode("utf-8")))
+        elif isinstance(obj, binary_type):
+            append(_tagged(b"b", bytes(obj)))
+        elif isinstance(obj, (list, tuple, dict, set, frozenset)):
+            obj_id = id(obj)
+            if obj_id in self._stack:
+                raise ValueError("can't encode a recursive data structure!")
+            self._stack.add(obj_id)
+            try:
+                self._encode_container(obj, append)
+            finally:
+                self._stack.discard(obj_id)
+        else:
+            append(_tagged(b"o", "{}.{}".format(
+                klass.__module__, klass.__name__).encode("utf-8")))
+            append(_tagged(b"p", pickle.dumps(obj, protocol=self.pk_protocol)))
+
+    def _encode_container(self, obj, append):
+        buffer = self._buffer
+        encode = self._encode
+        flush = self.flush if self._write is not None else None
+        if isinstance(obj, dict):
+            to_bytes = self._to_bytes
+            items = sorted(
+                [(to_bytes(key), value) for key, value in obj.items()],
+                key=lambda item: item[0],
+            )
+            append(b"d")
+            append(_pack_length(len(items)))
+            for key, value in items:
+                append(key)
+                encode(value)
+                if flush and len(buffer) > _FLUSH_ITEMS:
+                    flush()
+        elif isinstance(obj, (set, frozenset)):
+            digests = sorted(
+                hashlib.sha256(self._to_bytes(item)).digest()
+                for item in obj
+            )
+            append(_tagged(b"S", b"".join(digests)))
+        else:
+            append(b"l" if isinstance(obj, list) else b"t")
+            append(_pack_length(len(obj)))
+            for item in obj:
+                encode(item)
+                if flush and len(buffer) > _FLUSH_ITEMS:
+                    flush()
+
+
+class Digest(object):
+    """
+    A finished digest that can be rendered in every format the build and
+    deploy steps need.
+
+    - :attr:`Digest.hex`: hex string, used as the S3 key and S3 ETag.
+    - :attr:`Digest.b64`: base64 string, AWS Lambda ``CodeSha256`` and
+        S3 ``Content-MD5`` use it.
+    - :attr:`Digest.int`: integer.
+
+    :type raw: binary_type
+    :param raw: the raw ``hashlib`` digest bytes.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    @classmethod
+    def from_hex(cls, hexdigest):
+        """
+        :type hexdigest: str
+        :rtype: Digest
+        """
+        return cls(binascii.unhexlify(hexdigest))
+
+    @property
+    def hex(self):
+        return binascii.hexlify(self.raw).decode("ascii")
+
+    @property
+    def b64(self):
+        return base64.b64encode(self.raw).decode("ascii")
+
+    @property
+    def int(self):
+        return int(self.hex, 16)
+
+    def __eq__(self, other):
+        return isinstance(other, Digest) and (self.raw == other.raw)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __repr__(self):
+        return "Digest({!r})".format(self.hex)
+
+
+class FingerPrintCache(object):
+    """
+    A small json file backed cache of file digests. An entry is only used
+    when the (path, size, mtime_ns, inode, algorithm) of the file still
+    match, so an unchanged large artifact is hashed only once across many
+    ``pgr`` invocations.
+
+    :type path: str
+    :param path: the json file location, default :data:`DEFAULT_CACHE_PATH`
+
+    :type max_entries: int
+    :param max_entries: when there are more entries, the least recently
+        used ones are evicted on save.
+
+    Usage::
+
+        >>> fp = FingerPrint(cache=FingerPrintCache())
+        >>> fp.of_file("build/lambda/layer.zip") # hash the file
+        >>> fp.of_file("build/lambda/layer.zip") # read from cache
+        >>> fp.of_file("build/lambda/layer.zip", use_cache=False) # bypass
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._data = None  # type: typing.Dict[str, dict]
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        """
+        False if :data:`NO_CACHE_ENV_VAR` is set.
+        """
+        return not os.environ.get(NO_CACHE_ENV_VAR)
+
+    @staticmethod
+    def make_key(abspath, algorithm, nbytes=0):
+        """
+        :rtype: str
+        """
+        return "{}|{}|{}".format(os.path.abspath(abspath), algorithm, nbytes)
+
+    def _read(self):
+        try:
+            with io.open(self.path, "rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    @property
+    def data(self):
+        with self._lock:
+            if self._data is None:
+                self._data = self._read()
+            return self._data
+
+    def get(self, abspath, algorithm, nbytes=0):
+        """
+        Return the cached hex digest, or None if the file changed since it
+        was cached or it was never cached.
+
+        :rtype: str
+        """
+        entry = self.data.get(self.make_key(abspath, algorithm, nbytes))
+        if entry is None:
+            return None
+        if entry["stat"] != _stat_signature(abspath):
+            return None
+        entry["atime"] = time.time()
+        return entry["digest"]
+
+    def set(self, abspath, algorithm, digest, nbytes=0, save=True):
+        """
+        Store a hex digest and save the cache file.
+
+        :type save: bool
+        :param save: set False when storing many digests, and call
+            :meth:`FingerPrintCache.save` once at the end.
+        """
+        signature = _stat_signature(abspath)
+        # on a file system with 1 second mtime resolution, a file changed
+        # twice in the same second keeps the same signature, don't trust it
+        if (signature[1] % 1000000000 == 0) \
+                and (time.time() - signature[1] / 1000000000.0 < 2):
+            return
+        with self._lock:
+            self.data[self.make_key(abspath, algorithm, nbytes)] = dict(
+                stat=signature,
+                digest=digest,
+                atime=time.time(),
+            )
+            if save:
+                self.save()
+
+    def save(self):
+        """
+        Merge with what other processes have saved, evict the least recently
+        used entries, then atomically replace the cache file. It is thread
+        safe.
+        """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        data = self._read()
+        data.update(self.data)
+        if len(data) > self.max_entries:
+            keys = sorted(data, key=lambda k: data[k]["atime"], reverse=True)
+            data = {key: data[key] for key in keys[:self.max_entries]}
+        self._data = data
+
+        dir_path = os.path.dirname(self.path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with io.open(tmp_path, "wb") as f:
+            f.write(json.dumps(data).encode("utf-8"))
+        try:
+            os.replace(tmp_path, self.path)
+        except AttributeError:  # pragma: no cover
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+
+    def clear(self):
+        """
+        Remove all cached digests.
+        """
+        self._data = dict()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 
 class FingerPrint(object):
     """A hashlib wrapper class allow you to use one line to do hash as you wish.
@@ -55,22 +538,34 @@ class FingerPrint(object):
         "sha256": hashlib.sha256,
         "sha512": hashlib.sha512,
     }
+    if hasattr(hashlib, "blake2b"):  # pragma: no cover
+        _mapper["blake2b"] = hashlib.blake2b
+        _mapper["blake2s"] = hashlib.blake2s
 
-    def __init__(self, algorithm="md5", pk_protocol=default_pk_protocol):
+    def __init__(self,
+                 algorithm="md5",
+                 pk_protocol=default_pk_protocol,
+                 cache=None):
+        self.algorithm = "md5"
         self.hash_algo = hashlib.md5
         self.return_int = False
         self.pk_protocol = 2
+        self.mmap_threshold = DEFAULT_MMAP_THRESHOLD
+        self.cache = None  # type: FingerPrintCache
 
         self.use(algorithm)
         self.set_return_str()
         self.set_pickle_protocol(pk_protocol)
+        self.set_cache(cache)
 
     def use(self, algorithm):
         """Change the hash algorithm you gonna use.
         """
+        algorithm = algorithm.strip().lower()
         try:
-            self.hash_algo = self._mapper[algorithm.strip().lower()]
-        except IndexError:  # pragma: no cover
+            self.hash_algo = self._mapper[algorithm]
+            self.algorithm = algorithm
+        except KeyError:  # pragma: no cover
             template = "'%s' is not supported, try one of %s."
             raise ValueError(template % (algorithm, list(self._mapper)))
 
@@ -132,6 +627,18 @@ class FingerPrint(object):
         """
         self.set_pickle_protocol(3)
 
+    def set_cache(self, cache):
+        """
+        Set the :class:`FingerPrintCache` :meth:`FingerPrint.of_file` uses.
+        Set to None to disable cache.
+
+        :type cache: FingerPrintCache
+        """
+        self.cache = cache
+
+    def _use_cache(self, use_cache):
+        return use_cache and (self.cache is not None) and self.cache.enabled
+
     def digest(self, hash_method):
         if self.return_int:
             return int(hash_method.hexdigest(), 16)
@@ -160,68 +667,837 @@ class FingerPrint(object):
         m.update(text.encode(encoding))
         return self.digest(m)
 
-    def of_pyobj(self, pyobj):
+    def of_pyobj(self, pyobj, structural=False):
         """
         Use default hash method to return hash value of a piece of Python
         picklable object.
+
         :param pyobj: any python object
+
+        :type structural: bool
+        :param structural: by default the pickle of the object is hashed. if
+            True, the object is streamed into the hash with
+            :class:`StructEncoder`, dict and set ordering don't matter and the
+            digest of built-in types is the same on any machine and Python3
+            version.
         """
         m = self.hash_algo()
-        m.update(pickle.dumps(pyobj, protocol=self.pk_protocol))
+        if structural:
+            StructEncoder(m.update, pk_protocol=self.pk_protocol).encode(pyobj)
+        else:
+            m.update(pickle.dumps(pyobj, protocol=self.pk_protocol))
         return self.digest(m)
 
-    def of_file(self, abspath, nbytes=0, chunk_size=1024):
+    def _update_from_file(self,
+                          hashers,
+                          abspath,
+                          nbytes=0,
+                          chunk_size=None,
+                          cancel_event=None):
+        """
+        Feed the content of a file into one or many hashlib objects.
+
+        Files larger than :attr:`FingerPrint.mmap_threshold` are hashed
+        directly from a read only memory map, others are read with
+        ``readinto`` into one reusable buffer. Both ways avoid allocating a
+        new bytes object per chunk.
+
+        :type hashers: typing.List
+        :type abspath: text_type
+        :type nbytes: int
+        :type chunk_size: int
+
+        :type cancel_event: threading.Event
+        :param cancel_event: checked before each chunk, raise
+            :class:`HashCancelled` once it is set.
+        """
+        if nbytes < 0:
+            raise ValueError("nbytes cannot smaller than 0")
+        if (chunk_size is not None) and (chunk_size < 1):
+            raise ValueError("chunk_size cannot smaller than 1")
+
+        with io.open(abspath, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if nbytes:  # use first n bytes
+                total = min(nbytes, size)
+            else:  # use entire content
+                total = size
+            if chunk_size is None:
+                chunk_size = auto_chunk_size(total)
+            chunk_size = max(min(chunk_size, total), 1)
+
+            if _HAS_MMAP_VIEW and total >= self.mmap_threshold:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, total, chunk_size):
+                        if (cancel_event is not None) and cancel_event.is_set():
+                            raise HashCancelled(abspath)
+                        data = view[offset:min(offset + chunk_size, total)]
+                        for m in hashers:
+                            m.update(data)
+                        data.release()
+                finally:
+                    view.release()
+                    mm.close()
+            else:
+                buffer = memoryview(bytearray(chunk_size))
+                remaining = total
+                while remaining:
+                    if (cancel_event is not None) and cancel_event.is_set():
+                        raise HashCancelled(abspath)
+                    n = f.readinto(buffer[:min(chunk_size, remaining)])
+                    if not n:
+                        break
+                    for m in hashers:
+                        m.update(buffer[:n])
+                    remaining -= n
+
+    def of_file(self,
+                abspath,
+                nbytes=0,
+                chunk_size=None,
+                use_cache=True,
+                cancel_event=None):
         """
         Use default hash method to return hash value of a piece of a file
-        Estimate processing time on:
+
         :type abspath: text_type
         :param abspath: the absolute path to the file.
+
         :type nbytes: int
         :param nbytes: only has first N bytes of the file. if 0, hash all file.
+
         :type chunk_size: int
-        :param chunk_size: The max memory we use at one time.
-        CPU = i7-4600U 2.10GHz - 2.70GHz, RAM = 8.00 GB
-        1 second can process 0.25GB data
-        - 0.59G - 2.43 sec
-        - 1.3G - 5.68 sec
-        - 1.9G - 7.72 sec
-        - 2.5G - 10.32 sec
-        - 3.9G - 16.0 sec
+        :param chunk_size: The max memory we use at one time. if None, pick
+            a buffer size automatically based on the file size, see
+            :func:`auto_chunk_size`.
+
+        :type use_cache: bool
+        :param use_cache: if a :class:`FingerPrintCache` is set, reuse the
+            digest of an unchanged file. set False to bypass the cache.
+
+        :type cancel_event: threading.Event
+        :param cancel_event: set it from another thread to stop hashing,
+            :class:`HashCancelled` is raised.
+
+        Run ``python benchmarks/bench_fingerprint.py`` to measure the
+        throughput of each algorithm, chunk size and I/O strategy on your
+        machine.
+
         ATTENTION:
             if you change the meta data (for example, the title, years
             information in audio, video) of a multi-media file, then the hash
             value gonna also change.
         """
-        if nbytes < 0:
-            raise ValueError("chunk_size cannot smaller than 0")
-        if chunk_size < 1:
-            raise ValueError("chunk_size cannot smaller than 1")
-        if (nbytes > 0) and (nbytes < chunk_size):
-            chunk_size = nbytes
-
+        if self._use_cache(use_cache):
+            digest = self.cache.get(abspath, self.algorithm, nbytes)
+            if digest is not None:
+                return digest
         m = self.hash_algo()
-        with open(abspath, "rb") as f:
-            if nbytes:  # use first n bytes
-                have_reads = 0
-                while True:
-                    have_reads += chunk_size
-                    if have_reads > nbytes:
-                        n = nbytes - (have_reads - chunk_size)
-                        if n:
-                            data = f.read(n)
-                            m.update(data)
-                        break
-                    else:
-                        data = f.read(chunk_size)
-                        m.update(data)
-            else:  # use entire content
-                while True:
-                    data = f.read(chunk_size)
-                    if not data:
+        self._update_from_file(
+            [m, ], abspath,
+            nbytes=nbytes, chunk_size=chunk_size, cancel_event=cancel_event,
+        )
+        digest = m.hexdigest()
+        if self._use_cache(use_cache):
+            self.cache.set(abspath, self.algorithm, digest, nbytes)
+        return digest
+
+    def of_file_multi(self,
+                      abspath,
+                      algorithms,
+                      nbytes=0,
+                      chunk_size=None,
+                      use_cache=True,
+                      cancel_event=None):
+        """
+        Compute many digests of a file in one pass, each chunk is read once
+        and fed to all hash objects. Digests already in the
+        :class:`FingerPrintCache` are not computed again.
+
+        :type abspath: text_type
+        :type algorithms: typing.Iterable[str]
+        :param algorithms: for example ``["md5", "sha256"]``
+        :type nbytes: int
+        :type chunk_size: int
+        :type use_cache: bool
+        :type cancel_event: threading.Event
+
+        :rtype: typing.Dict[str, Digest]
+
+        Usage::
+
+            >>> digests = fingerprint.of_file_multi("source.zip", ["md5", "sha256"])
+            >>> digests["md5"].hex # S3 key
+            >>> digests["sha256"].b64 # AWS Lambda CodeSha256
+        """
+        algorithms = [algorithm.strip().lower() for algorithm in algorithms]
+        for algorithm in algorithms:
+            if algorithm not in self._mapper:
+                template = "'%s' is not supported, try one of %s."
+                raise ValueError(template % (algorithm, list(self._mapper)))
+
+        use_cache = self._use_cache(use_cache)
+        digests = OrderedDict()
+        hashers = OrderedDict()
+        for algorithm in algorithms:
+            hexdigest = None
+            if use_cache:
+                hexdigest = self.cache.get(abspath, algorithm, nbytes)
+            if hexdigest is None:
+                hashers[algorithm] = self._mapper[algorithm]()
+            else:
+                digests[algorithm] = Digest.from_hex(hexdigest)
+
+        if hashers:
+            self._update_from_file(
+                list(hashers.values()), abspath,
+                nbytes=nbytes, chunk_size=chunk_size, cancel_event=cancel_event,
+            )
+            for algorithm, m in hashers.items():
+                digests[algorithm] = Digest(m.digest())
+                if use_cache:
+                    self.cache.set(
+                        abspath, algorithm, digests[algorithm].hex, nbytes,
+                        save=False,
+                    )
+            if use_cache:
+                self.cache.save()
+        return OrderedDict([
+            (algorithm, digests[algorithm]) for algorithm in algorithms
+        ])
+
+    def of_file_s3_etag(self,
+                        abspath,
+                        part_size=S3_DEFAULT_PART_SIZE,
+                        multipart_threshold=S3_DEFAULT_PART_SIZE,
+                        workers=None):
+        """
+        Compute the ETag AWS S3 gives the file after ``aws s3 cp``, without
+        uploading it. A file smaller than ``multipart_threshold`` is uploaded
+        in one request, its ETag is the plain md5 hex digest. Otherwise the
+        ETag is ``md5(concat(md5 of each part))-{number of parts}``. Parts
+        are hashed concurrently in a thread pool, each thread reads its
+        own part with offset reads.
+
+        Like ``aws s3 cp``, the part size is doubled until there are at most
+        :data:`S3_MAX_PARTS` parts. The hash algorithm is always md5.
+
+        :type abspath: text_type
+        :type part_size: int
+        :param part_size: ``multipart_chunksize`` of the uploader.
+        :type multipart_threshold: int
+        :param multipart_threshold: ``multipart_threshold`` of the uploader.
+        :type workers: int
+        :param workers: number of hashing threads, default is the number of CPU.
+
+        :rtype: str
+        :return: the ETag without double quotes.
+        """
+        if part_size < 1:
+            raise ValueError("part_size cannot smaller than 1")
+        size = os.path.getsize(abspath)
+        if size < multipart_threshold:
+            m = hashlib.md5()
+            self._update_from_file([m, ], abspath)
+            return m.hexdigest()
+
+        while (size + part_size - 1) // part_size > S3_MAX_PARTS:
+            part_size *= 2
+        offsets = list(range(0, size, part_size)) or [0, ]
+
+        def hash_part(offset):
+            m = hashlib.md5()
+            chunk_size = min(MAX_CHUNK_SIZE, part_size)
+            buffer = memoryview(bytearray(chunk_size))
+            remaining = min(part_size, size - offset)
+            with io.open(abspath, "rb") as f:
+                f.seek(offset)
+                while remaining:
+                    n = f.readinto(buffer[:min(chunk_size, remaining)])
+                    if not n:
                         break
-                    m.update(data)
+                    m.update(buffer[:n])
+                    remaining -= n
+            return m.digest()
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        pool = ThreadPool(max(min(workers, len(offsets)), 1))
+        try:
+            part_digests = pool.map(hash_part, offsets)
+        finally:
+            pool.close()
+            pool.join()
+        m = hashlib.md5()
+        m.update(b"".join(part_digests))
+        return "{}-{}".format(m.hexdigest(), len(part_digests))
+
+    def of_file_quick(self,
+                      abspath,
+                      window_size=QUICK_WINDOW_SIZE,
+                      n_windows=QUICK_N_WINDOWS):
+        """
+        A quick fingerprint of a file, hash the file size, the head, the tail
+        and evenly spaced windows in between. It reads at most
+        ``window_size * n_windows`` bytes no matter how large the file is.
+        A small file is hashed entirely.
+
+        Unlike ``of_file(abspath, nbytes=...)``, it catches changes at the
+        end of a file, for example the central directory of a zip. But a
+        change between two windows is not detected, use
+        :meth:`FingerPrint.is_same_file` with ``certain=True`` if you need
+        a guarantee.
+
+        :type abspath: text_type
+        :type window_size: int
+        :type n_windows: int
+        :rtype: str
+        """
+        if window_size < 1:
+            raise ValueError("window_size cannot smaller than 1")
+        if n_windows < 2:
+            raise ValueError("n_windows cannot smaller than 2")
+
+        size = os.path.getsize(abspath)
+        m = self.hash_algo()
+        m.update(struct.pack(">QQQ", size, window_size, n_windows))
+        if size <= window_size * n_windows:
+            self._update_from_file([m, ], abspath)
+            return self.digest(m)
+
+        last_offset = size - window_size
+        offsets = [
+            last_offset * i // (n_windows - 1)
+            for i in range(n_windows)
+        ]
+        buffer = memoryview(bytearray(window_size))
+        with io.open(abspath, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                n = f.readinto(buffer)
+                m.update(buffer[:n])
+        return self.digest(m)
+
+    def is_same_file(self, abspath1, abspath2, certain=False):
+        """
+        Detect whether two files have the same content. Different size or
+        different :meth:`FingerPrint.of_file_quick` means different content.
+        When the quick fingerprints match, the files are considered the same
+        unless ``certain=True``, then the full content hash decides.
+
+        :type abspath1: text_type
+        :type abspath2: text_type
+        :type certain: bool
+        :rtype: bool
+        """
+        if os.path.getsize(abspath1) != os.path.getsize(abspath2):
+            return False
+        if self.of_file_quick(abspath1) != self.of_file_quick(abspath2):
+            return False
+        if certain:
+            return self.of_file(abspath1) == self.of_file(abspath2)
+        return True
+
+    def of_files(self,
+                 paths,
+                 workers=None,
+                 executor="thread",
+                 nbytes=0,
+                 chunk_size=None,
+                 callback=None,
+                 use_cache=True):
+        """
+        Compute the hex digest of many files concurrently.
+
+        Each file is read chunk by chunk, a worker holds at most one buffer
+        of ``chunk_size`` in memory, no matter how large the files are.
+
+        :type paths: typing.Iterable[text_type]
+        :param paths: absolute paths of the files.
+
+        :type workers: int
+        :param workers: size of the pool, default is the number of CPU.
+
+        :type executor: str
+        :param executor: "thread" (default) or "process". hashlib releases
+            the GIL, threads are good enough unless there are lots of tiny
+            files.
+
+        :type nbytes: int
+        :type chunk_size: int
+
+        :type callback: typing.Callable
+        :param callback: ``callback(n_done, n_total, path)`` is called in the
+            calling thread after each file is hashed, for progress report.
+
+        :type use_cache: bool
+        :param use_cache: digests of unchanged files are read from
+            the :class:`FingerPrintCache` if it is set.
+
+        :rtype: typing.Dict[str, str]
+        :return: an ordered mapping of path to hex digest, in the same order
+            as ``paths``.
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError("executor has to be 'thread' or 'process'!")
+        paths = list(paths)
+        n_total = len(paths)
+        use_cache = self._use_cache(use_cache)
+
+        results = OrderedDict([(path, None) for path in paths])
+        todo = list()
+        for path in results:
+            if use_cache:
+                results[path] = self.cache.get(path, self.algorithm, nbytes)
+            if results[path] is None:
+                todo.append(path)
+
+        n_done = 0
+        for path in results:
+            if results[path] is not None:
+                n_done += 1
+                if callback is not None:
+                    callback(n_done, n_total, path)
+
+        if todo:
+            if workers is None:
+                workers = multiprocessing.cpu_count()
+            workers = max(min(workers, len(todo)), 1)
+            tasks = [
+                (self.algorithm, path, nbytes, chunk_size)
+                for path in todo
+            ]
+            if executor == "thread":
+                pool = ThreadPool(workers)
+            else:
+                pool = multiprocessing.Pool(workers)
+            try:
+                chunksize = max(1, len(tasks) // (workers * 16))
+                iterator = pool.imap(_hash_file_task, tasks, chunksize)
+                for path, digest in zip(todo, iterator):
+                    results[path] = digest
+                    if use_cache:
+                        self.cache.set(
+                            path, self.algorithm, digest, nbytes, save=False)
+                    n_done += 1
+                    if callback is not None:
+                        callback(n_done, n_total, path)
+            finally:
+                pool.close()
+                pool.join()
+                if use_cache:
+                    self.cache.save()
+
+        return results
+
+    def _merkle_root(self, leaves):
+        """
+        Combine leaf digests pair by pair until there is only one left.
+        An odd node is promoted to the next level as it is.
+
+        :type leaves: typing.List[binary_type]
+        :rtype: binary_type
+        """
+        if not leaves:
+            return self.hash_algo().digest()
+        level = leaves
+        while len(level) > 1:
+            next_level = list()
+            for i in range(0, len(level) - 1, 2):
+                m = self.hash_algo()
+                m.update(b"\x01" + level[i] + level[i + 1])
+                next_level.append(m.digest())
+            if len(level) % 2:
+                next_level.append(level[-1])
+            level = next_level
+        return level[0]
+
+    def of_dir(self, dir_path, exclude=DEFAULT_EXCLUDE, workers=None):
+        """
+        Return the merkle root hash of all files in a directory. Files are
+        hashed concurrently in a thread pool (hashlib releases the GIL), then
+        each leaf ``hash(relpath + file digest)`` is combined into a merkle
+        root. Renaming, adding, removing or editing any file changes the
+        result. It is a cheap "did anything change" key of a source tree.
+
+        :type dir_path: text_type
+        :param dir_path: the absolute path to the directory.
+
+        :type exclude: typing.Union[typing.Iterable[str], IgnoreMatcher]
+        :param exclude: base name patterns of files and sub directories
+            to skip, default is :data:`DEFAULT_EXCLUDE`. Or an
+            :class:`~pygitrepo.pkg.ignore.IgnoreMatcher`.
+
+        :type workers: int
+        :param workers: number of hashing threads, default is the number of CPU.
+
+        :rtype: str
+        """
+        relpath_list = walk_files(dir_path, exclude=exclude)
+        hexdigests = self.of_files(
+            [
+                os.path.join(dir_path, *relpath.split("/"))
+                for relpath in relpath_list
+            ],
+            workers=workers,
+        ).values()
+        digests = [binascii.unhexlify(hexdigest) for hexdigest in hexdigests]
+        return self.of_named_digests(zip(relpath_list, digests))
+
+    def of_named_digests(self, named_digests):
+        """
+        Combine ``(name, raw digest)`` pairs, for example the relative path
+        and the content digest of files, into a merkle root. Each leaf is
+        ``hash(name + digest)``, pairs have to be sorted by the caller.
+
+        :type named_digests: typing.Iterable[typing.Tuple[str, binary_type]]
+        :rtype: str
+        """
+        leaves = list()
+        for name, digest in named_digests:
+            m = self.hash_algo()
+            m.update(b"\x00" + name.encode("utf-8") + b"\x00" + digest)
+            leaves.append(m.digest())
+        root = self._merkle_root(leaves)
+        if self.return_int:
+            return int(binascii.hexlify(root), 16)
+        else:
+            return binascii.hexlify(root).decode("ascii")
+
+    # --- asyncio API, Python3 only ---
+    # They are plain methods returning an awaitable ``asyncio.Future``,
+    # so this module still compiles on Python2.
+    def _run_in_executor(self, method, args, kwargs, executor=None):
+        """
+        Run a blocking ``of_*`` method in an executor. When the returned
+        future is cancelled, the ``cancel_event`` of the method is set, so
+        the hashing thread stops at the next chunk instead of reading the
+        rest of the file.
+
+        :rtype: asyncio.Future
+        """
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        if executor is None:
+            executor = get_shared_executor()
+        cancel_event = threading.Event()
+        kwargs["cancel_event"] = cancel_event
+        future = loop.run_in_executor(
+            executor, functools.partial(method, *args, **kwargs))
+
+        def on_done(fut):
+            if fut.cancelled():
+                cancel_event.set()
+
+        future.add_done_callback(on_done)
+        return future
+
+    def aof_file(self,
+                 abspath,
+                 nbytes=0,
+                 chunk_size=None,
+                 use_cache=True,
+                 executor=None):
+        """
+        The asyncio version of :meth:`FingerPrint.of_file`, hashing runs in
+        ``executor`` (default :func:`get_shared_executor`) without blocking
+        the event loop. Cancel the future to stop hashing.
+
+        Usage::
+
+            >>> async def main():
+            ...     md5 = await fingerprint.aof_file("layer.zip")
+
+        :type executor: concurrent.futures.Executor
+        :rtype: asyncio.Future
+        """
+        return self._run_in_executor(
+            self.of_file,
+            (abspath, ),
+            dict(nbytes=nbytes, chunk_size=chunk_size, use_cache=use_cache),
+            executor=executor,
+        )
+
+    def aof_file_multi(self,
+                       abspath,
+                       algorithms,
+                       nbytes=0,
+                       chunk_size=None,
+                       use_cache=True,
+                       executor=None):
+        """
+        The asyncio version of :meth:`FingerPrint.of_file_multi`.
+
+        :type executor: concurrent.futures.Executor
+        :rtype: asyncio.Future
+        """
+        return self._run_in_executor(
+            self.of_file_multi,
+            (abspath, algorithms),
+            dict(nbytes=nbytes, chunk_size=chunk_size, use_cache=use_cache),
+            executor=executor,
+        )
+
+    def aof_files(self,
+                  paths,
+                  nbytes=0,
+                  chunk_size=None,
+                  use_cache=True,
+                  executor=None):
+        """
+        The asyncio version of :meth:`FingerPrint.of_files`, each file is
+        hashed by :meth:`FingerPrint.aof_file`. Cancel the future to stop
+        hashing all files.
+
+        :type executor: concurrent.futures.Executor
+        :rtype: asyncio.Future
+        :return: resolves to an ordered mapping of path to hex digest.
+        """
+        import asyncio
+
+        paths = list(paths)
+        gathered = asyncio.gather(*[
+            self.aof_file(
+                path,
+                nbytes=nbytes, chunk_size=chunk_size, use_cache=use_cache,
+                executor=executor,
+            )
+            for path in paths
+        ])
+        future = asyncio.get_event_loop().create_future()
+
+        def on_gathered(fut):
+            if future.done():
+                return
+            if fut.cancelled():
+                future.cancel()
+            elif fut.exception() is not None:
+                future.set_exception(fut.exception())
+            else:
+                future.set_result(OrderedDict(zip(paths, fut.result())))
+
+        def on_done(fut):
+            if fut.cancelled():
+                gathered.cancel()
+
+        gathered.add_done_callback(on_gathered)
+        future.add_done_callback(on_done)
+        return future
+
+
+def _hash_file_task(task):
+    """
+    Pool worker of :meth:`FingerPrint.of_files`. It is a module level
+    function so it can be pickled to a process pool.
+
+    :type task: typing.Tuple[str, str, int, int]
+    :param task: (algorithm, abspath, nbytes, chunk_size)
+    :rtype: str
+    """
+    algorithm, abspath, nbytes, chunk_size = task
+    return FingerPrint(algorithm).of_file(
+        abspath, nbytes=nbytes, chunk_size=chunk_size, use_cache=False)
+
+
+class S3ETagHasher(object):
+    """
+    A hashlib like object that computes the AWS S3 multipart ETag of a
+    stream, see :meth:`FingerPrint.of_file_s3_etag`. The total size has
+    to be known in advance to double the part size like ``aws s3 cp``
+    does, so the part size is used as is here.
+
+    :type part_size: int
+    :type multipart_threshold: int
+    """
+
+    def __init__(self,
+                 part_size=S3_DEFAULT_PART_SIZE,
+                 multipart_threshold=S3_DEFAULT_PART_SIZE):
+        self.part_size = part_size
+        self.multipart_threshold = multipart_threshold
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._part_md5 = hashlib.md5()
+        self._part_filled = 0
+        self._part_digests = list()
+
+    def update(self, data):
+        data = memoryview(data)
+        self._md5.update(data)
+        self.size += len(data)
+        while len(data):
+            n = min(self.part_size - self._part_filled, len(data))
+            self._part_md5.update(data[:n])
+            self._part_filled += n
+            data = data[n:]
+            if self._part_filled == self.part_size:
+                self._part_digests.append(self._part_md5.digest())
+                self._part_md5 = hashlib.md5()
+                self._part_filled = 0
+
+    def hexdigest(self):
+        """
+        :rtype: str
+        :return: the ETag without double quotes.
+        """
+        if self.size < self.multipart_threshold:
+            return self._md5.hexdigest()
+        part_digests = list(self._part_digests)
+        if self._part_filled:
+            part_digests.append(self._part_md5.digest())
+        m = hashlib.md5()
+        m.update(b"".join(part_digests))
+        return "{}-{}".format(m.hexdigest(), len(part_digests))
 
-        return m.hexdigest()
+
+SIDECAR_SUFFIX = ".digests.json"
+
+
+def sidecar_path(abspath):
+    """
+    Where the digests of an artifact are recorded, ``${abspath}.digests.json``.
+
+    :type abspath: str
+    :rtype: str
+    """
+    return abspath + SIDECAR_SUFFIX
+
+
+def read_sidecar(abspath):
+    """
+    Read the digests recorded by :meth:`HashingWriter.write_sidecar`. Return
+    None if there's no record or the artifact changed after it was recorded.
+
+    :type abspath: str
+    :rtype: typing.Dict[str, str]
+    :return: algorithm (and ``s3_etag``) to hex digest mapping.
+    """
+    try:
+        with io.open(sidecar_path(abspath), "rb") as f:
+            data = json.loads(f.read().decode("utf-8"))
+        if data["stat"] != _stat_signature(abspath):
+            return None
+        return data["digests"]
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+class HashingWriter(object):
+    """
+    A write only file-like object that wraps an output stream, and updates
+    one or many digests while bytes pass through it. So an artifact is
+    fingerprinted while it is written, and never has to be read again.
+
+    It is not seekable, :class:`zipfile.ZipFile` (Python3) detects that and
+    writes an archive in streaming mode.
+
+    :type fileobj: typing.BinaryIO
+    :param fileobj: the underlying output stream, it is not closed by
+        :meth:`HashingWriter.close`.
+    :type algorithms: typing.Iterable[str]
+    :type s3_etag: bool
+    :param s3_etag: also compute the AWS S3 ETag, see :class:`S3ETagHasher`.
+
+    Usage::
+
+        >>> with open("source.zip", "wb") as f:
+        ...     writer = HashingWriter(f, ["md5", "sha256"])
+        ...     with ZipFile(writer, "w") as zf:
+        ...         zf.write("my_package/__init__.py")
+        >>> writer.write_sidecar("source.zip")
+        >>> read_sidecar("source.zip")
+        {"md5": "...", "sha256": "..."}
+    """
+
+    def __init__(self, fileobj, algorithms=("md5", "sha256"), s3_etag=False):
+        self.fileobj = fileobj
+        self.hashers = OrderedDict()
+        for algorithm in algorithms:
+            algorithm = algorithm.strip().lower()
+            try:
+                self.hashers[algorithm] = FingerPrint._mapper[algorithm]()
+            except KeyError:
+                template = "'%s' is not supported, try one of %s."
+                raise ValueError(template % (algorithm, list(FingerPrint._mapper)))
+        self.s3_etag_hasher = S3ETagHasher() if s3_etag else None
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.fileobj.write(data)
+        for m in self.hashers.values():
+            m.update(data)
+        if self.s3_etag_hasher is not None:
+            self.s3_etag_hasher.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation("HashingWriter is not seekable")
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.flush()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def digests(self):
+        """
+        :rtype: typing.Dict[str, Digest]
+        """
+        return OrderedDict([
+            (algorithm, Digest(m.digest()))
+            for algorithm, m in self.hashers.items()
+        ])
+
+    @property
+    def s3_etag(self):
+        """
+        :rtype: str
+        """
+        if self.s3_etag_hasher is None:
+            return None
+        return self.s3_etag_hasher.hexdigest()
+
+    def write_sidecar(self, abspath):
+        """
+        Record the digests next to the artifact at ``abspath``, call it after
+        the artifact file is closed. See :func:`read_sidecar`.
+
+        :type abspath: str
+        """
+        digests = OrderedDict([
+            (algorithm, digest.hex)
+            for algorithm, digest in self.digests.items()
+        ])
+        if self.s3_etag_hasher is not None:
+            digests["s3_etag"] = self.s3_etag
+        data = dict(stat=_stat_signature(abspath), digests=digests)
+        with io.open(sidecar_path(abspath), "wb") as f:
+            f.write(json.dumps(data, indent=4).encode("utf-8"))
 
 
 fingerprint = FingerPrint()
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+"""
+Git index backed file fingerprints.
+
+For a file tracked by git, git already stores its blob id (the sha1 of
+``blob {size}\\0{content}``) in ``.git/index``, together with the file stat
+at the time it was staged. If the stat of the file in the work tree still
+matches, the file is clean and the blob id can be used as its fingerprint
+without reading it. Only modified and untracked files are hashed. That's
+how ``git status`` stays fast on large repos.
+
+Usage::
+
+    >>> provider = GitIndexFingerPrint("/path/to/repo")
+    >>> provider.of_file("setup.py")
+    '6b4e3a0...'
+    >>> provider.of_dir("my_package") # merkle root of blob ids
+    'e1f3c5d...'
+
+Reference: https://git-scm.com/docs/index-format
+"""
+
+import io
+import os
+import struct
+import hashlib
+import binascii
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from pygitrepo.pkg.fingerprint import FingerPrint, DEFAULT_EXCLUDE, walk_files
+
+_ENTRY_HEAD = struct.Struct(">10I20sH")
+_FLAG_EXTENDED = 0x4000
+_FLAG_STAGE = 0x3000
+_FLAG_NAME_MASK = 0x0FFF
+
+
+class IndexEntry(object):
+    """
+    A ``.git/index`` entry, only fields used by :class:`GitIndexFingerPrint`
+    are kept.
+
+    :type path: str
+    :param path: relative path to the repo root, use ``/`` as separator.
+    :type sha1: str
+    :param sha1: the hex blob id.
+    """
+    __slots__ = ("path", "sha1", "mtime_s", "mtime_ns", "ino", "size", "stage")
+
+    def __init__(self, path, sha1, mtime_s, mtime_ns, ino, size, stage):
+        self.path = path
+        self.sha1 = sha1
+        self.mtime_s = mtime_s
+        self.mtime_ns = mtime_ns
+        self.ino = ino
+        self.size = size
+        self.stage = stage
+
+
+def _read_varint(data, pos):
+    """
+    Read the offset encoded integer index version 4 uses for path prefix
+    compression.
+
+    :rtype: typing.Tuple[int, int]
+    :return: (value, new position)
+    """
+    c = bytearray(data[pos:pos + 1])[0]
+    pos += 1
+    value = c & 0x7F
+    while c & 0x80:
+        value += 1
+        c = bytearray(data[pos:pos + 1])[0]
+        pos += 1
+        value = (value << 7) + (c & 0x7F)
+    return value, pos
+
+
+def read_index(path):
+    """
+    Parse a ``.git/index`` file, version 2, 3 and 4 are supported.
+
+    :type path: str
+    :rtype: typing.Dict[str, IndexEntry]
+    :return: relative path to entry mapping.
+    """
+    with io.open(path, "rb") as f:
+        data = f.read()
+    signature, version, n_entries = struct.unpack(">4sII", data[:12])
+    if signature != b"DIRC":
+        raise ValueError("'{}' is not a git index file!".format(path))
+    if version not in (2, 3, 4):
+        raise ValueError("git index version {} is not supported!".format(version))
+
+    entries = OrderedDict()
+    pos = 12
+    previous_path = b""
+    for _ in range(n_entries):
+        entry_start = pos
+        (
+            _, _, mtime_s, mtime_ns, _, ino, _, _, _, size,
+            sha1, flags,
+        ) = _ENTRY_HEAD.unpack_from(data, pos)
+        pos += _ENTRY_HEAD.size
+        if (version >= 3) and (flags & _FLAG_EXTENDED):
+            pos += 2
+
+        if version == 4:
+            n_strip, pos = _read_varint(data, pos)
+            end = data.index(b"\x00", pos)
+            path_bytes = previous_path[:len(previous_path) - n_strip] + data[pos:end]
+            pos = end + 1
+        else:
+            name_length = flags & _FLAG_NAME_MASK
+            if name_length < _FLAG_NAME_MASK:
+                end = pos + name_length
+            else:
+                end = data.index(b"\x00", pos)
+            path_bytes = data[pos:end]
+            # entries are padded with 1 - 8 NUL to a multiple of 8 bytes
+            pos = entry_start + ((end - entry_start + 8) // 8) * 8
+        previous_path = path_bytes
+
+        entry = IndexEntry(
+            path=path_bytes.decode("utf-8"),
+            sha1=binascii.hexlify(sha1).decode("ascii"),
+            mtime_s=mtime_s,
+            mtime_ns=mtime_ns,
+            ino=ino,
+            size=size,
+            stage=(flags & _FLAG_STAGE) >> 12,
+        )
+        entries[entry.path] = entry
+    return entries
+
+
+def locate_git_dir(repo_dir):
+    """
+    Find the git dir of a work tree, ``.git`` can be a directory or a file
+    pointing to the git dir (work trees and sub modules).
+
+    :type repo_dir: str
+    :rtype: str
+    """
+    dot_git = os.path.join(repo_dir, ".git")
+    if os.path.isdir(dot_git):
+        return dot_git
+    if os.path.isfile(dot_git):
+        with io.open(dot_git, "rb") as f:
+            content = f.read().decode("utf-8").strip()
+        if content.startswith("gitdir:"):
+            git_dir = content[len("gitdir:"):].strip()
+            return os.path.normpath(os.path.join(repo_dir, git_dir))
+    raise EnvironmentError("'{}' is not a git work tree!".format(repo_dir))
+
+
+_fingerprint_engine = FingerPrint("sha1")
+
+
+def git_blob_id(abspath):
+    """
+    Compute the git blob id of a file, same as ``git hash-object``.
+
+    :type abspath: str
+    :rtype: str
+    """
+    m = hashlib.sha1()
+    m.update("blob {}\x00".format(os.path.getsize(abspath)).encode("ascii"))
+    _fingerprint_engine._update_from_file([m, ], abspath)
+    return m.hexdigest()
+
+
+class GitIndexFingerPrint(object):
+    """
+    A fingerprint provider that reads blob ids of clean tracked files from
+    ``.git/index``, and hashes only modified or untracked files.
+
+    A file is clean when its size, mtime and inode match the index entry,
+    and it was not modified in the same second the index was written
+    (git calls that "racily clean", it is hashed to be safe).
+
+    :type repo_dir: str
+    :param repo_dir: the root directory of the git work tree.
+    """
+
+    def __init__(self, repo_dir):
+        self.repo_dir = os.path.abspath(repo_dir)
+        self.path_index = os.path.join(locate_git_dir(self.repo_dir), "index")
+        self._entries = None  # type: typing.Dict[str, IndexEntry]
+        self._index_mtime = None  # type: float
+        self.n_from_index = 0
+        self.n_hashed = 0
+
+    @property
+    def entries(self):
+        """
+        :rtype: typing.Dict[str, IndexEntry]
+        """
+        if self._entries is None:
+            if os.path.exists(self.path_index):
+                self._entries = read_index(self.path_index)
+                self._index_mtime = os.stat(self.path_index).st_mtime
+            else:  # a new repo without any staged file
+                self._entries = OrderedDict()
+                self._index_mtime = 0
+        return self._entries
+
+    def _relpath(self, path):
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.repo_dir)
+        return path.replace(os.sep, "/")
+
+    def is_clean(self, relpath):
+        """
+        Whether the file matches its index entry and the blob id in the
+        index can be trusted.
+
+        :type relpath: str
+        :rtype: bool
+        """
+        entry = self.entries.get(relpath)
+        if (entry is None) or entry.stage:
+            return False
+        st = os.stat(os.path.join(self.repo_dir, *relpath.split("/")))
+        try:
+            mtime_ns = st.st_mtime_ns
+        except AttributeError:  # pragma: no cover
+            mtime_ns = int(st.st_mtime * 1000000000)
+        if (st.st_size & 0xFFFFFFFF) != entry.size:
+            return False
+        if mtime_ns // 1000000000 != entry.mtime_s:
+            return False
+        # some file systems or git builds don't record nano seconds
+        if entry.mtime_ns and (mtime_ns % 1000000000 != entry.mtime_ns):
+            return False
+        if entry.ino and ((st.st_ino & 0xFFFFFFFF) != entry.ino):
+            return False
+        if entry.mtime_s >= int(self._index_mtime):
+            return False
+        return True
+
+    def of_file(self, path):
+        """
+        Return the git blob id of a file.
+
+        :type path: str
+        :param path: absolute path or path relative to the repo root.
+        :rtype: str
+        """
+        relpath = self._relpath(path)
+        if self.is_clean(relpath):
+            self.n_from_index += 1
+            return self.entries[relpath].sha1
+        self.n_hashed += 1
+        return git_blob_id(os.path.join(self.repo_dir, *relpath.split("/")))
+
+    def of_files(self, paths, workers=None):
+        """
+        Return the git blob ids of many files, modified and untracked files
+        are hashed concurrently in a thread pool.
+
+        :type paths: typing.Iterable[str]
+        :type workers: int
+        :rtype: typing.Dict[str, str]
+        :return: an ordered mapping of path to hex blob id.
+        """
+        results = OrderedDict()
+        todo = list()
+        for path in paths:
+            relpath = self._relpath(path)
+            if self.is_clean(relpath):
+                self.n_from_index += 1
+                results[path] = self.entries[relpath].sha1
+            else:
+                results[path] = None
+                todo.append(path)
+
+        if todo:
+            if workers is None:
+                workers = multiprocessing.cpu_count()
+            pool = ThreadPool(max(min(workers, len(todo)), 1))
+            try:
+                blob_ids = pool.map(
+                    git_blob_id,
+                    [
+                        os.path.join(self.repo_dir, *self._relpath(path).split("/"))
+                        for path in todo
+                    ],
+                )
+            finally:
+                pool.close()
+                pool.join()
+            self.n_hashed += len(todo)
+            for path, blob_id in zip(todo, blob_ids):
+                results[path] = blob_id
+        return results
+
+    def of_dir(self, dir_path, exclude=DEFAULT_EXCLUDE, workers=None):
+        """
+        Return the merkle root of git blob ids of all files in a directory,
+        see :meth:`pygitrepo.pkg.fingerprint.FingerPrint.of_dir`.
+
+        :type dir_path: str
+        :param dir_path: absolute path or path relative to the repo root.
+        :type exclude: typing.Union[typing.Iterable[str], IgnoreMatcher]
+        :type workers: int
+        :rtype: str
+        """
+        if not os.path.isabs(dir_path):
+            dir_path = os.path.join(self.repo_dir, dir_path)
+        relpath_list = walk_files(dir_path, exclude=exclude)
+        blob_ids = self.of_files(
+            [
+                os.path.join(dir_path, *relpath.split("/"))
+                for relpath in relpath_list
+            ],
+            workers=workers,
+        ).values()
+        return FingerPrint("sha1").of_named_digests(zip(
+            relpath_list,
+            [binascii.unhexlify(blob_id) for blob_id in blob_ids],
+        ))
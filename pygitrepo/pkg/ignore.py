@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""
+gitignore style path matcher, for ``.pgrignore``.
+
+All rules are compiled into one regular expression, the alternatives are in
+reversed order, so the first alternative that matches is the last matching
+rule, which wins like in ``.gitignore``. :meth:`IgnoreMatcher.walk` prunes
+ignored directories, their files are never listed.
+
+Supported syntax:
+
+- blank lines and lines start with ``#`` are ignored.
+- ``!pattern`` re-includes paths a previous pattern ignored, but not files
+  in an ignored directory.
+- ``pattern/`` only matches directories.
+- a pattern with a ``/`` at the beginning or in the middle is relative to
+  the base directory, otherwise it matches a name at any level.
+- ``*`` and ``?`` don't match ``/``, ``[...]`` is a character class,
+  ``**`` matches any number of directories.
+
+Usage::
+
+    >>> matcher = IgnoreMatcher(["__pycache__/", "*.pyc", "tests/fixtures/"])
+    >>> matcher.match("pkg/mod.pyc")
+    True
+    >>> matcher.walk("/path/to/project")
+    ['pkg/__init__.py', 'pkg/mod.py']
+"""
+
+import io
+import os
+import re
+import json
+
+from pygitrepo.pkg.inventory import get_inventory
+
+DEFAULT_IGNORE = ("__pycache__/", "*.pyc", "*.pyo")
+"""
+Patterns the lambda source code build and the source code copy always use.
+"""
+
+PGRIGNORE = ".pgrignore"
+
+
+def _translate_glob(glob):
+    """
+    Translate a gitignore glob, without the leading and trailing ``/``,
+    to a regular expression without capturing groups.
+
+    :type glob: str
+    :rtype: str
+    """
+    i, n = 0, len(glob)
+    res = list()
+    while i < n:
+        if glob.startswith("**/", i) and (i == 0 or glob[i - 1] == "/"):
+            res.append("(?:.*/)?")
+            i += 3
+            continue
+        if glob.startswith("/**", i) and i + 3 == n:
+            res.append("/.*")
+            i += 3
+            continue
+        c = glob[i]
+        i += 1
+        if c == "*":
+            if i < n and glob[i] == "*":
+                i += 1
+                res.append(".*")
+            else:
+                res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and glob[j] in "!^":
+                j += 1
+            if j < n and glob[j] == "]":
+                j += 1
+            while j < n and glob[j] != "]":
+                j += 1
+            if j >= n:
+                res.append("\\[")
+            else:
+                stuff = glob[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if stuff[0] in "!^":
+                    stuff = "^" + stuff[1:]
+                res.append("[{}]".format(stuff))
+        elif c == "\\" and i < n:
+            res.append(re.escape(glob[i]))
+            i += 1
+        else:
+            res.append(re.escape(c))
+    return "".join(res)
+
+
+def parse_pattern(line):
+    """
+    Parse one line of a ``.pgrignore`` file.
+
+    :type line: str
+    :rtype: typing.Tuple[str, bool, bool]
+    :return: (regex, negate, dir_only), None for blank and comment lines.
+    """
+    line = line.rstrip("\r\n")
+    if not line.endswith("\\ "):
+        line = line.rstrip(" ")
+    if (not line) or line.startswith("#"):
+        return None
+    negate = False
+    if line.startswith("!"):
+        negate = True
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+    dir_only = False
+    if line.endswith("/"):
+        dir_only = True
+        line = line.rstrip("/")
+    if not line:
+        return None
+    anchored = "/" in line
+    line = line.lstrip("/")
+    regex = _translate_glob(line)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex, negate, dir_only
+
+
+class IgnoreMatcher(object):
+    """
+    A compiled set of gitignore style rules.
+
+    :type patterns: typing.Iterable[str]
+    :param patterns: the rules, later rules take precedence.
+    :type base_dir: str
+    :param base_dir: the directory anchored patterns are relative to, by
+        default it is the directory being walked.
+    """
+
+    def __init__(self, patterns=DEFAULT_IGNORE, base_dir=None):
+        self.patterns = list(patterns)
+        self.base_dir = base_dir
+        rules = [
+            rule
+            for rule in [parse_pattern(pattern) for pattern in self.patterns]
+            if rule is not None
+        ]
+        self._dir_regex, self._dir_negate = self._compile(rules)
+        self._file_regex, self._file_negate = self._compile([
+            rule for rule in rules if not rule[2]
+        ])
+
+    @staticmethod
+    def _compile(rules):
+        if not rules:
+            return None, dict()
+        alternatives = list()
+        negate_mapping = dict()
+        for i, (regex, negate, _) in reversed(list(enumerate(rules))):
+            name = "r{}".format(i)
+            alternatives.append("(?P<{}>{})".format(name, regex))
+            negate_mapping[name] = negate
+        regex = re.compile("^(?:{})$".format("|".join(alternatives)), re.DOTALL)
+        return regex, negate_mapping
+
+    @classmethod
+    def from_file(cls, path, extra_patterns=(), base_dir=None):
+        """
+        Read rules from an ignore file, the :data:`DEFAULT_IGNORE` rules are
+        always included. A missing file is fine.
+
+        :type path: str
+        :type extra_patterns: typing.Iterable[str]
+        :param extra_patterns: rules after the ones in the file.
+        :type base_dir: str
+        :param base_dir: default is the directory of the ignore file.
+        :rtype: IgnoreMatcher
+        """
+        patterns = list(DEFAULT_IGNORE)
+        if os.path.exists(path):
+            with io.open(path, "r", encoding="utf-8") as f:
+                patterns.extend(f.read().splitlines())
+        patterns.extend(extra_patterns)
+        if base_dir is None:
+            base_dir = os.path.dirname(os.path.abspath(path))
+        return cls(patterns, base_dir=base_dir)
+
+    def match(self, relpath, is_dir=False):
+        """
+        Test a path against the rules, its parent directories are not tested.
+
+        :type relpath: str
+        :param relpath: ``/`` separated path relative to the base directory.
+        :type is_dir: bool
+        :rtype: bool
+        """
+        if is_dir:
+            regex, negate_mapping = self._dir_regex, self._dir_negate
+        else:
+            regex, negate_mapping = self._file_regex, self._file_negate
+        if regex is None:
+            return False
+        m = regex.match(relpath)
+        if m is None:
+            return False
+        return not negate_mapping[m.lastgroup]
+
+    def is_ignored(self, relpath, is_dir=False):
+        """
+        Like :meth:`match`, but a path in an ignored directory is ignored too.
+
+        :type relpath: str
+        :type is_dir: bool
+        :rtype: bool
+        """
+        parts = relpath.strip("/").split("/")
+        for i in range(1, len(parts)):
+            if self.match("/".join(parts[:i]), is_dir=True):
+                return True
+        return self.match("/".join(parts), is_dir=is_dir)
+
+    def walk(self, dir_path, persist=False):
+        """
+        Find all not ignored files under a directory. Ignored sub
+        directories are pruned, not traversed.
+
+        :type dir_path: str
+        :type persist: bool
+        :param persist: persist the inventory of ``dir_path``, see
+            :func:`~pygitrepo.pkg.inventory.get_inventory`.
+        :rtype: typing.List[str]
+        :return: sorted paths relative to ``dir_path``, ``/`` separated.
+        """
+        if self.base_dir is None:
+            prefix = ""
+        else:
+            prefix = os.path.relpath(dir_path, self.base_dir).replace(os.sep, "/")
+            if prefix == os.curdir:
+                prefix = ""
+            elif prefix.startswith(".."):
+                raise ValueError(
+                    "'{}' is not in '{}'".format(dir_path, self.base_dir)
+                )
+            else:
+                prefix = prefix + "/"
+                if self.is_ignored(prefix, is_dir=True):
+                    return []
+
+        def prune(relpath, is_dir):
+            return self.match(prefix + relpath, is_dir=is_dir)
+
+        inventory = get_inventory(
+            dir_path,
+            persist=persist,
+            prune=prune,
+            prune_key=json.dumps(["pgrignore", prefix, self.patterns]),
+        )
+        return inventory.walk(prune=prune)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+Static import graph of a python package, built with :mod:`ast`. Source code
+is parsed, never imported.
+
+Starting from some entry modules or scripts, :meth:`ImportGraph.reachable`
+finds the package modules they import directly or indirectly. Importing
+``a.b.c`` also runs ``a/__init__.py`` and ``a/b/__init__.py``, they are
+reachable too. Dynamic imports (``importlib.import_module``, ``__import__``,
+plugin loading) can't be seen, the ``allowlist`` keeps them.
+
+Usage::
+
+    >>> graph = ImportGraph.from_dir("/path/to/project", "my_package")
+    >>> graph.reachable(
+    ...     entry_files=["/path/to/project/lambda_app/app.py"],
+    ...     allowlist=["my_package.plugins.*"],
+    ... )
+    {'my_package', 'my_package.api', 'my_package.plugins', ...}
+"""
+
+import io
+import os
+import ast
+import fnmatch
+
+from pygitrepo.pkg.inventory import get_inventory
+
+
+def module_name_of(relpath):
+    """
+    ``pkg/sub/mod.py`` -> ``pkg.sub.mod``, ``pkg/sub/__init__.py`` -> ``pkg.sub``
+
+    :type relpath: str
+    :param relpath: ``/`` separated path relative to the directory on ``sys.path``.
+    :rtype: str
+    """
+    parts = relpath[:-len(".py")].split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def find_imports(source, module_name="", is_package=False):
+    """
+    Find the absolute names of all modules a python source code may import.
+    ``from a import b`` yields both ``a`` and ``a.b``, because ``b`` may be a
+    sub module. Imports in functions and ``try`` blocks are included.
+
+    :type source: typing.Union[str, bytes]
+    :type module_name: str
+    :param module_name: name of the module, to resolve relative imports.
+    :type is_package: bool
+    :param is_package: True if the source is an ``__init__.py``.
+    :rtype: typing.Set[str]
+    """
+    tree = ast.parse(source)
+    if is_package:
+        package = module_name
+    else:
+        package = module_name.rpartition(".")[0]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                names.add(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                parts = package.split(".") if package else []
+                if node.level - 1 > len(parts):
+                    continue  # beyond the top level package
+                base_parts = parts[:len(parts) - (node.level - 1)]
+                if node.module:
+                    base_parts.append(node.module)
+                base = ".".join(base_parts)
+            else:
+                base = node.module
+            if not base:
+                continue
+            names.add(base)
+            for alias in node.names:
+                if alias.name != "*":
+                    names.add("{}.{}".format(base, alias.name))
+    return names
+
+
+def _parents(module_name):
+    parts = module_name.split(".")
+    for i in range(1, len(parts)):
+        yield ".".join(parts[:i])
+
+
+class ImportGraph(object):
+    """
+    :type modules: typing.Dict[str, str]
+    :param modules: module name to source file path of all modules that can
+        be tree shaken.
+    """
+
+    def __init__(self, modules):
+        self.modules = modules
+        self._imports = dict()  # type: typing.Dict[str, typing.Set[str]]
+
+    @classmethod
+    def from_dir(cls, sys_path_dir, package_name, relpath_list=None):
+        """
+        :type sys_path_dir: str
+        :param sys_path_dir: the directory the package is imported from.
+        :type package_name: str
+        :type relpath_list: typing.Iterable[str]
+        :param relpath_list: ``/`` separated paths of files of the package,
+            relative to ``sys_path_dir``. Default is all files.
+        :rtype: ImportGraph
+        """
+        if relpath_list is None:
+            relpath_list = [
+                "{}/{}".format(package_name, relpath)
+                for relpath in get_inventory(
+                    os.path.join(sys_path_dir, package_name)).walk()
+            ]
+        modules = dict()
+        for relpath in relpath_list:
+            if relpath.endswith(".py"):
+                modules[module_name_of(relpath)] = os.path.join(
+                    sys_path_dir, *relpath.split("/"))
+        return cls(modules)
+
+    def imports_of(self, module_name):
+        """
+        Package modules a module imports directly.
+
+        :type module_name: str
+        :rtype: typing.Set[str]
+        """
+        if module_name not in self._imports:
+            path = self.modules[module_name]
+            self._imports[module_name] = self._resolve(find_imports(
+                self._read(path),
+                module_name,
+                is_package=os.path.basename(path) == "__init__.py",
+            ))
+        return self._imports[module_name]
+
+    @staticmethod
+    def _read(path):
+        with io.open(path, "rb") as f:
+            return f.read()
+
+    def _resolve(self, names):
+        resolved = set()
+        for name in names:
+            for candidate in list(_parents(name)) + [name]:
+                if candidate in self.modules:
+                    resolved.add(candidate)
+        return resolved
+
+    def reachable(self, entry_modules=(), entry_files=(), allowlist=()):
+        """
+        Find all package modules the entry points import directly or
+        indirectly.
+
+        :type entry_modules: typing.Iterable[str]
+        :param entry_modules: module names, for example ``my_package.handlers``.
+        :type entry_files: typing.Iterable[str]
+        :param entry_files: paths of scripts outside of the package, for
+            example ``lambda_app/app.py``.
+        :type allowlist: typing.Iterable[str]
+        :param allowlist: ``fnmatch`` patterns of module names that are
+            always reachable, for modules imported dynamically.
+        :rtype: typing.Set[str]
+        """
+        todo = set(self._resolve(entry_modules))
+        for path in entry_files:
+            todo.update(self._resolve(find_imports(self._read(path))))
+        allowlist = list(allowlist)
+        for module_name in self.modules:
+            if any(fnmatch.fnmatch(module_name, pattern) for pattern in allowlist):
+                todo.add(module_name)
+
+        reachable = set()
+        while todo:
+            module_name = todo.pop()
+            if module_name in reachable:
+                continue
+            reachable.add(module_name)
+            todo.update(
+                parent
+                for parent in _parents(module_name)
+                if parent in self.modules
+            )
+            todo.update(self.imports_of(module_name))
+        return reachable
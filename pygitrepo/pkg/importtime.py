@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Profile what a module import costs with ``python -X importtime``
+(Python3.7+), as a tree of imported modules.
+
+``-X importtime`` writes one line per imported module to stderr, children
+before their parent::
+
+    import time: self [us] | cumulative | imported package
+    import time:       344 |        344 |   _json
+    import time:       850 |       1194 |   json.scanner
+    import time:       477 |       1671 | json
+
+Usage::
+
+    >>> roots = profile_import("/path/to/python", ["/tmp/task"], "app")
+    >>> for line in format_tree(roots, min_us=1000):
+    ...     print(line)
+    >>> heaviest(roots, top=10)
+"""
+
+import os
+import tempfile
+import subprocess
+
+_HEADER = "import time: self [us]"
+_PREFIX = "import time:"
+
+
+class ImportTimeNode(object):
+    """
+    One imported module.
+
+    :type name: str
+    :type self_us: int
+    :param self_us: microseconds spent in the module itself.
+    :type cumulative_us: int
+    :param cumulative_us: microseconds including the modules it imports.
+    :type children: typing.List[ImportTimeNode]
+    """
+
+    def __init__(self, name, self_us, cumulative_us, children=None):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.children = children or list()
+
+    def __repr__(self):
+        return "ImportTimeNode(name={!r}, self_us={}, cumulative_us={})".format(
+            self.name, self.self_us, self.cumulative_us)
+
+    def walk(self, depth=0):
+        """
+        Yield (depth, node) of this node and all descendants, parent first.
+
+        :type depth: int
+        """
+        yield depth, self
+        for child in self.children:
+            for item in child.walk(depth + 1):
+                yield item
+
+
+def parse_importtime(text):
+    """
+    Parse the ``-X importtime`` output, other lines are ignored.
+
+    :type text: str
+    :rtype: typing.List[ImportTimeNode]
+    :return: modules imported at the top level, in import order.
+    """
+    # a module is printed after all its children, children wait on the
+    # stack until their parent shows up
+    stack = list()  # type: typing.List[typing.Tuple[int, ImportTimeNode]]
+    for line in text.splitlines():
+        if (not line.startswith(_PREFIX)) or line.startswith(_HEADER):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len(_PREFIX):].split("|", 2)
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue
+        name = name[1:]  # the space after the separator
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        children = list()
+        while stack and stack[-1][0] > depth:
+            children.append(stack.pop()[1])
+        children.reverse()
+        stack.append((depth, ImportTimeNode(
+            name.strip(), self_us, cumulative_us, children)))
+    return [node for _, node in stack]
+
+
+def profile_import(python, sys_path_dirs, module, env=None, cwd=None):
+    """
+    Import a module in a fresh interpreter with ``-X importtime``. ``-B`` is
+    used so no pyc is written, like in a read only lambda deployment package.
+    ``python -c`` puts the current directory before ``PYTHONPATH``, it runs
+    in ``cwd`` so a package in the current directory, for example the project
+    source tree, doesn't shadow the one profiled.
+
+    :type python: str
+    :param python: path to the python interpreter, Python3.7+.
+    :type sys_path_dirs: typing.List[str]
+    :param sys_path_dirs: directories the module is imported from, they are
+        put before the site-packages of the interpreter.
+    :type module: str
+    :type env: typing.Dict[str, str]
+    :type cwd: str
+    :param cwd: the first of ``sys_path_dirs`` by default.
+
+    :rtype: typing.List[ImportTimeNode]
+    :raise subprocess.CalledProcessError: if the import fails, ``output`` is
+        the stderr.
+    """
+    run_env = dict(os.environ if env is None else env)
+    run_env["PYTHONPATH"] = os.pathsep.join(sys_path_dirs)
+    run_env.pop("PYTHONDONTWRITEBYTECODE", None)
+    if cwd is None:
+        cwd = sys_path_dirs[0] if sys_path_dirs else tempfile.gettempdir()
+    args = [python, "-B", "-X", "importtime", "-c", "import {}".format(module)]
+    p = subprocess.Popen(
+        args, env=run_env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = p.communicate()
+    stderr = stderr.decode("utf-8", "replace")
+    if p.returncode:
+        raise subprocess.CalledProcessError(p.returncode, args, output=stderr)
+    return parse_importtime(stderr)
+
+
+def find_module(roots, name):
+    """
+    :type roots: typing.List[ImportTimeNode]
+    :type name: str
+    :rtype: ImportTimeNode
+    :return: None if the module is not imported.
+    """
+    for root in roots:
+        for _, node in root.walk():
+            if node.name == name:
+                return node
+    return None
+
+
+def heaviest(roots, top=10):
+    """
+    The modules that take the most time by themselves.
+
+    :type roots: typing.List[ImportTimeNode]
+    :type top: int
+    :rtype: typing.List[ImportTimeNode]
+    """
+    nodes = [node for root in roots for _, node in root.walk()]
+    nodes.sort(key=lambda node: (-node.self_us, node.name))
+    return nodes[:top]
+
+
+def format_tree(roots, min_us=0, max_depth=None):
+    """
+    The cumulative import cost tree as text lines, heaviest children first.
+    Modules cheaper than ``min_us`` and deeper than ``max_depth`` are hidden.
+
+    :type roots: typing.List[ImportTimeNode]
+    :type min_us: int
+    :type max_depth: int
+    :rtype: typing.List[str]
+    """
+    lines = list()
+
+    def visit(node, depth):
+        if node.cumulative_us < min_us:
+            return
+        lines.append("{:>10.1f} ms {:>10.1f} ms  {}{}".format(
+            node.cumulative_us / 1000.0,
+            node.self_us / 1000.0,
+            "  " * depth,
+            node.name,
+        ))
+        if (max_depth is None) or (depth < max_depth):
+            for child in sorted(node.children, key=lambda n: -n.cumulative_us):
+                visit(child, depth + 1)
+
+    for root in sorted(roots, key=lambda n: -n.cumulative_us):
+        visit(root, 0)
+    return lines
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+"""
+A file inventory of a directory tree: the path and kind of every entry,
+built with ``os.scandir``, files are never ``stat``. Directories a ``prune``
+callback excludes are not traversed at all.
+
+Walks of the same tree in one ``pgr`` invocation share one inventory.
+An inventory is revalidated before it is used again with one ``stat`` per
+directory: the listing of a directory whose mtime didn't change is reused,
+only the directories that changed are listed again, like ``git status``
+does with the untracked cache. It can be persisted in ``~/.cache/pygitrepo``
+so the next invocation starts from it.
+
+Usage::
+
+    >>> inventory = get_inventory("/path/to/my_package")
+    >>> inventory.walk()
+    ['__init__.py', 'sub/mod.py']
+    >>> inventory.get("sub/mod.py")
+    ('f', 1024, 1600000000000000000)
+    >>> get_inventory(
+    ...     "/path/to/my_package",
+    ...     prune=lambda relpath, is_dir: is_dir and relpath.endswith("__pycache__"),
+    ...     prune_key="no-pycache",
+    ... )
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import threading
+
+try:
+    from os import scandir
+except ImportError:  # pragma: no cover
+    scandir = None
+
+KIND_FILE = "f"
+KIND_DIR = "d"
+KIND_LINK = "l"
+"""
+A symlink to a directory, it is listed but not traversed, like ``os.walk``.
+"""
+
+RACY_WINDOW_NS = 2 * 10 ** 9
+"""
+A directory modified this close to the scan may change again within the
+same mtime tick, its listing is never reused.
+"""
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "pygitrepo", "inventory",
+)
+"""
+Where :func:`get_inventory` persists inventories.
+"""
+
+NO_CACHE_ENV_VAR = "PYGITREPO_NO_INVENTORY_CACHE"
+"""
+Set this environment variable to any non empty value to never read or write
+a persisted inventory.
+"""
+
+
+def _mtime_ns(st):
+    try:
+        return st.st_mtime_ns
+    except AttributeError:  # pragma: no cover
+        return int(st.st_mtime * 10 ** 9)
+
+
+def _time_ns():
+    try:
+        return time.time_ns()
+    except AttributeError:  # pragma: no cover
+        return int(time.time() * 10 ** 9)
+
+
+class _ListDirEntry(object):  # pragma: no cover
+    """
+    The subset of ``os.DirEntry`` the inventory uses, for Python2.
+    """
+
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.path.isdir(self.path)
+        return os.path.isdir(self.path) and not os.path.islink(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+def _scandir(dirname):
+    if scandir is not None:
+        return list(scandir(dirname))
+    return [  # pragma: no cover
+        _ListDirEntry(dirname, name) for name in os.listdir(dirname)
+    ]
+
+
+def _join(reldir, name):
+    return name if not reldir else reldir + "/" + name
+
+
+_FORMAT_VERSION = 2
+
+
+class Inventory(object):
+    """
+    :type root: str
+    :param root: absolute path of the directory.
+    :type prune: typing.Callable[[str, bool], bool]
+    :param prune: ``prune(relpath, True)`` returns True to never traverse a
+        sub directory, see :meth:`walk`.
+
+    :param entries: ``{relpath: kind}``, ``relpath`` is ``/`` separated, the
+        root itself is ``""``.
+    :param dirs: ``{reldir: (mtime_ns, child names)}`` of traversed directories.
+    :param scanned_at: nano seconds timestamp of the last scan or refresh.
+    :param n_listed: number of directories listed by the last scan or refresh.
+    :param n_reused: number of directory listings reused by the last refresh.
+    """
+
+    def __init__(self, root, prune=None):
+        self.root = os.path.abspath(root)
+        self.prune = prune
+        self.entries = dict()  # type: typing.Dict[str, str]
+        self.dirs = dict()  # type: typing.Dict[str, typing.Tuple[int, typing.List[str]]]
+        self.scanned_at = 0
+        self.n_listed = 0
+        self.n_reused = 0
+
+    def _abspath(self, relpath):
+        if not relpath:
+            return self.root
+        return os.path.join(self.root, *relpath.split("/"))
+
+    def _list(self, reldir, abspath):
+        names = list()
+        for entry in _scandir(abspath):
+            try:
+                # the file type comes with the listing, no stat is needed
+                if entry.is_dir(follow_symlinks=False):
+                    kind = KIND_DIR
+                elif entry.is_dir():
+                    kind = KIND_LINK
+                elif entry.is_symlink() and not os.path.exists(entry.path):
+                    continue  # broken symlink
+                else:
+                    kind = KIND_FILE
+            except OSError:  # removed while listing
+                continue
+            self.entries[_join(reldir, entry.name)] = kind
+            names.append(entry.name)
+        names.sort()
+        self.n_listed += 1
+        return names
+
+    def _visit(self, reldir, old_dirs, old_entries, racy_since):
+        abspath = self._abspath(reldir)
+        mtime = _mtime_ns(os.stat(abspath))
+        self.entries[reldir] = KIND_DIR
+        old = old_dirs.get(reldir)
+        names = None
+        if (old is not None) and (old[0] == mtime) and (mtime < racy_since):
+            # nothing is added, removed or renamed in this directory
+            try:
+                for name in old[1]:
+                    relpath = _join(reldir, name)
+                    self.entries[relpath] = old_entries[relpath]
+                names = old[1]
+                self.n_reused += 1
+            except KeyError:
+                names = None
+        if names is None:
+            names = self._list(reldir, abspath)
+        self.dirs[reldir] = (mtime, names)
+        for name in names:
+            relpath = _join(reldir, name)
+            if self.entries[relpath] != KIND_DIR:
+                continue
+            if (self.prune is not None) and self.prune(relpath, True):
+                continue
+            try:
+                self._visit(relpath, old_dirs, old_entries, racy_since)
+            except OSError:  # removed while scanning, or no permission
+                pass
+
+    def scan(self):
+        """
+        List the whole tree from scratch.
+        """
+        self.entries, self.dirs = dict(), dict()
+        self._refresh(dict(), dict())
+
+    def refresh(self):
+        """
+        Bring the inventory up to date. Directories are listed again only if
+        their mtime changed, files are not ``stat``.
+        """
+        self._refresh(self.dirs, self.entries)
+
+    def _refresh(self, old_dirs, old_entries):
+        racy_since = self.scanned_at - RACY_WINDOW_NS
+        self.entries, self.dirs = dict(), dict()
+        self.n_listed, self.n_reused = 0, 0
+        self.scanned_at = _time_ns()
+        try:
+            self._visit("", old_dirs, old_entries, racy_since)
+        except OSError:  # the root doesn't exist, the inventory is empty
+            pass
+
+    def get(self, relpath):
+        """
+        :type relpath: str
+        :rtype: typing.Tuple[str, int, int]
+        :return: (kind, size, mtime_ns), size and mtime are ``stat`` now.
+            None if not exists.
+        """
+        kind = self.entries.get(relpath)
+        if kind is None:
+            return None
+        try:
+            st = os.stat(self._abspath(relpath))
+        except OSError:
+            return None
+        return kind, st.st_size, _mtime_ns(st)
+
+    def walk(self, reldir="", prune=None):
+        """
+        Find all files under a sub directory.
+
+        :type reldir: str
+        :param reldir: ``/`` separated path of the sub directory.
+        :type prune: typing.Callable[[str, bool], bool]
+        :param prune: ``prune(relpath, is_dir)`` returns True to skip a file,
+            or a directory and everything in it. ``relpath`` is relative to
+            ``reldir``. Directories pruned by the ``prune`` of the inventory
+            are always skipped.
+        :rtype: typing.List[str]
+        :return: sorted paths relative to ``reldir``, ``/`` separated.
+        """
+        reldir = reldir.strip("/")
+        if reldir not in self.dirs:
+            return []
+        prefix_length = len(reldir) + 1 if reldir else 0
+        relpath_list = list()
+        stack = [reldir]
+        while stack:
+            dirname = stack.pop()
+            for name in self.dirs[dirname][1]:
+                path = _join(dirname, name)
+                kind = self.entries.get(path)
+                relpath = path[prefix_length:]
+                if kind == KIND_DIR:
+                    if path not in self.dirs:
+                        continue
+                    if (prune is None) or (not prune(relpath, True)):
+                        stack.append(path)
+                elif kind == KIND_FILE:
+                    if (prune is None) or (not prune(relpath, False)):
+                        relpath_list.append(relpath)
+        relpath_list.sort()
+        return relpath_list
+
+    def to_dict(self):
+        """
+        :rtype: dict
+        """
+        return {
+            "version": _FORMAT_VERSION,
+            "root": self.root,
+            "scanned_at": self.scanned_at,
+            "dirs": self.dirs,
+            "entries": self.entries,
+        }
+
+    def save(self, path):
+        """
+        Write the inventory to a json file.
+
+        :type path: str
+        """
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with io.open(tmp_path, "wb") as f:
+            f.write(json.dumps(self.to_dict(), separators=(",", ":")).encode("utf-8"))
+        if os.path.exists(path):  # os.replace is Python3 only
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, root, prune=None):
+        """
+        Read an inventory saved by :meth:`save`, it needs :meth:`refresh`
+        before use.
+
+        :type path: str
+        :type root: str
+        :type prune: typing.Callable[[str, bool], bool]
+        :rtype: Inventory
+        :return: None if the file is missing, broken or of another root.
+        """
+        try:
+            with io.open(path, "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+            inventory = cls(root, prune=prune)
+            if (data.get("version") != _FORMAT_VERSION) \
+                    or (data["root"] != inventory.root):
+                return None
+            inventory.scanned_at = data["scanned_at"]
+            inventory.dirs = {
+                reldir: (mtime, names)
+                for reldir, (mtime, names) in data["dirs"].items()
+            }
+            inventory.entries = dict(data["entries"])
+            return inventory
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+def cache_path(root, cache_dir=DEFAULT_CACHE_DIR, prune_key=""):
+    """
+    Where the inventory of a directory is persisted.
+
+    :type root: str
+    :type cache_dir: str
+    :type prune_key: str
+    :rtype: str
+    """
+    key = hashlib.sha1(
+        (os.path.abspath(root) + "\0" + prune_key).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key + ".json")
+
+
+_inventories = dict()  # type: typing.Dict[typing.Tuple[str, str], Inventory]
+_inventories_lock = threading.Lock()
+
+
+def get_inventory(root, persist=False, cache_dir=DEFAULT_CACHE_DIR,
+                  prune=None, prune_key=None):
+    """
+    Get the up to date inventory of a directory. The first call in a process
+    scans the tree, or starts from the persisted inventory if ``persist``,
+    later calls refresh the same inventory.
+
+    :type root: str
+    :type persist: bool
+    :param persist: read and write the inventory in ``cache_dir``.
+    :type cache_dir: str
+    :type prune: typing.Callable[[str, bool], bool]
+    :param prune: sub directories never traversed, see :class:`Inventory`.
+    :type prune_key: str
+    :param prune_key: identify what ``prune`` excludes, inventories of the
+        same root with different keys are different. Required with ``prune``.
+    :rtype: Inventory
+    """
+    if (prune is not None) and (prune_key is None):
+        raise ValueError("prune_key is required with prune!")
+    prune_key = prune_key or ""
+    root = os.path.abspath(root)
+    persist = persist and (not os.environ.get(NO_CACHE_ENV_VAR))
+    path = cache_path(root, cache_dir, prune_key)
+    with _inventories_lock:
+        inventory = _inventories.get((root, prune_key))
+        if (inventory is None) and persist:
+            inventory = Inventory.load(path, root, prune=prune)
+        if inventory is None:
+            inventory = Inventory(root, prune=prune)
+            inventory.scan()
+        else:
+            inventory.prune = prune
+            inventory.refresh()
+        _inventories[(root, prune_key)] = inventory
+        if persist:
+            try:
+                inventory.save(path)
+            except (IOError, OSError):  # pragma: no cover
+                pass
+        return inventory
+
+
+def clear_cache():
+    """
+    Forget all inventories of this process.
+    """
+    with _inventories_lock:
+        _inventories.clear()
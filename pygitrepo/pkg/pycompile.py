@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Byte compile python source code in parallel into a separate directory, in
+the ``__pycache__`` layout, with unchecked hash based pyc (PEP 552). An
+unchecked pyc is loaded without even a ``stat`` of its source, and it doesn't
+depend on the mtime, so it works in a read only, mtime normalized AWS Lambda
+deployment package.
+
+A pyc only works with the Python minor version that wrote it. This module
+has no dependency, so the target interpreter can run it as a script::
+
+    echo '[["/path/to/mypkg/api.py", "mypkg/api.py"]]' | /path/to/python3.8 pycompile.py compile ./build/pycache
+    /path/to/python3.8 pycompile.py import-time /tmp/extracted mypkg
+
+Requires Python3.7+ for the ``compile`` command.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import subprocess
+
+
+def pyc_arcname(arcname):
+    """
+    The ``__pycache__`` path of a source file for the running interpreter,
+    for example ``pkg/mod.py`` -> ``pkg/__pycache__/mod.cpython-38.pyc``.
+
+    :type arcname: str
+    :rtype: str
+    """
+    import importlib.util
+
+    return importlib.util.cache_from_source(arcname).replace(os.sep, "/")
+
+
+def _compile_task(task):
+    import py_compile
+
+    source_path, arcname, dir_out = task
+    cfile = os.path.join(dir_out, *pyc_arcname(arcname).split("/"))
+    py_compile.compile(
+        source_path,
+        cfile=cfile,
+        dfile=arcname,
+        doraise=True,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+    return cfile
+
+
+def compile_files(to_compile_list, dir_out, workers=None):
+    """
+    Byte compile source files concurrently in a process pool.
+
+    :type to_compile_list: typing.List[typing.Tuple[str, str]]
+    :param to_compile_list: (source path, archive path) pairs.
+    :type dir_out: str
+    :param dir_out: pyc are written to ``${dir_out}/${pyc_arcname}``
+    :type workers: int
+
+    :rtype: typing.List[typing.Tuple[str, str]]
+    :return: (pyc path, pyc archive path) pairs, same order as the input.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = [
+        (source_path, arcname, dir_out)
+        for source_path, arcname in to_compile_list
+    ]
+    if (workers == 1) or (len(tasks) <= 1):
+        cfiles = [_compile_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            cfiles = list(executor.map(_compile_task, tasks, chunksize=16))
+    return [
+        (cfile, pyc_arcname(arcname))
+        for cfile, (_, arcname, _) in zip(cfiles, tasks)
+    ]
+
+
+def measure_import_time(python, sys_path_dir, module, repeat=5, env=None):
+    """
+    Measure how long a fresh interpreter takes to import a module, minus the
+    time to start an interpreter, the best of ``repeat`` runs. ``-B`` is used
+    so no pyc is written, like in a read only lambda deployment package.
+    It runs in ``sys_path_dir``, ``python -c`` puts the current directory
+    before ``PYTHONPATH`` and a project tree there would be imported instead.
+
+    :type python: str
+    :param python: path to the python interpreter.
+    :type sys_path_dir: str
+    :param sys_path_dir: the directory the module is imported from.
+    :type module: str
+    :type repeat: int
+    :rtype: float
+    :return: seconds
+    """
+    run_env = dict(os.environ if env is None else env)
+    run_env["PYTHONPATH"] = sys_path_dir
+    run_env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    def best_of(code):
+        best = None
+        for _ in range(repeat):
+            st = time.time()
+            subprocess.check_call(
+                [python, "-B", "-c", code], env=run_env, cwd=sys_path_dir)
+            elapsed = time.time() - st
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+    baseline = best_of("pass")
+    return max(best_of("import {}".format(module)) - baseline, 0.0)
+
+
+def main(argv=None):
+    """
+    ``compile ${dir_out}``: reads the json list of (source path, archive
+    path) from stdin, prints the json list of (pyc path, pyc archive path).
+
+    ``import-time ${sys_path_dir} ${module}``: prints the seconds.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0]
+    if command == "compile":
+        to_compile_list = json.loads(sys.stdin.read())
+        print(json.dumps(compile_files(to_compile_list, argv[1])))
+    elif command == "import-time":
+        print(measure_import_time(sys.executable, argv[1], argv[2]))
+    else:
+        raise ValueError("unknown command '{}'".format(command))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stream bytes into an AWS S3 object while they are produced, with multipart
+upload, so a build artifact doesn't have to be written to disk and read
+back before upload.
+
+The final key of a lambda artifact is the md5 of its content, it is unknown
+until the last byte is written. Bytes are buffered until a full part is
+ready:
+
+- an artifact smaller than one part is uploaded with a single ``PutObject``
+  to the final key when it is complete.
+- a larger one is uploaded part by part to a staging key, then copied part
+  by part to the final key on the server side. The part boundaries are the
+  same, so the ETag is the same multipart ETag ``aws s3 cp`` would give.
+
+The server side copy moves no bytes through the client, but it costs one
+``UploadPartCopy`` request per part, and the staging object is stored
+until the copy is done. When the final key is known in advance, pass it as
+``final_key``, parts go straight there and there is no copy. Parts are
+uploaded synchronously in ``write()``, the producer waits for each upload.
+
+Where the bytes go is pluggable, a target is any object with the methods
+of :class:`Boto3Target`. :class:`LocalDirTarget` is a local directory
+stand-in for tests and offline builds. A boto3 client of moto or MinIO
+(``endpoint_url``) works with :class:`Boto3Target`.
+
+Usage::
+
+    >>> upload = StreamingUpload(Boto3Target(s3_client, "my-bucket"), "tmp/staging.zip")
+    >>> writer = HashingWriter(upload, ["md5"], s3_etag=True)
+    >>> build_zip(writer, to_zip_list)
+    >>> upload.commit("lambda/{}.zip".format(writer.digests["md5"].hex), etag=writer.s3_etag)
+"""
+
+import io
+import os
+import json
+import uuid
+import hashlib
+
+from pygitrepo.pkg.fingerprint import S3_DEFAULT_PART_SIZE
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+"""
+All parts but the last one of a multipart upload must be at least this large.
+"""
+
+
+def _multipart_etag(part_md5_digests):
+    m = hashlib.md5()
+    m.update(b"".join(part_md5_digests))
+    return "{}-{}".format(m.hexdigest(), len(part_md5_digests))
+
+
+class Boto3Target(object):
+    """
+    Upload to a S3 bucket with a boto3 S3 client, or any object with the
+    same API.
+
+    :param client: ``boto3.client("s3")``
+    :type bucket: str
+    """
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def head_etag(self, key):
+        """
+        :type key: str
+        :rtype: str
+        :return: the ETag without double quotes, None if the object doesn't
+            exist or we cannot get it.
+        """
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception:
+            return None
+        return response["ETag"].strip('"')
+
+    def put_object(self, key, body, metadata):
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=body, Metadata=metadata,
+        )
+
+    def create_multipart_upload(self, key, metadata):
+        """
+        :rtype: str
+        :return: upload id
+        """
+        response = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, Metadata=metadata,
+        )
+        return response["UploadId"]
+
+    def upload_part(self, key, upload_id, part_number, body):
+        """
+        :rtype: str
+        :return: the part ETag
+        """
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            PartNumber=part_number, Body=body,
+        )
+        return response["ETag"]
+
+    def upload_part_copy(self, key, upload_id, part_number, source_key, first_byte, last_byte):
+        """
+        Copy a byte range of another object as a part, on the server side.
+
+        :rtype: str
+        :return: the part ETag
+        """
+        response = self.client.upload_part_copy(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource={"Bucket": self.bucket, "Key": source_key},
+            CopySourceRange="bytes={}-{}".format(first_byte, last_byte),
+        )
+        return response["CopyPartResult"]["ETag"]
+
+    def complete_multipart_upload(self, key, upload_id, part_etags):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": [
+                {"ETag": etag, "PartNumber": i}
+                for i, etag in enumerate(part_etags, 1)
+            ]},
+        )
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+        )
+
+    def delete_object(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+class LocalDirTarget(object):
+    """
+    A local directory that behaves like a S3 bucket, the ETag and the
+    metadata of an object are in ``${key}.meta.json``.
+
+    :type root: str
+    """
+
+    _META_SUFFIX = ".meta.json"
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        """
+        :type key: str
+        :rtype: str
+        """
+        return os.path.join(self.root, *key.split("/"))
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, ".uploads", upload_id)
+
+    def _write(self, key, chunks, etag, metadata):
+        path = self.path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        with io.open(path + self._META_SUFFIX, "wb") as f:
+            f.write(json.dumps(dict(ETag=etag, Metadata=metadata)).encode("utf-8"))
+
+    def head(self, key):
+        """
+        :type key: str
+        :rtype: dict
+        :return: ``ETag`` and ``Metadata``, None if not exists.
+        """
+        try:
+            with io.open(self.path(key) + self._META_SUFFIX, "rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError):
+            return None
+
+    def head_etag(self, key):
+        meta = self.head(key)
+        return None if meta is None else meta["ETag"]
+
+    def put_object(self, key, body, metadata):
+        body = bytes(body)
+        self._write(key, [body], hashlib.md5(body).hexdigest(), metadata)
+
+    def create_multipart_upload(self, key, metadata):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id))
+        with io.open(os.path.join(self._upload_dir(upload_id), "metadata.json"), "wb") as f:
+            f.write(json.dumps(metadata).encode("utf-8"))
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, body):
+        body = bytes(body)
+        with io.open(os.path.join(self._upload_dir(upload_id), str(part_number)), "wb") as f:
+            f.write(body)
+        return hashlib.md5(body).hexdigest()
+
+    def upload_part_copy(self, key, upload_id, part_number, source_key, first_byte, last_byte):
+        with io.open(self.path(source_key), "rb") as f:
+            f.seek(first_byte)
+            body = f.read(last_byte - first_byte + 1)
+        return self.upload_part(key, upload_id, part_number, body)
+
+    def complete_multipart_upload(self, key, upload_id, part_etags):
+        dir_upload = self._upload_dir(upload_id)
+        with io.open(os.path.join(dir_upload, "metadata.json"), "rb") as f:
+            metadata = json.loads(f.read().decode("utf-8"))
+        chunks = list()
+        for i in range(1, len(part_etags) + 1):
+            with io.open(os.path.join(dir_upload, str(i)), "rb") as f:
+                chunks.append(f.read())
+        etag = _multipart_etag([hashlib.md5(chunk).digest() for chunk in chunks])
+        self._write(key, chunks, etag, metadata)
+        self.abort_multipart_upload(key, upload_id)
+
+    def abort_multipart_upload(self, key, upload_id):
+        dir_upload = self._upload_dir(upload_id)
+        for basename in os.listdir(dir_upload):
+            os.remove(os.path.join(dir_upload, basename))
+        os.rmdir(dir_upload)
+
+    def delete_object(self, key):
+        for path in [self.path(key), self.path(key) + self._META_SUFFIX]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TeeWriter(object):
+    """
+    A write only file-like object that writes to many file objects.
+
+    :type fileobjs: typing.List[typing.BinaryIO]
+    """
+
+    def __init__(self, fileobjs):
+        self.fileobjs = fileobjs
+
+    def write(self, data):
+        for fileobj in self.fileobjs:
+            fileobj.write(data)
+        return len(data)
+
+    def flush(self):
+        for fileobj in self.fileobjs:
+            fileobj.flush()
+
+
+class StreamingUpload(object):
+    """
+    A write only file-like object, bytes written are uploaded in parts of
+    ``part_size`` as soon as a part is full. Call :meth:`commit` when done,
+    or :meth:`abort` on error.
+
+    :param target: where to upload, see :class:`Boto3Target`.
+    :type staging_key: str
+    :param staging_key: where the parts go before the final key is known.
+    :type part_size: int
+    :param part_size: the same as the ``aws s3 cp`` multipart chunk size by
+        default, so the ETag can be compared with a local file.
+    :type final_key: str
+    :param final_key: the final key if it is known in advance, parts are
+        uploaded to it directly instead of the staging key, :meth:`commit`
+        only accepts this key.
+    :type metadata: typing.Dict[str, str]
+    :param metadata: the object metadata when ``final_key`` is given.
+
+    :param n_parts: number of parts uploaded while writing.
+    """
+
+    def __init__(self, target, staging_key, part_size=S3_DEFAULT_PART_SIZE,
+                 final_key=None, metadata=None):
+        if part_size < S3_MIN_PART_SIZE:
+            raise ValueError("part size must be at least {}".format(S3_MIN_PART_SIZE))
+        self.target = target
+        self.staging_key = staging_key
+        self.final_key = final_key
+        self.metadata = metadata or {}
+        self.part_size = part_size
+        self.size = 0
+        self.upload_id = None
+        self.part_etags = list()
+        self.part_sizes = list()
+        self._buffer = bytearray()
+
+    @property
+    def n_parts(self):
+        return len(self.part_etags)
+
+    @property
+    def upload_key(self):
+        """
+        Where the parts are uploaded to.
+
+        :rtype: str
+        """
+        return self.staging_key if self.final_key is None else self.final_key
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.target.create_multipart_upload(
+                self.upload_key,
+                {} if self.final_key is None else self.metadata,
+            )
+        self.part_etags.append(self.target.upload_part(
+            self.upload_key, self.upload_id, len(self.part_etags) + 1, body,
+        ))
+        self.part_sizes.append(len(body))
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            body = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._upload_part(body)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def abort(self):
+        """
+        Discard everything uploaded so far.
+        """
+        if self.upload_id is not None:
+            self.target.abort_multipart_upload(self.upload_key, self.upload_id)
+            self.upload_id = None
+
+    def commit(self, key, metadata=None, etag=None):
+        """
+        Store the uploaded bytes at the final key.
+
+        :type key: str
+        :type metadata: typing.Dict[str, str]
+        :param metadata: ignored when ``final_key`` is given, the one passed
+            to the constructor is used.
+        :type etag: str
+        :param etag: the expected ETag, if the object at ``key`` already has
+            it, nothing is uploaded.
+        :rtype: bool
+        :return: False if the object already exists.
+        """
+        if self.final_key is not None:
+            if key != self.final_key:
+                raise ValueError("the final key is {!r}, not {!r}".format(
+                    self.final_key, key))
+            metadata = self.metadata
+        metadata = metadata or {}
+        if (etag is not None) and (self.target.head_etag(key) == etag):
+            self.abort()
+            return False
+
+        if self.upload_id is None:
+            self.target.put_object(key, bytes(self._buffer), metadata)
+            self._buffer = bytearray()
+            return True
+
+        if self._buffer:
+            self._upload_part(bytes(self._buffer))
+            self._buffer = bytearray()
+        try:
+            self.target.complete_multipart_upload(
+                self.upload_key, self.upload_id, self.part_etags)
+        except Exception:
+            self.abort()
+            raise
+        self.upload_id = None
+        if self.final_key is not None:
+            return True
+        try:
+            upload_id = self.target.create_multipart_upload(key, metadata)
+            try:
+                part_etags = list()
+                first_byte = 0
+                for part_number, part_size in enumerate(self.part_sizes, 1):
+                    part_etags.append(self.target.upload_part_copy(
+                        key, upload_id, part_number, self.staging_key,
+                        first_byte, first_byte + part_size - 1,
+                    ))
+                    first_byte += part_size
+                self.target.complete_multipart_upload(key, upload_id, part_etags)
+            except Exception:
+                self.target.abort_multipart_upload(key, upload_id)
+                raise
+        finally:
+            self.target.delete_object(self.staging_key)
+        return True
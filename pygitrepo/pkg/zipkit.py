@@ -0,0 +1,1143 @@
+# -*- coding: utf-8 -*-
+
+"""
+A zip archive writer working at the member level. A member is a
+:class:`zipfile.ZipInfo` plus its raw (already compressed) bytes, so members
+can be copied from an existing archive without being decompressed and
+compressed again, and the output file object doesn't need to be seekable.
+
+Usage::
+
+    >>> with io.open("source.zip", "wb") as f:
+    ...     stats = build_zip(f, [("/path/to/a.py", "a.py")], previous="old.zip")
+    >>> stats
+    {"n_members": 1, "n_reused": 1, "n_compressed": 0}
+
+Or from the command line, members are compressed with all CPU cores::
+
+    python -m pygitrepo.pkg.zipkit layer.zip ./build/lambda/python -p python/ -x "python/boto3*"
+
+Reference: https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+"""
+
+import io
+import os
+import re
+import sys
+import stat
+import time
+import zlib
+import json
+import hashlib
+import struct
+import fnmatch
+import zipfile
+import tempfile
+import itertools
+import multiprocessing
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
+
+try:
+    from pygitrepo.pkg.inventory import get_inventory
+except ImportError:  # pragma: no cover, run as a copied standalone script
+    get_inventory = None
+
+try:
+    import bz2
+except ImportError:  # pragma: no cover
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+# not in Python2 zipfile
+ZIP_BZIP2 = 12
+ZIP_LZMA = 14
+
+# same layouts as the private ones in :mod:`zipfile`
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL_DIR = struct.Struct("<4s4B4HL2L5H2L")
+_END_ARCHIVE = struct.Struct("<4s4H2LH")
+_END_ARCHIVE64 = struct.Struct("<4sQ2H2L4Q")
+_END_ARCHIVE64_LOCATOR = struct.Struct("<4sLQL")
+_LOCAL_MAGIC = b"PK\x03\x04"
+_CENTRAL_MAGIC = b"PK\x01\x02"
+_END_MAGIC = b"PK\x05\x06"
+_END_MAGIC64 = b"PK\x06\x06"
+_END_LOCATOR_MAGIC64 = b"PK\x06\x07"
+_ZIP64_EXTRA_ID = 0x0001
+
+_FLAG_UTF8 = 0x800
+_FLAG_LZMA_EOS = 0x02
+_BZIP2_VERSION = 46
+_LZMA_VERSION = 63
+_ZIP64_VERSION = 45
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP32_MAX_MEMBERS = 0xFFFF
+
+# the zip format stores time in 2 seconds resolution
+_DOS_TIME_RESOLUTION = 2
+
+DOS_EPOCH = 315532800
+"""
+1980-01-01 00:00:00 UTC, the earliest time a zip archive can store.
+"""
+
+REPRODUCIBLE_COMPRESSLEVEL = 6
+"""
+The fixed deflate level of a reproducible build.
+"""
+
+_CREATE_SYSTEM_UNIX = 3
+
+STREAM_THRESHOLD = 1024 * 1024
+"""
+Files larger than this are compressed chunk by chunk into a temp file, and
+members larger than this are copied chunk by chunk, instead of in memory.
+"""
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def source_date_epoch():
+    """
+    The timestamp of all members in a reproducible build, from the
+    ``SOURCE_DATE_EPOCH`` environment variable, default :data:`DOS_EPOCH`.
+    See https://reproducible-builds.org/specs/source-date-epoch/
+
+    :rtype: typing.Tuple[int, int, int, int, int, int]
+    """
+    epoch = max(int(os.environ.get("SOURCE_DATE_EPOCH", DOS_EPOCH)), DOS_EPOCH)
+    return time.gmtime(epoch)[0:6]
+
+
+def make_zinfo(source_path, arcname, compress_type=ZIP_STORED, reproducible=False):
+    """
+    Create the :class:`zipfile.ZipInfo` of a file the same way
+    :meth:`zipfile.ZipFile.write` does.
+
+    :type source_path: str
+    :type arcname: str
+    :type compress_type: int
+
+    :type reproducible: bool
+    :param reproducible: if True, use :func:`source_date_epoch` instead of
+        the mtime, permission is normalized to ``0o644`` (``0o755`` if it is
+        executable by owner) and the creator system is always unix.
+
+    :rtype: ZipInfo
+    """
+    st = os.stat(source_path)
+    if reproducible:
+        date_time = source_date_epoch()
+    else:
+        date_time = time.localtime(st.st_mtime)[0:6]
+    zinfo = ZipInfo(arcname.replace(os.sep, "/"), date_time)
+    if reproducible:
+        mode = 0o755 if (st.st_mode & stat.S_IXUSR) else 0o644
+        zinfo.external_attr = (stat.S_IFREG | mode) << 16
+        zinfo.create_system = _CREATE_SYSTEM_UNIX
+    else:
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    zinfo.compress_type = compress_type
+    return zinfo
+
+
+def _new_compressor(compress_type=ZIP_STORED, compresslevel=None):
+    """
+    :rtype: tuple
+    :return: (compressor, header), compressor is None for ``ZIP_STORED``,
+        header are the bytes before the compressed stream.
+    """
+    if compress_type == ZIP_STORED:
+        return None, b""
+    elif compress_type == ZIP_DEFLATED:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        return zlib.compressobj(compresslevel, zlib.DEFLATED, -15), b""
+    elif compress_type == ZIP_BZIP2 and bz2 is not None:
+        return bz2.BZ2Compressor(compresslevel or 9), b""
+    elif compress_type == ZIP_LZMA and lzma is not None:
+        # the same raw LZMA1 stream with a properties header zipfile writes
+        props = lzma._encode_filter_properties({"id": lzma.FILTER_LZMA1})
+        compressor = lzma.LZMACompressor(
+            lzma.FORMAT_RAW,
+            filters=[lzma._decode_filter_properties(lzma.FILTER_LZMA1, props)],
+        )
+        return compressor, struct.pack("<BBH", 9, 4, len(props)) + props
+    else:
+        raise NotImplementedError(
+            "compress type {} is not supported!".format(compress_type))
+
+
+def compress(data, compress_type=ZIP_STORED, compresslevel=None):
+    """
+    Compress bytes to the raw member data of ``compress_type``.
+
+    :type data: bytes
+    :type compress_type: int
+    :type compresslevel: int
+    :rtype: bytes
+    """
+    compressor, header = _new_compressor(compress_type, compresslevel)
+    if compressor is None:
+        return data
+    return header + compressor.compress(data) + compressor.flush()
+
+
+class SpooledRaw(object):
+    """
+    Raw member data in a temp file, the file is deleted on :meth:`close`.
+    It only holds the path, so it can be returned by a process pool worker.
+
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def read(self, size=-1):
+        if self._f is None:
+            self._f = io.open(self.path, "rb")
+        return self._f.read(size)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def compress_file(source_path,
+                  arcname,
+                  compress_type=ZIP_STORED,
+                  compresslevel=None,
+                  reproducible=False):
+    """
+    Read and compress a file. A file larger than :data:`STREAM_THRESHOLD` is
+    compressed chunk by chunk into a temp file.
+
+    :rtype: typing.Tuple[ZipInfo, typing.Union[bytes, SpooledRaw]]
+    :return: the member info with CRC and sizes, and the raw member data,
+        a :class:`SpooledRaw` for a large file, the caller has to close it.
+    """
+    zinfo = make_zinfo(source_path, arcname, compress_type, reproducible)
+    if zinfo.file_size <= STREAM_THRESHOLD:
+        with io.open(source_path, "rb") as f:
+            data = f.read()
+        zinfo.file_size = len(data)
+        zinfo.CRC = zlib.crc32(data) & 0xFFFFFFFF
+        raw = compress(data, compress_type, compresslevel)
+        zinfo.compress_size = len(raw)
+        return zinfo, raw
+
+    compressor, header = _new_compressor(compress_type, compresslevel)
+    fd, path = tempfile.mkstemp(suffix=".zipkit")
+    raw = SpooledRaw(path)
+    try:
+        crc, file_size = 0, 0
+        with io.open(fd, "wb") as f_out, io.open(source_path, "rb") as f_in:
+            f_out.write(header)
+            while True:
+                chunk = f_in.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                f_out.write(chunk)
+            if compressor is not None:
+                f_out.write(compressor.flush())
+            zinfo.compress_size = f_out.tell()
+        zinfo.file_size = file_size
+        zinfo.CRC = crc & 0xFFFFFFFF
+    except Exception:
+        raw.close()
+        raise
+    return zinfo, raw
+
+
+class _RawReader(object):
+    """
+    Read the raw data of a member from an archive, at most ``size`` bytes.
+    """
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def read(self, size=-1):
+        if (size < 0) or (size > self.remaining):
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        pass
+
+
+def open_raw(fileobj, zinfo):
+    """
+    Seek to the raw (compressed) data of a member in an existing archive.
+
+    :type fileobj: typing.BinaryIO
+    :type zinfo: ZipInfo
+    :rtype: _RawReader
+    :return: a file-like object that reads ``zinfo.compress_size`` bytes.
+    """
+    fileobj.seek(zinfo.header_offset)
+    header = fileobj.read(_LOCAL_HEADER.size)
+    fields = _LOCAL_HEADER.unpack(header)
+    if fields[0] != _LOCAL_MAGIC:
+        raise zipfile.BadZipfile(
+            "bad local file header of '{}'".format(zinfo.filename))
+    fileobj.seek(fields[10] + fields[11], 1)  # file name and extra field
+    return _RawReader(fileobj, zinfo.compress_size)
+
+
+def read_raw(fileobj, zinfo):
+    """
+    Read the raw (compressed) data of a member from an existing archive.
+
+    :type fileobj: typing.BinaryIO
+    :param fileobj: the archive opened in binary mode.
+    :type zinfo: ZipInfo
+    :param zinfo: from :meth:`zipfile.ZipFile.infolist`.
+    :rtype: bytes
+    """
+    raw = open_raw(fileobj, zinfo).read()
+    if len(raw) != zinfo.compress_size:
+        raise zipfile.BadZipfile("'{}' is truncated".format(zinfo.filename))
+    return raw
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    dosdate = (year - 1980) << 9 | month << 5 | day
+    dostime = hour << 11 | minute << 5 | (second // 2)
+    return dosdate, dostime
+
+
+def _encode_filename(filename, flag_bits):
+    try:
+        return filename.encode("ascii"), flag_bits
+    except UnicodeError:
+        return filename.encode("utf-8"), flag_bits | _FLAG_UTF8
+
+
+class ZipWriter(object):
+    """
+    Write members with known CRC and sizes sequentially, then the central
+    directory on :meth:`ZipWriter.close`. The output doesn't need to be
+    seekable. Zip64 records are written only where a size, an offset or the
+    number of members doesn't fit the zip32 fields.
+
+    :type fileobj: typing.BinaryIO
+    :type comment: bytes
+    :param comment: the archive comment.
+    """
+
+    def __init__(self, fileobj, comment=b""):
+        self.fileobj = fileobj
+        self.comment = comment
+        self.members = list()  # type: typing.List[ZipInfo]
+        self._offset = 0
+        self._closed = False
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self._offset += len(data)
+
+    def write_member(self, zinfo, raw):
+        """
+        Append a member.
+
+        :type zinfo: ZipInfo
+        :param zinfo: ``CRC``, ``file_size`` and ``compress_size`` have to be
+            set, ``compress_size`` must be ``len(raw)``.
+        :type raw: typing.Union[bytes, typing.BinaryIO]
+        :param raw: the raw (compressed) member data, or a file-like object
+            to read it from chunk by chunk, it is not closed.
+        """
+        if self._closed:
+            raise ValueError("write to a closed ZipWriter!")
+        is_bytes = isinstance(raw, (bytes, bytearray))
+        if is_bytes and len(raw) != zinfo.compress_size:
+            raise ValueError("compress_size of '{}' doesn't match the data!".format(
+                zinfo.filename))
+
+        zinfo.flag_bits = zinfo.flag_bits & _FLAG_UTF8  # no data descriptor
+        if zinfo.compress_type == ZIP_BZIP2:
+            zinfo.create_version = max(zinfo.create_version, _BZIP2_VERSION)
+            zinfo.extract_version = max(zinfo.extract_version, _BZIP2_VERSION)
+        elif zinfo.compress_type == ZIP_LZMA:
+            zinfo.create_version = max(zinfo.create_version, _LZMA_VERSION)
+            zinfo.extract_version = max(zinfo.extract_version, _LZMA_VERSION)
+            zinfo.flag_bits |= _FLAG_LZMA_EOS
+        filename, zinfo.flag_bits = _encode_filename(zinfo.filename, zinfo.flag_bits)
+        zinfo.header_offset = self._offset
+        if zinfo.header_offset >= _ZIP32_LIMIT:
+            zinfo.create_version = max(zinfo.create_version, _ZIP64_VERSION)
+            zinfo.extract_version = max(zinfo.extract_version, _ZIP64_VERSION)
+        extra = b""
+        file_size, compress_size = zinfo.file_size, zinfo.compress_size
+        if file_size >= _ZIP32_LIMIT or compress_size >= _ZIP32_LIMIT:
+            # the local header zip64 extra field has both sizes
+            extra = struct.pack("<2H2Q", _ZIP64_EXTRA_ID, 16, file_size, compress_size)
+            file_size = compress_size = _ZIP32_LIMIT
+            zinfo.create_version = max(zinfo.create_version, _ZIP64_VERSION)
+            zinfo.extract_version = max(zinfo.extract_version, _ZIP64_VERSION)
+        dosdate, dostime = _dos_date_time(zinfo.date_time)
+        self._write(_LOCAL_HEADER.pack(
+            _LOCAL_MAGIC,
+            zinfo.extract_version,
+            zinfo.reserved,
+            zinfo.flag_bits,
+            zinfo.compress_type,
+            dostime,
+            dosdate,
+            zinfo.CRC,
+            compress_size,
+            file_size,
+            len(filename),
+            len(extra),
+        ))
+        self._write(filename)
+        self._write(extra)
+        if is_bytes:
+            self._write(raw)
+        else:
+            size = 0
+            while True:
+                chunk = raw.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._write(chunk)
+                size += len(chunk)
+            if size != zinfo.compress_size:
+                raise ValueError("compress_size of '{}' doesn't match the data!".format(
+                    zinfo.filename))
+        self.members.append(zinfo)
+
+    def close(self):
+        """
+        Write the central directory and the end of central directory record.
+        """
+        if self._closed:
+            return
+        cd_offset = self._offset
+        for zinfo in self.members:
+            filename, _ = _encode_filename(zinfo.filename, zinfo.flag_bits)
+            dosdate, dostime = _dos_date_time(zinfo.date_time)
+            # the central directory zip64 extra field has only the values
+            # that don't fit, in this order
+            values = list()
+            fields = list()
+            for value in [zinfo.file_size, zinfo.compress_size, zinfo.header_offset]:
+                if value >= _ZIP32_LIMIT:
+                    values.append(value)
+                    fields.append(_ZIP32_LIMIT)
+                else:
+                    fields.append(value)
+            extra = b""
+            if values:
+                extra = struct.pack(
+                    "<2H{}Q".format(len(values)),
+                    _ZIP64_EXTRA_ID, 8 * len(values), *values
+                )
+            self._write(_CENTRAL_DIR.pack(
+                _CENTRAL_MAGIC,
+                zinfo.create_version,
+                zinfo.create_system,
+                zinfo.extract_version,
+                zinfo.reserved,
+                zinfo.flag_bits,
+                zinfo.compress_type,
+                dostime,
+                dosdate,
+                zinfo.CRC,
+                fields[1],
+                fields[0],
+                len(filename),
+                len(extra),
+                0,
+                0,
+                zinfo.internal_attr,
+                zinfo.external_attr,
+                fields[2],
+            ))
+            self._write(filename)
+            self._write(extra)
+        cd_size = self._offset - cd_offset
+        n_members = len(self.members)
+        if n_members >= _ZIP32_MAX_MEMBERS \
+                or cd_size >= _ZIP32_LIMIT \
+                or cd_offset >= _ZIP32_LIMIT:
+            end64_offset = self._offset
+            self._write(_END_ARCHIVE64.pack(
+                _END_MAGIC64,
+                _END_ARCHIVE64.size - 12,
+                _ZIP64_VERSION,
+                _ZIP64_VERSION,
+                0,
+                0,
+                n_members,
+                n_members,
+                cd_size,
+                cd_offset,
+            ))
+            self._write(_END_ARCHIVE64_LOCATOR.pack(
+                _END_LOCATOR_MAGIC64,
+                0,
+                end64_offset,
+                1,
+            ))
+            n_members = min(n_members, _ZIP32_MAX_MEMBERS)
+            cd_size = min(cd_size, _ZIP32_LIMIT)
+            cd_offset = min(cd_offset, _ZIP32_LIMIT)
+        self._write(_END_ARCHIVE.pack(
+            _END_MAGIC,
+            0,
+            0,
+            n_members,
+            n_members,
+            cd_size,
+            cd_offset,
+            len(self.comment),
+        ))
+        self._write(self.comment)
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+_POLICY_COMMENT_PREFIX = b"zipkit-policy:"
+
+
+def _policy_comment(policy):
+    return _POLICY_COMMENT_PREFIX + policy.signature().encode("ascii")
+
+
+def _read_previous(path, policy):
+    """
+    :type path: str
+    :type policy: CompressionPolicy
+    :rtype: typing.Dict[str, ZipInfo]
+    :return: members of the previous archive, empty if it was built with
+        another compression policy or level.
+    """
+    try:
+        with ZipFile(path, "r") as f:
+            if f.comment != _policy_comment(policy):
+                return dict()
+            return {zinfo.filename: zinfo for zinfo in f.infolist()}
+    except (IOError, OSError, zipfile.BadZipfile):
+        return dict()
+
+
+def _crc32_of_file(path):
+    crc = 0
+    with io.open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return crc & 0xFFFFFFFF
+
+
+COMPRESS_METHODS = {
+    "stored": ZIP_STORED,
+    "deflate": ZIP_DEFLATED,
+    "bzip2": ZIP_BZIP2,
+    "lzma": ZIP_LZMA,
+}
+
+INCOMPRESSIBLE_PATTERNS = (
+    "*.zip", "*.whl", "*.egg", "*.jar",
+    "*.gz", "*.tgz", "*.bz2", "*.xz", "*.lz4", "*.zst", "*.7z",
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp",
+    "*.mp3", "*.mp4", "*.woff", "*.woff2",
+)
+"""
+Already compressed file types, compressing them again wastes CPU for no
+size gain.
+"""
+
+
+class CompressionPolicy(object):
+    """
+    Decide the compression method and level of each member by its archive
+    path, the first matching ``fnmatch`` pattern wins.
+
+    :type rules: typing.List[typing.Tuple[str, int, int]]
+    :param rules: (pattern, compress type, level) tuples, level None is the
+        default level of the method.
+    :type default: typing.Tuple[int, int]
+    :param default: (compress type, level) of members no rule matches.
+
+    Usage::
+
+        >>> policy = CompressionPolicy.from_config([
+        ...     {"pattern": "*.png", "method": "stored"},
+        ...     {"pattern": "*.json", "method": "deflate", "level": 9},
+        ... ])
+        >>> policy.match("static/logo.png")
+        (0, None)
+    """
+
+    def __init__(self, rules=None, default=(ZIP_DEFLATED, None)):
+        self.rules = list(rules or [])
+        self.default = tuple(default)
+        for _, compress_type, _ in self.rules:
+            self._check(compress_type)
+        self._check(self.default[0])
+
+    @staticmethod
+    def _check(compress_type):
+        if (compress_type == ZIP_BZIP2 and bz2 is None) \
+                or (compress_type == ZIP_LZMA and lzma is None):  # pragma: no cover
+            raise RuntimeError(
+                "compress type {} is not available!".format(compress_type))
+        if compress_type not in COMPRESS_METHODS.values():
+            raise ValueError(
+                "compress type {} is not supported!".format(compress_type))
+
+    @classmethod
+    def default_policy(cls, compresslevel=None):
+        """
+        Store already compressed file types, deflate everything else.
+
+        :rtype: CompressionPolicy
+        """
+        return cls(
+            rules=[
+                (pattern, ZIP_STORED, None)
+                for pattern in INCOMPRESSIBLE_PATTERNS
+            ],
+            default=(ZIP_DEFLATED, compresslevel),
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a policy from json data, a list of
+        ``{"pattern": "*.png", "method": "stored", "level": null}``,
+        ``method`` is one of "stored", "deflate", "bzip2", "lzma". Members
+        no rule matches are deflated.
+
+        :type config: typing.List[dict]
+        :rtype: CompressionPolicy
+        """
+        rules = list()
+        for rule in config:
+            method = rule["method"].strip().lower()
+            if method not in COMPRESS_METHODS:
+                raise ValueError("compression method '{}' is not one of {}".format(
+                    method, list(COMPRESS_METHODS)))
+            rules.append((rule["pattern"], COMPRESS_METHODS[method], rule.get("level")))
+        return cls(rules=rules)
+
+    def signature(self):
+        """
+        Identify the method and level this policy gives to every archive
+        path, it is recorded in the archive comment by :func:`build_zip`.
+
+        :rtype: str
+        """
+        data = json.dumps([
+            [list(rule) for rule in self.rules],
+            list(self.default),
+        ], sort_keys=True)
+        return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+    def match(self, arcname):
+        """
+        :type arcname: str
+        :rtype: typing.Tuple[int, int]
+        :return: (compress type, level)
+        """
+        for pattern, compress_type, compresslevel in self.rules:
+            if fnmatch.fnmatch(arcname, pattern):
+                return compress_type, compresslevel
+        return self.default
+
+
+def _compress_task(task):
+    """
+    Pool worker of :func:`compress_files`, it is a module level function so
+    it can be pickled to a process pool.
+    """
+    source_path, arcname, compress_type, compresslevel, reproducible = task
+    zinfo, raw = compress_file(
+        source_path, arcname, compress_type, compresslevel, reproducible)
+    return zinfo, raw
+
+
+def compress_files(to_zip_list,
+                   compress_type=ZIP_DEFLATED,
+                   compresslevel=None,
+                   workers=None,
+                   executor="thread",
+                   reproducible=False,
+                   policy=None):
+    """
+    Compress many files concurrently, zlib releases the GIL so threads use
+    all cores.
+
+    :type to_zip_list: typing.Iterable[typing.Tuple[str, str]]
+    :param to_zip_list: (source path, archive path) pairs.
+    :type compress_type: int
+    :type compresslevel: int
+    :type workers: int
+    :param workers: size of the pool, default is the number of CPU. if 1,
+        files are compressed in the calling thread.
+    :type executor: str
+    :param executor: "thread" (default) or "process".
+    :type reproducible: bool
+
+    :type policy: CompressionPolicy
+    :param policy: if given, it decides the method and level of each
+        member instead of ``compress_type`` and ``compresslevel``.
+
+    :rtype: typing.Iterable[typing.Tuple[ZipInfo, typing.Union[bytes, SpooledRaw]]]
+    :return: (member info, raw member data) in the same order as
+        ``to_zip_list``, as soon as they are ready, see :func:`compress_file`.
+        At most ``2 * workers`` members are compressed ahead of the consumer.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError("executor has to be 'thread' or 'process'!")
+    if policy is None:
+        policy = CompressionPolicy(default=(compress_type, compresslevel))
+    tasks = [
+        (source_path, arcname) + policy.match(arcname) + (reproducible, )
+        for source_path, arcname in to_zip_list
+    ]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(min(workers, len(tasks)), 1)
+    return _iter_compressed(tasks, workers, executor)
+
+
+def _iter_compressed(tasks, workers, executor):
+    if workers == 1:
+        for task in tasks:
+            yield _compress_task(task)
+        return
+
+    if executor == "thread":
+        pool = ThreadPool(workers)
+    else:
+        pool = multiprocessing.Pool(workers)
+    # at most ``2 * workers`` compressed members wait for the writer, so
+    # memory doesn't grow with the archive size
+    tasks = iter(tasks)
+    window = deque(
+        pool.apply_async(_compress_task, (task, ))
+        for task in itertools.islice(tasks, 2 * workers)
+    )
+    try:
+        while window:
+            zinfo, raw = window.popleft().get()
+            for task in itertools.islice(tasks, 1):
+                window.append(pool.apply_async(_compress_task, (task, )))
+            yield zinfo, raw
+    finally:
+        pool.terminate()
+        pool.join()
+        # temp files of members that are compressed but never written
+        for result in window:
+            if result.ready() and result.successful():
+                _close_raw(result.get()[1])
+
+
+def _close_raw(raw):
+    if not isinstance(raw, (bytes, bytearray)):
+        raw.close()
+
+
+def build_zip(fileobj,
+              to_zip_list,
+              compress_type=ZIP_DEFLATED,
+              compresslevel=None,
+              previous=None,
+              workers=None,
+              executor="thread",
+              reproducible=False,
+              policy=None):
+    """
+    Build a zip archive of many files. Members are compressed concurrently
+    by :func:`compress_files` and written in the order of ``to_zip_list``,
+    so the archive is the same no matter how many workers are used.
+
+    If ``previous`` is an existing archive built with the same compression
+    policy and levels (recorded in the archive comment), a member whose
+    source file has the same size and CRC is copied from it as raw bytes,
+    only new or changed files are compressed. The CRC is not even computed when the mtime
+    matches too and the file was not modified within 2 seconds before the
+    previous archive was written (the zip format stores time in 2 seconds
+    resolution). The result is the same as a build without ``previous``.
+
+    A reproducible build doesn't depend on the order of ``to_zip_list``,
+    mtime and permission of files, or the machine, identical source always
+    produce an identical archive, see :func:`make_zinfo`.
+
+    :type fileobj: typing.BinaryIO
+    :param fileobj: the output, it doesn't need to be seekable.
+    :type to_zip_list: typing.Iterable[typing.Tuple[str, str]]
+    :param to_zip_list: (source path, archive path) pairs.
+    :type compress_type: int
+    :type compresslevel: int
+    :type previous: str
+    :param previous: path of the archive to reuse members from, it must
+        not be the output file.
+    :type workers: int
+    :type executor: str
+    :type reproducible: bool
+    :type policy: CompressionPolicy
+    :param policy: if given, it decides the method and level of each
+        member instead of ``compress_type`` and ``compresslevel``.
+
+    :rtype: dict
+    :return: ``n_members``, ``n_reused`` and ``n_compressed``.
+    """
+    if reproducible:
+        to_zip_list = sorted(to_zip_list, key=lambda pair: pair[1])
+        if compresslevel is None:
+            compresslevel = REPRODUCIBLE_COMPRESSLEVEL
+    if policy is None:
+        policy = CompressionPolicy(default=(compress_type, compresslevel))
+
+    previous_members = dict()
+    previous_mtime = 0
+    if previous and os.path.exists(previous):
+        previous_members = _read_previous(previous, policy)
+        previous_mtime = os.path.getmtime(previous)
+
+    # decide which members can be reused, the rest are compressed
+    plan = list()  # type: typing.List[typing.Tuple[str, str, ZipInfo]]
+    to_compress_list = list()
+    for source_path, arcname in to_zip_list:
+        member_compress_type, _ = policy.match(arcname)
+        zinfo = make_zinfo(source_path, arcname, member_compress_type, reproducible)
+        old = previous_members.get(zinfo.filename)
+        reuse = False
+        if (old is not None) \
+                and (old.compress_type == member_compress_type) \
+                and (old.file_size == zinfo.file_size):
+            # in a reproducible build the date time is not the mtime
+            if (not reproducible) and (old.date_time == zinfo.date_time) and (
+                os.path.getmtime(source_path)
+                < previous_mtime - _DOS_TIME_RESOLUTION
+            ):
+                reuse = True
+            else:
+                reuse = _crc32_of_file(source_path) == old.CRC
+        if reuse:
+            zinfo.CRC = old.CRC
+            zinfo.compress_size = old.compress_size
+            plan.append((source_path, arcname, zinfo, old))
+        else:
+            plan.append((source_path, arcname, None, None))
+            to_compress_list.append((source_path, arcname))
+
+    compressed = compress_files(
+        to_compress_list,
+        workers=workers,
+        executor=executor,
+        reproducible=reproducible,
+        policy=policy,
+    )
+    f_previous = io.open(previous, "rb") if previous_members else None
+    try:
+        with ZipWriter(fileobj, comment=_policy_comment(policy)) as writer:
+            for source_path, arcname, zinfo, old in plan:
+                if old is None:
+                    zinfo, raw = next(compressed)
+                else:
+                    raw = open_raw(f_previous, old)
+                try:
+                    writer.write_member(zinfo, raw)
+                finally:
+                    _close_raw(raw)
+    finally:
+        compressed.close()
+        if f_previous is not None:
+            f_previous.close()
+    n_compressed = len(to_compress_list)
+    return dict(
+        n_members=len(plan),
+        n_reused=len(plan) - n_compressed,
+        n_compressed=n_compressed,
+    )
+
+
+def compare_policies(to_zip_list, policies, workers=None):
+    """
+    Build an in memory archive with each compression policy, measure the
+    time and the size.
+
+    :type to_zip_list: typing.List[typing.Tuple[str, str]]
+    :type policies: typing.Dict[str, CompressionPolicy]
+    :param policies: name to policy mapping.
+    :type workers: int
+
+    :rtype: typing.List[dict]
+    :return: ``name``, ``seconds``, ``size`` and ``ratio`` (archive size
+        divided by the total size of files) of each policy.
+    """
+    total_size = sum(os.path.getsize(source_path) for source_path, _ in to_zip_list)
+    report = list()
+    for name, policy in policies.items():
+        buffer = io.BytesIO()
+        st = time.time()
+        build_zip(buffer, to_zip_list, workers=workers, policy=policy)
+        elapsed = time.time() - st
+        size = len(buffer.getvalue())
+        report.append(dict(
+            name=name,
+            seconds=elapsed,
+            size=size,
+            ratio=float(size) / max(total_size, 1),
+        ))
+    return report
+
+
+LAYER_PREFIX = re.compile(r"python/(lib/python[^/]+/site-packages/)?")
+"""
+Where a lambda layer puts packages, ``python/lib/python3.x/site-packages/``
+or ``python/``. It is stripped before grouping members by package.
+"""
+
+
+def strip_layer_prefix(arcname):
+    """
+    ``python/requests/api.py`` and
+    ``python/lib/python3.8/site-packages/requests/api.py`` -> ``requests/api.py``,
+    other paths are not changed. ``python/lib/foo.py`` is a package named
+    ``lib`` -> ``lib/foo.py``.
+
+    :type arcname: str
+    :rtype: str
+    """
+    match = LAYER_PREFIX.match(arcname)
+    if match is None:
+        return arcname
+    return arcname[match.end():]
+
+
+def splice_zips(fileobj, sources):
+    """
+    Combine many archives into one, members are copied as raw
+    (compressed) bytes, nothing is decompressed or compressed again. When
+    the same archive path is in many archives, the last one wins.
+
+    :type fileobj: typing.BinaryIO
+    :param fileobj: the output, it doesn't need to be seekable.
+    :type sources: typing.Iterable[typing.Tuple[str, typing.Callable[[str], str]]]
+    :param sources: (archive path, rename function) pairs. The rename
+        function maps a member path to its path in the output, for example
+        :func:`strip_layer_prefix`, None to keep it, members renamed to
+        ``""`` are skipped.
+
+    :rtype: dict
+    :return: ``n_members`` and ``n_overridden``, number of members replaced
+        by a member of a later archive.
+    """
+    # (index of the archive, ZipInfo) of each member in the output
+    plan = OrderedDict()
+    n_total = 0
+    sources = list(sources)
+    for i, (path, rename) in enumerate(sources):
+        with ZipFile(path, "r") as f:
+            for zinfo in f.infolist():
+                arcname = zinfo.filename if rename is None else rename(zinfo.filename)
+                if not arcname:
+                    continue
+                zinfo.filename = arcname
+                n_total += 1
+                plan[arcname] = (i, zinfo)
+    n_overridden = n_total - len(plan)
+
+    f_inputs = [io.open(path, "rb") for path, _ in sources]
+    try:
+        with ZipWriter(fileobj) as writer:
+            for i, zinfo in plan.values():
+                writer.write_member(zinfo, open_raw(f_inputs[i], zinfo))
+    finally:
+        for f in f_inputs:
+            f.close()
+    return dict(n_members=len(plan), n_overridden=n_overridden)
+
+
+def _package_of(arcname):
+    arcname = strip_layer_prefix(arcname)
+    parts = arcname.split("/", 1)
+    if len(parts) == 1:
+        return "(top level)"
+    return parts[0]
+
+
+def _file_type_of(arcname):
+    basename = arcname.rsplit("/", 1)[-1]
+    if "." not in basename.lstrip("."):
+        return "(none)"
+    ext = "." + basename.rsplit(".", 1)[-1].lower()
+    # mylib.cpython-38-x86_64-linux-gnu.so, libfoo.so.1.2
+    if ".so." in basename or ext == ".so":
+        return ".so"
+    return ext
+
+
+def zip_report(path, top=20):
+    """
+    Find out where the bytes of an archive come from. Only the central
+    directory is read, nothing is decompressed.
+
+    :type path: str
+    :type top: int
+    :param top: how many largest members to list.
+
+    :rtype: dict
+    :return: ``path``, ``size`` (the archive), ``n_members``,
+        ``compress_size``, ``file_size``, ``by_package`` and ``by_file_type``
+        (lists of ``name``, ``n_members``, ``compress_size``, ``file_size``,
+        largest first), ``largest`` (lists of ``name``, ``compress_size``,
+        ``file_size``).
+    """
+    by_package = dict()
+    by_file_type = dict()
+    members = list()
+    with ZipFile(path) as zf:
+        for zinfo in zf.infolist():
+            if zinfo.filename.endswith("/"):
+                continue
+            members.append(zinfo)
+            for mapping, name in [
+                (by_package, _package_of(zinfo.filename)),
+                (by_file_type, _file_type_of(zinfo.filename)),
+            ]:
+                group = mapping.setdefault(name, dict(
+                    name=name, n_members=0, compress_size=0, file_size=0,
+                ))
+                group["n_members"] += 1
+                group["compress_size"] += zinfo.compress_size
+                group["file_size"] += zinfo.file_size
+
+    def largest_first(groups):
+        return sorted(
+            groups,
+            key=lambda group: (-group["compress_size"], group["name"]),
+        )
+
+    members.sort(key=lambda zinfo: (-zinfo.compress_size, zinfo.filename))
+    return dict(
+        path=path,
+        size=os.path.getsize(path),
+        n_members=len(members),
+        compress_size=sum(zinfo.compress_size for zinfo in members),
+        file_size=sum(zinfo.file_size for zinfo in members),
+        by_package=largest_first(by_package.values()),
+        by_file_type=largest_first(by_file_type.values()),
+        largest=[
+            dict(
+                name=zinfo.filename,
+                compress_size=zinfo.compress_size,
+                file_size=zinfo.file_size,
+            )
+            for zinfo in members[:top]
+        ],
+    )
+
+
+def walk_dir(dir_path, exclude=()):
+    """
+    List all files in a directory as (source path, archive path) pairs, the
+    archive path is relative to ``dir_path``.
+
+    :type dir_path: str
+    :type exclude: typing.Iterable[str]
+    :param exclude: ``fnmatch`` patterns of archive paths to skip,
+        ``*`` also matches ``/``, like ``zip -x``.
+    :rtype: typing.List[typing.Tuple[str, str]]
+    """
+    if get_inventory is not None:
+        arcname_list = get_inventory(dir_path).walk()
+    else:
+        arcname_list = sorted(
+            os.path.relpath(os.path.join(dirname, basename), dir_path).replace(os.sep, "/")
+            for dirname, _, basename_list in os.walk(dir_path)
+            for basename in basename_list
+        )
+    return [
+        (os.path.join(dir_path, *arcname.split("/")), arcname)
+        for arcname in arcname_list
+        if not any(fnmatch.fnmatch(arcname, pattern) for pattern in exclude)
+    ]
+
+
+def main(argv=None):
+    """
+    Zip the content of a directory with all CPU cores, for example the lambda
+    layer::
+
+        python -m pygitrepo.pkg.zipkit layer.zip ./build/lambda/python -p python/ -x "python/boto3*"
+
+    This module has no dependency, a copy of this file can run as a script
+    where pygitrepo is not installed.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m pygitrepo.pkg.zipkit")
+    parser.add_argument("output", help="path of the zip file")
+    parser.add_argument("dir", help="zip files in this directory")
+    parser.add_argument(
+        "-p", "--prefix", default="",
+        help="prepended to archive paths, for example 'python/'",
+    )
+    parser.add_argument("-x", "--exclude", nargs="*", default=[])
+    parser.add_argument("-l", "--level", type=int, default=None)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument(
+        "-r", "--reproducible", action="store_true",
+        help="sorted members, fixed SOURCE_DATE_EPOCH time and permissions",
+    )
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    to_zip_list = [
+        (source_path, args.prefix + arcname)
+        for source_path, arcname in walk_dir(args.dir)
+        if os.path.abspath(source_path) != output
+        and not any(
+            fnmatch.fnmatch(args.prefix + arcname, pattern)
+            for pattern in args.exclude
+        )
+    ]
+    with io.open(output, "wb") as f:
+        build_zip(
+            f, to_zip_list,
+            compress_type=ZIP_DEFLATED,
+            compresslevel=args.level,
+            workers=args.workers,
+            reproducible=args.reproducible,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
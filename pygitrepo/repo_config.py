@@ -4,6 +4,7 @@ import os
 import sys
 import json
 from .pkg.configirl import ConfigClass, Constant, Derivable
+from .pkg.ignore import IgnoreMatcher, PGRIGNORE
 from . import constants
 from .helpers import (
     join_s3_uri,
@@ -44,6 +45,14 @@ class _RepoConfig(_BaseConfig):
     DEV_PY_VER_MINOR = Constant(default=None)
     DEV_PY_VER_MICRO = Constant(default=None)
 
+    IGNORE_PATTERNS = Constant(default=None)
+    """
+    A list of gitignore style patterns, relative to the project root, of
+    files to leave out of build artifacts and source code copies, for
+    example ``["tests/", "*.ipynb", "fixtures/"]``. They take precedence
+    over the ``.pgrignore`` file in the project root.
+    """
+
     @property
     def package_name(self):
         return self.PACKAGE_NAME.get_value()
@@ -95,6 +104,75 @@ class _AWSLambdaConfig(_BaseConfig):
     AWS_LAMBDA_BUILD_DOCKER_IMAGE_WORKSPACE_DIR = Constant(default=None)
     AWS_LAMBDA_TEST_DOCKER_IMAGE = Constant(default=None)
 
+    AWS_LAMBDA_BUILD_REPRODUCIBLE = Constant(default=False)
+    """
+    Build byte identical ``source.zip`` and ``layer.zip`` from identical
+    source code: sorted members, a fixed timestamp (``SOURCE_DATE_EPOCH``),
+    normalized permissions and a fixed deflate level. The S3 key is the md5
+    of the zip, so an unchanged source tree is not uploaded nor deployed
+    again. Off by default, members keep their mtime and permissions.
+    """
+
+    AWS_LAMBDA_BUILD_COMPRESSION_POLICY = Constant(default=None)
+    """
+    How lambda zip members are compressed, a list of rules, the first rule
+    whose ``fnmatch`` pattern matches the archive path wins, for example::
+
+        [
+            {"pattern": "*.png", "method": "stored"},
+            {"pattern": "*.json", "method": "deflate", "level": 9},
+            {"pattern": "*.csv", "method": "lzma"}
+        ]
+
+    ``method`` is one of "stored", "deflate", "bzip2", "lzma". Members no
+    rule matches are deflated. If not set, already compressed file types
+    are stored and everything else is deflated. Run
+    ``pgr report-lambda-compression`` to compare policies on your code.
+    """
+
+    AWS_LAMBDA_BUILD_PRECOMPILE = Constant(default=False)
+    """
+    Add unchecked hash ``.pyc`` files in ``__pycache__`` layout to
+    ``source.zip``, so lambda cold start doesn't compile the source code.
+    The pyc are compiled by a ``DEV_PY_VER_MAJOR.DEV_PY_VER_MINOR`` python,
+    the current one or the virtualenv one, it is skipped if none of them
+    matches. Run ``pgr report-lambda-cold-start`` to see the difference.
+    """
+
+    AWS_LAMBDA_BUILD_KEEP_LOCAL_ZIP = Constant(default=True)
+    """
+    ``pgr build-upload-lambda-source-code`` streams ``source.zip`` to S3
+    while it is built, set it to False to not also write it to disk. The
+    next build can't reuse members of the previous zip then.
+    """
+
+    AWS_LAMBDA_S3_ENDPOINT_URL = Constant(default=None)
+    """
+    The S3 endpoint ``pgr build-upload-lambda-source-code`` streams to, for
+    example a MinIO server ``http://localhost:9000``, or ``file:///tmp/s3``
+    to use a local directory as the S3 service. Default is AWS S3.
+    """
+
+    AWS_LAMBDA_BUILD_TREE_SHAKE = Constant(default=False)
+    """
+    Only put the package modules the lambda handlers import, directly or
+    indirectly, into ``source.zip``. Imports are found by parsing the source
+    code, non ``.py`` files are always kept.
+    """
+
+    AWS_LAMBDA_HANDLER_MODULES = Constant(default=None)
+    """
+    Where the tree shaking starts, a list of module names like
+    ``my_package.handlers`` or ``.py`` file paths relative to the project
+    root. Default is ``["lambda_app/app.py"]``.
+    """
+
+    AWS_LAMBDA_BUILD_KEEP_MODULES = Constant(default=None)
+    """
+    ``fnmatch`` patterns of module names the tree shaking always keeps, for
+    modules imported dynamically, for example ``["my_package.plugins.*"]``.
+    """
+
     def ensure_aws_lambda_deploy_s3_bucket(self):
         self.ensure_attr_not_none(self.AWS_LAMBDA_DEPLOY_S3_BUCKET.name)
 
@@ -206,6 +284,21 @@ class RepoConfig(
     def dir_python_lib(self):
         return os.path.join(self.dir_project_root, self.PACKAGE_NAME.get_value())
 
+    @property
+    def path_pgrignore(self):
+        return os.path.join(self.dir_project_root, PGRIGNORE)
+
+    @property
+    def ignore_matcher(self):
+        """
+        :rtype: IgnoreMatcher
+        """
+        return IgnoreMatcher.from_file(
+            self.path_pgrignore,
+            extra_patterns=self.IGNORE_PATTERNS.get_value() or [],
+            base_dir=self.dir_project_root,
+        )
+
     @property
     def path_version_file(self):
         return os.path.join(self.dir_python_lib, "_version.py")
@@ -568,6 +661,26 @@ class RepoConfig(
     def path_lambda_build_deploy_package(self):
         return os.path.join(self.dir_lambda_build, "deploy-pkg.zip")
 
+    @property
+    def path_lambda_build_report(self):
+        return os.path.join(self.dir_lambda_build, "report.json")
+
+    @property
+    def dir_lambda_chunk_store(self):
+        """
+        The local content defined chunk store of lambda build artifacts.
+        It is not in ``build`` dir, so ``pgr clean`` doesn't remove it.
+
+        example: ${HOME}/.cache/pygitrepo/chunk-store/${package_name}
+        """
+        return os.path.join(
+            self.DIR_HOME.get_value(),
+            ".cache",
+            "pygitrepo",
+            "chunk-store",
+            self.PACKAGE_NAME.get_value(),
+        )
+
     # --- s3 ---
     @property
     def s3_key_lambda_deploy_dir(self):
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import pytest
+
+dir_here = os.path.dirname(os.path.abspath(__file__))
+dir_project_root = os.path.dirname(dir_here)
+dir_benchmarks = os.path.join(dir_project_root, "benchmarks")
+if dir_benchmarks not in sys.path:
+    sys.path.append(dir_benchmarks)
+
+import bench_fingerprint
+
+
+def test_run_suite(tmpdir):
+    path_output = str(tmpdir.join("bench.json"))
+    argv = [
+        "--sizes", "64KB", "100000",
+        "--chunk-sizes", "1KB", "auto",
+        "--algorithms", "md5", "sha256",
+        "--repeat", "1",
+        "--output", path_output,
+    ]
+    assert bench_fingerprint.main(argv) == 0
+    with open(path_output) as f:
+        report = json.load(f)
+    # 2 sizes * 2 chunk sizes * 2 algorithms * 3 strategies
+    assert len(report["results"]) == 24
+    assert len(report["best"]) == 4
+
+    # compare with itself, no regression
+    assert bench_fingerprint.find_regressions(report, report) == []
+
+    # baseline was twice faster
+    baseline = json.loads(json.dumps(report))
+    for result in baseline["results"]:
+        result["gbps"] *= 2
+    assert len(bench_fingerprint.find_regressions(report, baseline)) == 24
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import random
+import pytest
+from pygitrepo.pkg.chunkstore import Chunker, LocalDirBackend, ChunkStore
+
+
+def make_data(size, seed):
+    rnd = random.Random(seed)
+    return bytes(bytearray(rnd.getrandbits(8) for _ in range(size)))
+
+
+def make_text(size, seed):
+    rnd = random.Random(seed)
+    words = ["def", "return", "self", "import", "value", "name", "=", "(", ")",
+             ":", "for", "in", "if", "    ", "\n", "\n    "]
+    text = list()
+    length = 0
+    while length < size:
+        word = rnd.choice(words)
+        text.append(word)
+        length += len(word) + 1
+    return " ".join(text).encode("ascii")[:size]
+
+
+class TestChunker(object):
+    def test_iter_chunks(self):
+        chunker = Chunker(min_size=1024, avg_size=4096, max_size=16384)
+        data = make_data(200000, seed=1)
+        chunks = list(chunker.iter_chunks(io.BytesIO(data), read_size=1))
+        assert b"".join(chunks) == data
+        for chunk in chunks[:-1]:
+            assert 1024 < len(chunk) <= 16384
+        assert 20 < len(chunks) < 100
+
+        # boundaries re-synchronize after an insertion
+        new_data = data[:50000] + b"inserted" + data[50000:]
+        new_chunks = list(chunker.iter_chunks(io.BytesIO(new_data)))
+        assert len(set(chunks) & set(new_chunks)) >= len(chunks) - 3
+
+        assert list(chunker.iter_chunks(io.BytesIO(b""))) == []
+
+    def test_iter_chunks_text(self):
+        # boundaries depend on all bytes, not on a specific byte value
+        chunker = Chunker(min_size=1024, avg_size=4096, max_size=16384)
+        data = make_text(300000, seed=3)
+        chunks = list(chunker.iter_chunks(io.BytesIO(data)))
+        assert len(set(len(chunk) for chunk in chunks)) > len(chunks) // 2
+        assert 20 < len(chunks) < 150
+
+        new_chunks = list(chunker.iter_chunks(io.BytesIO(b"x" + data)))
+        assert len(set(chunks) & set(new_chunks)) >= len(chunks) - 3
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            Chunker(min_size=10, avg_size=5, max_size=20)
+
+
+class TestChunkStore(object):
+    def test(self, tmpdir):
+        chunker = Chunker(min_size=1024, avg_size=4096, max_size=16384)
+        store = ChunkStore(LocalDirBackend(str(tmpdir.join("store"))), chunker=chunker)
+
+        data_v1 = make_data(300000, seed=2)
+        data_v2 = data_v1[:100000] + b"a small edit" + data_v1[100020:]
+        path = str(tmpdir.join("layer.zip"))
+
+        with open(path, "wb") as f:
+            f.write(data_v1)
+        report = store.put_file(path, "layer/v1")
+        assert report["size"] == report["new_bytes"] == len(data_v1)
+        assert report["n_chunks"] == report["n_new_chunks"]
+
+        with open(path, "wb") as f:
+            f.write(data_v2)
+        report = store.put_file(path, "layer/v2")
+        assert report["size"] == len(data_v2)
+        assert 0 < report["new_bytes"] < 3 * 16384
+
+        # the same content again introduces nothing
+        report = store.put_file(path, "layer/v3")
+        assert report["new_bytes"] == 0
+
+        assert store.names() == ["layer/v1", "layer/v2", "layer/v3"]
+        assert store.has_file("layer/v1")
+        assert not store.has_file("layer/v4")
+
+        restored = str(tmpdir.join("restored.zip"))
+        store.get_file("layer/v1", restored)
+        with open(restored, "rb") as f:
+            assert f.read() == data_v1
+        store.get_file("layer/v2", restored)
+        with open(restored, "rb") as f:
+            assert f.read() == data_v2
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
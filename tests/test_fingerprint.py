@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
+import os
+import hashlib
 import pytest
-from pygitrepo.pkg.fingerprint import fingerprint
-from pygitrepo.pkg.mini_six import integer_types, string_types
+from pygitrepo.pkg.fingerprint import (
+    FingerPrint, FingerPrintCache, Digest, fingerprint,
+    HashingWriter, S3ETagHasher, read_sidecar, auto_chunk_size, walk_files,
+    NO_CACHE_ENV_VAR, HashCancelled, StructEncoder,
+)
+from pygitrepo.pkg.mini_six import PY2, integer_types, string_types
 
 
 def test_md5_file():
@@ -31,6 +37,407 @@ def test_md5_file():
         fingerprint.of_file(a_file, chunk_size=0)
 
 
+def test_of_file_mmap_and_readinto(tmpdir):
+    data = os.urandom(300 * 1000 + 7)
+    p = tmpdir.join("data.bin")
+    p.write_binary(data)
+    abspath = str(p)
+
+    fp = FingerPrint()
+    fp.mmap_threshold = 1  # force mmap
+    id1 = fp.of_file(abspath)
+    id2 = fp.of_file(abspath, chunk_size=4096)
+    id3 = fp.of_file(abspath, nbytes=12345, chunk_size=1000)
+    fp.mmap_threshold = len(data) + 1  # force readinto
+    id4 = fp.of_file(abspath)
+    id5 = fp.of_file(abspath, nbytes=12345, chunk_size=1000)
+
+    assert id1 == id2 == id4 == hashlib.md5(data).hexdigest()
+    assert id3 == id5 == hashlib.md5(data[:12345]).hexdigest()
+
+    p_empty = tmpdir.join("empty.bin")
+    p_empty.write_binary(b"")
+    assert fp.of_file(str(p_empty)) == hashlib.md5(b"").hexdigest()
+
+
+def test_auto_chunk_size():
+    assert auto_chunk_size(0) == 1
+    assert auto_chunk_size(100) == 100
+    assert 64 * 1024 <= auto_chunk_size(10 * 1024 * 1024) <= 1024 * 1024
+    assert auto_chunk_size(10 * 1024 * 1024 * 1024) == 1024 * 1024
+
+
+def test_of_dir(tmpdir):
+    tmpdir.join("a.py").write("a = 1")
+    tmpdir.join("a.pyc").write("compiled")
+    tmpdir.mkdir("sub").join("b.py").write("b = 2")
+    tmpdir.mkdir("__pycache__").join("a.cpython-38.pyc").write("compiled")
+    dir_path = str(tmpdir)
+
+    assert walk_files(dir_path) == ["a.py", "sub/b.py"]
+
+    fp = FingerPrint()
+    root1 = fp.of_dir(dir_path)
+    assert root1 == fp.of_dir(dir_path, workers=1)
+
+    # excluded files don't change the fingerprint
+    tmpdir.join("__pycache__").join("b.cpython-38.pyc").write("compiled")
+    assert fp.of_dir(dir_path) == root1
+
+    # edit, rename and add changes the fingerprint
+    tmpdir.join("a.py").write("a = 2")
+    root2 = fp.of_dir(dir_path)
+    assert root2 != root1
+
+    tmpdir.join("a.py").rename(tmpdir.join("c.py"))
+    root3 = fp.of_dir(dir_path)
+    assert root3 != root2
+
+    tmpdir.join("d.py").write("")
+    assert fp.of_dir(dir_path) != root3
+
+    assert fp.of_dir(dir_path, exclude=["*.py", "*.pyc", "__pycache__"]) \
+           == fp.of_dir(str(tmpdir.mkdir("empty")))
+
+
+def test_fingerprint_cache(tmpdir, monkeypatch):
+    p = tmpdir.join("layer.zip")
+    p.write_binary(b"version 1")
+    abspath = str(p)
+    cache_path = str(tmpdir.join("cache", "fingerprint-cache.json"))
+
+    fp = FingerPrint(cache=FingerPrintCache(path=cache_path))
+    calls = list()
+    update_from_file = fp._update_from_file
+
+    def counted_update_from_file(*args, **kwargs):
+        calls.append(args)
+        return update_from_file(*args, **kwargs)
+
+    monkeypatch.setattr(fp, "_update_from_file", counted_update_from_file)
+
+    md5 = hashlib.md5(b"version 1").hexdigest()
+    assert fp.of_file(abspath) == md5
+    assert fp.of_file(abspath) == md5
+    assert len(calls) == 1
+
+    # cache is persistent
+    fp.set_cache(FingerPrintCache(path=cache_path))
+    assert fp.of_file(abspath) == md5
+    assert len(calls) == 1
+
+    # algorithm and nbytes are part of the key
+    fp.use_sha256()
+    assert fp.of_file(abspath) == hashlib.sha256(b"version 1").hexdigest()
+    assert len(calls) == 2
+    fp.use_md5()
+    assert fp.of_file(abspath, nbytes=3) == hashlib.md5(b"ver").hexdigest()
+    assert len(calls) == 3
+
+    # bypass
+    fp.of_file(abspath, use_cache=False)
+    assert len(calls) == 4
+    monkeypatch.setenv(NO_CACHE_ENV_VAR, "1")
+    fp.of_file(abspath)
+    assert len(calls) == 5
+    monkeypatch.delenv(NO_CACHE_ENV_VAR)
+
+    # file changed
+    p.write_binary(b"version 2 is longer")
+    assert fp.of_file(abspath) == hashlib.md5(b"version 2 is longer").hexdigest()
+    assert len(calls) == 6
+
+    # eviction
+    cache = FingerPrintCache(path=cache_path, max_entries=2)
+    cache.save()
+    assert len(FingerPrintCache(path=cache_path).data) == 2
+
+    cache.clear()
+    assert os.path.exists(cache_path) is False
+
+
+def test_of_file_multi(tmpdir):
+    import base64
+
+    data = os.urandom(100000)
+    p = tmpdir.join("source.zip")
+    p.write_binary(data)
+    abspath = str(p)
+
+    fp = FingerPrint(cache=FingerPrintCache(path=str(tmpdir.join("cache.json"))))
+    for _ in range(2):  # second time from cache
+        digests = fp.of_file_multi(abspath, ["SHA256", "md5"])
+        assert list(digests) == ["sha256", "md5"]
+        assert digests["md5"].hex == hashlib.md5(data).hexdigest()
+        assert digests["md5"].int == int(hashlib.md5(data).hexdigest(), 16)
+        assert digests["sha256"].b64 == \
+               base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+    assert fp.of_file(abspath) == digests["md5"].hex
+
+    digests = fp.of_file_multi(abspath, ["md5", "sha1"], nbytes=10, use_cache=False)
+    assert digests["sha1"] == Digest(hashlib.sha1(data[:10]).digest())
+
+    with pytest.raises(ValueError):
+        fp.of_file_multi(abspath, ["crc32"])
+
+
+def test_of_file_s3_etag(tmpdir):
+    data = os.urandom(25000)
+    p = tmpdir.join("layer.zip")
+    p.write_binary(data)
+    abspath = str(p)
+
+    # single part upload
+    assert fingerprint.of_file_s3_etag(abspath) == hashlib.md5(data).hexdigest()
+
+    # multi part upload
+    parts = [data[:10000], data[10000:20000], data[20000:]]
+    expected = "{}-3".format(hashlib.md5(b"".join([
+        hashlib.md5(part).digest() for part in parts
+    ])).hexdigest())
+    for workers in [1, 4]:
+        etag = fingerprint.of_file_s3_etag(
+            abspath, part_size=10000, multipart_threshold=10000, workers=workers)
+        assert etag == expected
+
+    # exactly one part
+    etag = fingerprint.of_file_s3_etag(
+        abspath, part_size=100000, multipart_threshold=1)
+    assert etag == "{}-1".format(
+        hashlib.md5(hashlib.md5(data).digest()).hexdigest())
+
+    # too many parts, the part size is doubled
+    etag = fingerprint.of_file_s3_etag(
+        abspath, part_size=1, multipart_threshold=1)
+    assert etag.endswith("-{}".format((25000 + 3) // 4))
+
+
+def test_s3_etag_hasher(tmpdir):
+    data = os.urandom(25000)
+    p = tmpdir.join("layer.zip")
+    p.write_binary(data)
+    for part_size, multipart_threshold in [(10000, 10000), (5000, 30000), (25000, 1)]:
+        hasher = S3ETagHasher(part_size=part_size, multipart_threshold=multipart_threshold)
+        for i in range(0, len(data), 3333):
+            hasher.update(data[i:i + 3333])
+        assert hasher.hexdigest() == fingerprint.of_file_s3_etag(
+            str(p), part_size=part_size, multipart_threshold=multipart_threshold)
+
+
+def test_hashing_writer(tmpdir):
+    import zipfile
+
+    path = str(tmpdir.join("source.zip"))
+    with open(path, "wb") as f:
+        writer = HashingWriter(f, ["md5", "sha256"], s3_etag=True)
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.write(__file__, "tests/test_fingerprint.py")
+            zf.writestr("data.bin", os.urandom(10000))
+    writer.write_sidecar(path)
+
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == ["data.bin", "tests/test_fingerprint.py"]
+
+    assert writer.size == os.path.getsize(path)
+    digests = FingerPrint().of_file_multi(path, ["md5", "sha256"], use_cache=False)
+    assert writer.digests == digests
+    assert read_sidecar(path) == {
+        "md5": digests["md5"].hex,
+        "sha256": digests["sha256"].hex,
+        "s3_etag": fingerprint.of_file_s3_etag(path),
+    }
+
+    # artifact changed after the digests were recorded
+    with open(path, "ab") as f:
+        f.write(b"tail")
+    assert read_sidecar(path) is None
+    assert read_sidecar(str(tmpdir.join("not-exists.zip"))) is None
+
+    with pytest.raises(ValueError):
+        HashingWriter(None, ["crc32"])
+
+
+def test_of_file_quick(tmpdir):
+    data = os.urandom(3 * 1000 * 1000)
+    p1 = tmpdir.join("layer-1.zip")
+    p1.write_binary(data)
+    p2 = tmpdir.join("layer-2.zip")
+    p2.write_binary(data)
+    path1, path2 = str(p1), str(p2)
+
+    fp = FingerPrint()
+    quick = fp.of_file_quick(path1)
+    assert quick == fp.of_file_quick(path2)
+    assert fp.is_same_file(path1, path2)
+    assert fp.is_same_file(path1, path2, certain=True)
+
+    # a change in the tail is detected by the quick fingerprint
+    p2.write_binary(data[:-1] + b"x" if data[-1:] != b"x" else data[:-1] + b"y")
+    assert fp.of_file_quick(path2) != quick
+    assert fp.is_same_file(path1, path2) is False
+
+    # a change in between windows is only detected when certainty is requested
+    middle = 100000
+    changed = bytearray(data)
+    changed[middle] = (changed[middle] + 1) % 256
+    p2.write_binary(bytes(changed))
+    assert fp.of_file_quick(path2) == quick
+    assert fp.is_same_file(path1, path2) is True
+    assert fp.is_same_file(path1, path2, certain=True) is False
+
+    # different size
+    p2.write_binary(data + b"x")
+    assert fp.is_same_file(path1, path2) is False
+
+    # small file is hashed entirely
+    p3 = tmpdir.join("small.txt")
+    p3.write_binary(b"hello")
+    assert fp.of_file_quick(str(p3)) != fp.of_file_quick(str(p3), window_size=1, n_windows=2)
+
+    with pytest.raises(ValueError):
+        fp.of_file_quick(path1, n_windows=1)
+
+
+def test_of_files(tmpdir):
+    paths = list()
+    for i in range(20):
+        p = tmpdir.join("{}.txt".format(i))
+        p.write_binary("file {}".format(i).encode("utf-8") * (i + 1))
+        paths.append(str(p))
+    paths.reverse()
+    expected = [fingerprint.of_file(path) for path in paths]
+
+    progress = list()
+
+    def callback(n_done, n_total, path):
+        progress.append((n_done, n_total))
+
+    fp = FingerPrint(cache=FingerPrintCache(path=str(tmpdir.join("cache.json"))))
+    for executor in ["thread", "process"]:
+        del progress[:]
+        results = fp.of_files(
+            paths, workers=3, executor=executor, callback=callback,
+            use_cache=False,
+        )
+        assert list(results) == paths
+        assert list(results.values()) == expected
+        assert progress[-1] == (20, 20)
+        assert [n_done for n_done, _ in progress] == list(range(1, 21))
+
+    # half from cache, half computed
+    fp.of_files(paths[:10])
+    del progress[:]
+    results = fp.of_files(paths, callback=callback)
+    assert list(results.values()) == expected
+    assert len(progress) == 20
+    assert len(fp.cache.data) == 20
+
+    with pytest.raises(ValueError):
+        fp.of_files(paths, executor="fiber")
+
+
+def test_cancel_event(tmpdir):
+    import threading
+
+    p = tmpdir.join("data.bin")
+    p.write_binary(b"x" * 1000)
+    cancel_event = threading.Event()
+    assert fingerprint.of_file(str(p), cancel_event=cancel_event) \
+           == hashlib.md5(b"x" * 1000).hexdigest()
+    cancel_event.set()
+    with pytest.raises(HashCancelled):
+        fingerprint.of_file(str(p), cancel_event=cancel_event)
+
+
+@pytest.mark.skipif(PY2, reason="asyncio is Python3 only")
+def test_async(tmpdir):
+    import time
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    paths = list()
+    for i in range(5):
+        p = tmpdir.join("{}.txt".format(i))
+        p.write_binary("file {}".format(i).encode("utf-8") * 1000)
+        paths.append(str(p))
+    big = tmpdir.join("big.bin")
+    big.write_binary(b"x" * (8 * 1024 * 1024))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = ThreadPoolExecutor(max_workers=2)
+    fp = FingerPrint()
+    try:
+        assert loop.run_until_complete(fp.aof_file(paths[0])) \
+               == fp.of_file(paths[0])
+        digests = loop.run_until_complete(
+            fp.aof_file_multi(paths[0], ["md5", "sha256"]))
+        assert digests["sha256"].hex == FingerPrint("sha256").of_file(paths[0])
+        results = loop.run_until_complete(fp.aof_files(paths, executor=executor))
+        assert list(results) == paths
+        assert list(results.values()) == [fp.of_file(path) for path in paths]
+
+        # cancel a slow hashing, the worker thread stops early
+        future = fp.aof_file(str(big), chunk_size=1, executor=executor)
+        loop.run_until_complete(asyncio.sleep(0.05))
+        st = time.time()
+        future.cancel()
+        loop.run_until_complete(asyncio.sleep(0))  # run done callbacks
+        executor.shutdown(wait=True)
+        assert time.time() - st < 1
+        assert future.cancelled()
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_of_pyobj_structural():
+    fp = FingerPrint()
+
+    def of(pyobj):
+        return fp.of_pyobj(pyobj, structural=True)
+
+    # dict and set ordering don't matter
+    assert of({"a": 1, "b": [1, 2]}) == of({"b": [1, 2], "a": 1})
+    assert of({"x", "y", "z"}) == of({"z", "y", "x"})
+    assert of({1: "a", "1": "b"}) == of({"1": "b", 1: "a"})
+    assert of({1, 2}) == of(frozenset([2, 1]))
+
+    # types are tagged
+    values = [
+        None, True, False, 0, 1, 1.0, "1", b"1", [1], (1,), {1: 1},
+        {1}, [], (), {}, "", b"", [[]], [[], []],
+        ["a", "b"], ["ab"], {"a": None}, {"a": (1, 2)}, 1.5, -0,
+    ]
+    digests = set(of(value) for value in values)
+    assert len(digests) == len(values) - 1  # -0 == 0
+
+    # stable across machines and Python3 versions
+    assert of({"a": 1}) == "651c6a20d94234a1715ea0f315c05ec6"
+
+    # other objects are pickled
+    assert of([Digest(b"a")]) == of([Digest(b"a")])
+
+    # streamed in batches
+    chunks = list()
+    encoder = StructEncoder(chunks.append)
+    encoder.encode([str(i) for i in range(10000)])
+    assert len(chunks) > 1
+    m = hashlib.md5()
+    m.update(b"".join(chunks))
+    assert m.hexdigest() == of([str(i) for i in range(10000)])
+
+    a_list = [1, 2]
+    a_list.append(a_list)
+    with pytest.raises(ValueError):
+        of(a_list)
+
+    # pickle by default
+    assert fp.of_pyobj({"a": 1}) \
+           != of({"a": 1})
+
+
 def test_hash_anything():
     """This test may failed in different operation system.
     """
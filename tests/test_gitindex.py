@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import subprocess
+import pytest
+from pygitrepo.pkg.fingerprint import FingerPrint
+from pygitrepo.pkg.gitindex import (
+    read_index, git_blob_id, locate_git_dir, GitIndexFingerPrint,
+)
+
+try:
+    subprocess.check_output(["git", "--version"])
+    has_git = True
+except Exception:  # pragma: no cover
+    has_git = False
+
+pytestmark = pytest.mark.skipif(not has_git, reason="git is not installed")
+
+
+def git(repo_dir, *args):
+    return subprocess.check_output(
+        ["git", "-C", repo_dir] + list(args)
+    ).decode("utf-8")
+
+
+def make_repo(tmpdir, index_version=None):
+    repo_dir = str(tmpdir.join("repo"))
+    os.makedirs(os.path.join(repo_dir, "pkg", "sub"))
+    files = {
+        "setup.py": b"print('hello')\n",
+        "pkg/__init__.py": b"",
+        "pkg/a.py": b"a = 1\n" * 1000,
+        "pkg/sub/b.py": b"b = 2\n",
+    }
+    for relpath, content in files.items():
+        with open(os.path.join(repo_dir, *relpath.split("/")), "wb") as f:
+            f.write(content)
+    git(repo_dir, "init", "-q")
+    if index_version:
+        git(repo_dir, "config", "index.version", str(index_version))
+    git(repo_dir, "add", "-A")
+    # make sure tracked files are not racily clean
+    past = time.time() - 10
+    for relpath in files:
+        os.utime(os.path.join(repo_dir, *relpath.split("/")), (past, past))
+    git(repo_dir, "update-index", "--refresh", "-q")
+    return repo_dir
+
+
+def ls_files(repo_dir):
+    mapping = dict()
+    for line in git(repo_dir, "ls-files", "-s").splitlines():
+        meta, path = line.split("\t")
+        mapping[path] = meta.split(" ")[1]
+    return mapping
+
+
+@pytest.mark.parametrize("index_version", [2, 3, 4])
+def test_read_index(tmpdir, index_version):
+    repo_dir = make_repo(tmpdir, index_version)
+    entries = read_index(os.path.join(locate_git_dir(repo_dir), "index"))
+    assert {
+        path: entry.sha1 for path, entry in entries.items()
+    } == ls_files(repo_dir)
+
+
+def test_git_blob_id(tmpdir):
+    repo_dir = make_repo(tmpdir)
+    path = os.path.join(repo_dir, "pkg", "a.py")
+    assert git_blob_id(path) == git(repo_dir, "hash-object", path).strip()
+
+
+def test_locate_git_dir(tmpdir):
+    repo_dir = make_repo(tmpdir)
+    work_tree = str(tmpdir.join("work_tree"))
+    os.makedirs(work_tree)
+    with open(os.path.join(work_tree, ".git"), "w") as f:
+        f.write("gitdir: ../repo/.git\n")
+    assert locate_git_dir(work_tree) == os.path.join(repo_dir, ".git")
+    with pytest.raises(EnvironmentError):
+        locate_git_dir(str(tmpdir))
+
+
+def test_git_index_fingerprint(tmpdir):
+    repo_dir = make_repo(tmpdir)
+    expected = ls_files(repo_dir)
+
+    provider = GitIndexFingerPrint(repo_dir)
+    assert provider.of_file("setup.py") == expected["setup.py"]
+    assert provider.of_file(os.path.join(repo_dir, "pkg", "a.py")) == expected["pkg/a.py"]
+    assert provider.n_from_index == 2
+    assert provider.n_hashed == 0
+
+    # modified and untracked files are hashed
+    with open(os.path.join(repo_dir, "pkg", "a.py"), "ab") as f:
+        f.write(b"c = 3\n")
+    with open(os.path.join(repo_dir, "pkg", "new.py"), "wb") as f:
+        f.write(b"d = 4\n")
+
+    provider = GitIndexFingerPrint(repo_dir)
+    results = provider.of_files(["setup.py", "pkg/a.py", "pkg/new.py"], workers=2)
+    assert list(results) == ["setup.py", "pkg/a.py", "pkg/new.py"]
+    for relpath, blob_id in results.items():
+        path = os.path.join(repo_dir, *relpath.split("/"))
+        assert blob_id == git(repo_dir, "hash-object", path).strip()
+    assert provider.n_from_index == 1
+    assert provider.n_hashed == 2
+
+    # the dir fingerprint is the same no matter where blob ids come from
+    dir_fingerprint = provider.of_dir("pkg")
+    fp = FingerPrint("sha1")
+    dir_path = os.path.join(repo_dir, "pkg")
+    relpath_list = ["__init__.py", "a.py", "new.py", "sub/b.py"]
+    assert dir_fingerprint == fp.of_named_digests([
+        (
+            relpath,
+            bytes(bytearray.fromhex(
+                git_blob_id(os.path.join(dir_path, *relpath.split("/")))
+            )),
+        )
+        for relpath in relpath_list
+    ])
+
+    git(repo_dir, "add", "-A")
+    assert GitIndexFingerPrint(repo_dir).of_dir(dir_path) == dir_fingerprint
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from pygitrepo.pkg.ignore import IgnoreMatcher, parse_pattern, DEFAULT_IGNORE
+from pygitrepo.pkg.fingerprint import walk_files
+from pygitrepo.helpers import copy_python_code
+
+
+@pytest.mark.parametrize(
+    "pattern,path,is_dir,expected",
+    [
+        ("*.pyc", "a.pyc", False, True),
+        ("*.pyc", "pkg/sub/a.pyc", False, True),
+        ("*.pyc", "a.py", False, False),
+        ("__pycache__/", "pkg/__pycache__", True, True),
+        ("__pycache__/", "pkg/__pycache__", False, False),
+        ("/setup.py", "setup.py", False, True),
+        ("/setup.py", "pkg/setup.py", False, False),
+        ("pkg/tests", "pkg/tests", True, True),
+        ("pkg/tests", "other/pkg/tests", True, False),
+        ("**/fixtures", "a/b/fixtures", True, True),
+        ("**/fixtures", "fixtures", True, True),
+        ("pkg/**/data.json", "pkg/data.json", False, True),
+        ("pkg/**/data.json", "pkg/a/b/data.json", False, True),
+        ("docs/**", "docs/a/b.rst", False, True),
+        ("docs/**", "docs", True, False),
+        ("mod?.py", "mod1.py", False, True),
+        ("mod?.py", "mod10.py", False, False),
+        ("mod[0-4].py", "mod3.py", False, True),
+        ("mod[!0-4].py", "mod3.py", False, False),
+        ("*.ipynb", "nb/a b.ipynb", False, True),
+        ("\\#hash", "#hash", False, True),
+        ("a+b(c).txt", "a+b(c).txt", False, True),
+    ],
+)
+def test_match(pattern, path, is_dir, expected):
+    assert IgnoreMatcher([pattern]).match(path, is_dir=is_dir) is expected
+
+
+def test_parse_pattern():
+    assert parse_pattern("") is None
+    assert parse_pattern("# comment") is None
+    assert parse_pattern("  \n") is None
+    assert parse_pattern("!keep.py")[1] is True
+    assert parse_pattern("build/")[2] is True
+
+
+def test_negation():
+    matcher = IgnoreMatcher(["*.json", "!config.json", "data/"])
+    assert matcher.match("a.json") is True
+    assert matcher.match("pkg/config.json") is False
+    # the last matching rule wins
+    assert IgnoreMatcher(["!a.json", "*.json"]).match("a.json") is True
+    # a file in an ignored directory can't be re-included
+    matcher = IgnoreMatcher(["data/", "!data/keep.json"])
+    assert matcher.is_ignored("data/keep.json") is True
+    assert matcher.is_ignored("pkg/data/a.json") is True
+    assert IgnoreMatcher([]).match("a.py") is False
+
+
+def make_tree(tmpdir):
+    root = tmpdir.mkdir("project")
+    for relpath in [
+        "pkg/__init__.py",
+        "pkg/a.py",
+        "pkg/a.pyc",
+        "pkg/__pycache__/a.cpython-38.pyc",
+        "pkg/tests/test_a.py",
+        "pkg/tests/fixtures/big.bin",
+        "pkg/notebook.ipynb",
+        "pkg/data/keep.json",
+        "pkg/data/drop.json",
+        "setup.py",
+    ]:
+        root.join(*relpath.split("/")).write("x", ensure=True)
+    root.join(".pgrignore").write(
+        "# artifacts\n"
+        "*.ipynb\n"
+        "/pkg/tests/\n"
+        "*.json\n"
+        "!keep.json\n"
+    )
+    return str(root)
+
+
+def test_walk(tmpdir):
+    root = make_tree(tmpdir)
+    dir_pkg = os.path.join(root, "pkg")
+    assert IgnoreMatcher().walk(dir_pkg) == [
+        "__init__.py", "a.py", "data/drop.json", "data/keep.json",
+        "notebook.ipynb", "tests/fixtures/big.bin", "tests/test_a.py",
+    ]
+
+    # anchored patterns are relative to the .pgrignore file, not the walk root
+    matcher = IgnoreMatcher.from_file(os.path.join(root, ".pgrignore"))
+    assert matcher.patterns[:len(DEFAULT_IGNORE)] == list(DEFAULT_IGNORE)
+    assert matcher.walk(dir_pkg) == ["__init__.py", "a.py", "data/keep.json"]
+    assert matcher.walk(os.path.join(dir_pkg, "tests")) == []
+    assert walk_files(dir_pkg, exclude=matcher) == matcher.walk(dir_pkg)
+    with pytest.raises(ValueError):
+        matcher.walk(str(tmpdir))
+
+    matcher = IgnoreMatcher.from_file(
+        os.path.join(root, "not-exists"), extra_patterns=["/pkg/data/"],
+    )
+    assert matcher.walk(root) == [
+        ".pgrignore", "pkg/__init__.py", "pkg/a.py", "pkg/notebook.ipynb",
+        "pkg/tests/fixtures/big.bin", "pkg/tests/test_a.py", "setup.py",
+    ]
+
+    to_dir = str(tmpdir.join("copy"))
+    copy_python_code(dir_pkg, to_dir, matcher=matcher)
+    assert IgnoreMatcher([]).walk(to_dir) == [
+        "__init__.py", "a.py", "notebook.ipynb",
+        "tests/fixtures/big.bin", "tests/test_a.py",
+    ]
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
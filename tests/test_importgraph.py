@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from pygitrepo.pkg.importgraph import module_name_of, find_imports, ImportGraph
+
+
+def test_module_name_of():
+    assert module_name_of("pkg/__init__.py") == "pkg"
+    assert module_name_of("pkg/sub/mod.py") == "pkg.sub.mod"
+
+
+def test_find_imports():
+    source = b"""
+import os, json as js
+import pkg.a
+from pkg import b, c as cc
+from . import d
+from .e import f
+from ..g import *
+from ... import too_far
+
+def lazy():
+    from .h import i
+
+try:
+    import ujson
+except ImportError:
+    pass
+"""
+    assert find_imports(source, "pkg.sub.mod") == {
+        "os", "json", "pkg.a", "pkg", "pkg.b", "pkg.c",
+        "pkg.sub", "pkg.sub.d", "pkg.sub.e", "pkg.sub.e.f",
+        "pkg.g", "pkg.sub.h", "pkg.sub.h.i", "ujson",
+    }
+    # in a package, "." is the package itself
+    assert find_imports("from . import x", "pkg.sub", is_package=True) \
+           == {"pkg.sub", "pkg.sub.x"}
+
+
+def make_package(tmpdir):
+    files = {
+        "pkg/__init__.py": "from ._version import __version__\n",
+        "pkg/_version.py": "__version__ = '0.1'\n",
+        "pkg/api.py": "from .core import run\nfrom .util import helper\n",
+        "pkg/core.py": "import json\nfrom pkg.sub.models import Model\n",
+        "pkg/util.py": "def helper(): pass\n",
+        "pkg/sub/__init__.py": "",
+        "pkg/sub/models.py": "class Model(object): pass\n",
+        "pkg/sub/unused.py": "import pkg.api\n",
+        "pkg/plugins/__init__.py": "",
+        "pkg/plugins/csv_plugin.py": "",
+        "pkg/cli.py": "import click\nfrom pkg import api\n",
+        "pkg/data/config.json": "{}",
+        "lambda_app/app.py": "from pkg.api import run\n",
+    }
+    root = tmpdir.mkdir("project")
+    for relpath, content in files.items():
+        root.join(*relpath.split("/")).write(content, ensure=True)
+    return str(root)
+
+
+def test_reachable(tmpdir):
+    root = make_package(tmpdir)
+    graph = ImportGraph.from_dir(root, "pkg")
+    assert len(graph.modules) == 11
+
+    core = {
+        "pkg", "pkg._version", "pkg.api", "pkg.core", "pkg.util",
+        "pkg.sub", "pkg.sub.models",
+    }
+    assert graph.reachable(entry_files=[str(tmpdir.join("project", "lambda_app", "app.py"))]) == core
+    assert graph.reachable(entry_modules=["pkg.api"]) == core
+    assert graph.reachable(entry_modules=["pkg.api"], allowlist=["pkg.plugins.*"]) \
+           == core | {"pkg.plugins", "pkg.plugins.csv_plugin"}
+    assert graph.reachable(entry_modules=["pkg.sub.unused"]) == core | {"pkg.sub.unused"}
+    assert graph.reachable(entry_modules=["requests"]) == set()
+
+    graph = ImportGraph.from_dir(root, "pkg", relpath_list=["pkg/__init__.py", "pkg/util.py"])
+    assert graph.reachable(entry_modules=["pkg.util"]) == {"pkg", "pkg.util"}
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import subprocess
+import pytest
+from pygitrepo.pkg.importtime import (
+    parse_importtime, profile_import, find_module, heaviest, format_tree,
+)
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       100 |        100 | _io
+import time:        30 |         30 |       re._parser
+import time:        20 |         50 |     re._compiler
+import time:       400 |        450 |   re
+import time:       344 |        344 |   _json
+import time:       850 |       1644 | json
+some other stderr line
+"""
+
+
+def test_parse_importtime():
+    roots = parse_importtime(OUTPUT)
+    assert [(node.name, node.self_us, node.cumulative_us) for node in roots] \
+           == [("_io", 100, 100), ("json", 850, 1644)]
+    json = roots[1]
+    assert [node.name for node in json.children] == ["re", "_json"]
+    assert [(depth, node.name) for depth, node in json.walk()] == [
+        (0, "json"), (1, "re"), (2, "re._compiler"), (3, "re._parser"), (1, "_json"),
+    ]
+    assert find_module(roots, "re._compiler").cumulative_us == 50
+    assert find_module(roots, "yaml") is None
+
+    assert [node.name for node in heaviest(roots, top=3)] == ["json", "re", "_json"]
+    lines = format_tree(roots, min_us=100)
+    assert [line.split("ms")[-1].rstrip() for line in lines] == [
+        "  json", "    re", "    _json", "  _io",
+    ]
+    assert len(format_tree(roots, max_depth=0)) == 2
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires Python3.7+")
+def test_profile_import(tmpdir):
+    tmpdir.join("pkg", "__init__.py").write("from . import heavy\n", ensure=True)
+    tmpdir.join("pkg", "heavy.py").write("import json\nx = sum(range(100000))\n")
+    tmpdir.join("broken.py").write("import not_exists_module\n")
+
+    roots = profile_import(sys.executable, [str(tmpdir)], "pkg")
+    node = find_module(roots, "pkg")
+    assert [child.name for child in node.children] == ["pkg.heavy"]
+    assert node.cumulative_us >= node.children[0].cumulative_us
+
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        profile_import(sys.executable, [str(tmpdir)], "broken")
+    assert "not_exists_module" in e.value.output
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires Python3.7+")
+def test_profile_import_cwd(tmpdir, monkeypatch):
+    # a package with the same name in the current directory is not imported
+    tmpdir.join("task", "pkg", "__init__.py").write("import json\n", ensure=True)
+    tmpdir.join("cwd", "pkg", "__init__.py").write("raise ImportError('shadowed')\n", ensure=True)
+    monkeypatch.chdir(str(tmpdir.join("cwd")))
+
+    roots = profile_import(sys.executable, [str(tmpdir.join("task"))], "pkg")
+    assert find_module(roots, "pkg") is not None
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import pytest
+from pygitrepo.pkg.inventory import (
+    Inventory, get_inventory, clear_cache, cache_path,
+    KIND_FILE, KIND_DIR, KIND_LINK, NO_CACHE_ENV_VAR,
+)
+
+
+def make_tree(tmpdir):
+    root = tmpdir.mkdir("root")
+    for relpath in ["a.py", "pkg/__init__.py", "pkg/sub/b.py", "pkg/sub/c.txt"]:
+        root.join(*relpath.split("/")).write("x", ensure=True)
+    age_tree(str(root))
+    return str(root)
+
+
+def age_tree(root):
+    """
+    Move all mtime out of the racy window, so directory listings can be reused.
+    """
+    past = time.time() - 3600
+    for dirname, _, basename_list in os.walk(root):
+        for basename in basename_list:
+            os.utime(os.path.join(dirname, basename), (past, past))
+        os.utime(dirname, (past, past))
+
+
+def test_scan_and_refresh(tmpdir):
+    root = make_tree(tmpdir)
+    inventory = Inventory(root)
+    inventory.scan()
+    assert inventory.walk() == ["a.py", "pkg/__init__.py", "pkg/sub/b.py", "pkg/sub/c.txt"]
+    assert inventory.walk("pkg") == ["__init__.py", "sub/b.py", "sub/c.txt"]
+    assert inventory.walk("not-exists") == []
+    assert inventory.walk(prune=lambda relpath, is_dir: relpath == "pkg/sub") \
+           == ["a.py", "pkg/__init__.py"]
+    assert inventory.walk(prune=lambda relpath, is_dir: relpath.endswith(".txt")) \
+           == ["a.py", "pkg/__init__.py", "pkg/sub/b.py"]
+    assert inventory.get("a.py")[:2] == (KIND_FILE, 1)
+    assert inventory.get("pkg")[0] == KIND_DIR
+    assert inventory.get("b.py") is None
+    assert inventory.n_listed == 3
+
+    # nothing changed, no directory is listed again
+    inventory.refresh()
+    assert (inventory.n_listed, inventory.n_reused) == (0, 3)
+
+    # in place edit doesn't change the directory mtime, the file is stat again
+    with open(os.path.join(root, "pkg", "sub", "b.py"), "a") as f:
+        f.write("yz")
+    inventory.refresh()
+    assert inventory.get("pkg/sub/b.py")[1] == 3
+    assert inventory.n_listed == 0
+
+    # added and removed files change the directory mtime
+    os.remove(os.path.join(root, "pkg", "sub", "c.txt"))
+    with open(os.path.join(root, "pkg", "d.py"), "w") as f:
+        f.write("d")
+    inventory.refresh()
+    assert inventory.walk() == ["a.py", "pkg/__init__.py", "pkg/d.py", "pkg/sub/b.py"]
+    assert (inventory.n_listed, inventory.n_reused) == (2, 1)
+
+    # directories changed within the racy window are always listed again
+    inventory.refresh()
+    assert inventory.n_listed == 2
+
+
+def test_prune_and_syscalls(tmpdir, monkeypatch):
+    root = make_tree(tmpdir)
+    inventory = Inventory(root, prune=lambda relpath, is_dir: relpath == "pkg/sub")
+    inventory.scan()
+    # the pruned directory is never listed
+    assert inventory.n_listed == 2
+    assert "pkg/sub" not in inventory.dirs
+    assert "pkg/sub/b.py" not in inventory.entries
+    assert inventory.walk() == ["a.py", "pkg/__init__.py"]
+
+    # a refresh only stat directories, not files
+    stat_calls = list()
+    real_stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        stat_calls.append(path)
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", counting_stat)
+    inventory.refresh()
+    assert (inventory.n_listed, inventory.n_reused) == (0, 2)
+    monkeypatch.undo()
+    assert sorted(stat_calls) == sorted([root, os.path.join(root, "pkg")])
+
+    with pytest.raises(ValueError):
+        get_inventory(root, prune=lambda relpath, is_dir: False)
+
+
+def test_symlink_and_missing_root(tmpdir):
+    root = make_tree(tmpdir)
+    if hasattr(os, "symlink"):
+        os.symlink(os.path.join(root, "pkg"), os.path.join(root, "link"))
+        inventory = Inventory(root)
+        inventory.scan()
+        assert inventory.get("link")[0] == KIND_LINK
+        assert "link/__init__.py" not in inventory.walk()
+
+    inventory = Inventory(str(tmpdir.join("not-exists")))
+    inventory.scan()
+    assert inventory.walk() == []
+
+
+def test_get_inventory(tmpdir, monkeypatch):
+    monkeypatch.delenv(NO_CACHE_ENV_VAR, raising=False)
+    root = make_tree(tmpdir)
+    cache_dir = str(tmpdir.join("cache"))
+    clear_cache()
+    try:
+        inventory = get_inventory(root, persist=True, cache_dir=cache_dir)
+        assert inventory.n_listed == 3
+        assert os.path.exists(cache_path(root, cache_dir))
+        # one inventory per process, refreshed on every get
+        assert get_inventory(root) is inventory
+        assert inventory.n_reused == 3
+
+        # the next process starts from the persisted inventory
+        clear_cache()
+        inventory = get_inventory(root, persist=True, cache_dir=cache_dir)
+        assert (inventory.n_listed, inventory.n_reused) == (0, 3)
+        assert inventory.walk() == ["a.py", "pkg/__init__.py", "pkg/sub/b.py", "pkg/sub/c.txt"]
+
+        # a broken cache file is ignored
+        with open(cache_path(root, cache_dir), "w") as f:
+            f.write("{")
+        clear_cache()
+        assert get_inventory(root, persist=True, cache_dir=cache_dir).n_listed == 3
+
+        monkeypatch.setenv(NO_CACHE_ENV_VAR, "1")
+        clear_cache()
+        assert get_inventory(root, persist=True, cache_dir=cache_dir).n_listed == 3
+    finally:
+        clear_cache()
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info[:2] < (3, 7),
+    reason="unchecked hash pyc requires Python3.7+",
+)
+
+from pygitrepo.pkg import pycompile
+from pygitrepo.pkg.pycompile import (
+    pyc_arcname, compile_files, measure_import_time,
+)
+
+
+def make_package(tmpdir):
+    dir_src = tmpdir.mkdir("src")
+    dir_src.mkdir("mypkg").mkdir("sub")
+    files = {
+        "mypkg/__init__.py": "from . import a\n",
+        "mypkg/a.py": "from .sub import b\nvalue = b.value + 1\n",
+        "mypkg/sub/__init__.py": "",
+        "mypkg/sub/b.py": "value = 1\n",
+    }
+    to_compile_list = list()
+    for arcname, content in sorted(files.items()):
+        p = dir_src.join(*arcname.split("/"))
+        p.write(content)
+        to_compile_list.append((str(p), arcname))
+    return to_compile_list
+
+
+def test_pyc_arcname():
+    tag = sys.implementation.cache_tag
+    assert pyc_arcname("mypkg/sub/b.py") == "mypkg/sub/__pycache__/b.{}.pyc".format(tag)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_compile_files(tmpdir, workers):
+    to_compile_list = make_package(tmpdir)
+    dir_out = str(tmpdir.join("pycache"))
+    pyc_list = compile_files(to_compile_list, dir_out, workers=workers)
+    assert [arcname for _, arcname in pyc_list] \
+           == [pyc_arcname(arcname) for _, arcname in to_compile_list]
+    for cfile, arcname in pyc_list:
+        assert cfile == os.path.join(dir_out, *arcname.split("/"))
+        with io.open(cfile, "rb") as f:
+            header = f.read(16)
+        # flags: hash based, unchecked
+        assert header[4:8] == b"\x01\x00\x00\x00"
+
+    # pyc are loaded without checking the source, the source can't be stale
+    dir_lambda = tmpdir.mkdir("lambda")
+    for path, arcname in to_compile_list + pyc_list:
+        target = dir_lambda.join(*arcname.split("/"))
+        target.dirpath().ensure(dir=True)
+        with io.open(path, "rb") as f:
+            target.write_binary(f.read())
+    dir_lambda.join("mypkg", "sub", "b.py").write("value = 100\n")
+    env = dict(os.environ, PYTHONPATH=str(dir_lambda))
+    output = subprocess.check_output(
+        [sys.executable, "-B", "-c", "import mypkg; print(mypkg.a.value)"],
+        env=env,
+    )
+    assert output.strip() == b"2"
+
+    seconds = measure_import_time(sys.executable, str(dir_lambda), "mypkg", repeat=1)
+    assert seconds >= 0
+
+
+def test_measure_import_time_cwd(tmpdir, monkeypatch):
+    # a package with the same name in the current directory is not imported
+    tmpdir.join("lambda", "mypkg", "__init__.py").write("value = 1\n", ensure=True)
+    tmpdir.join("cwd", "mypkg", "__init__.py").write("raise ImportError('shadowed')\n", ensure=True)
+    monkeypatch.chdir(str(tmpdir.join("cwd")))
+    seconds = measure_import_time(sys.executable, str(tmpdir.join("lambda")), "mypkg", repeat=1)
+    assert seconds >= 0
+
+
+def test_main(tmpdir):
+    to_compile_list = make_package(tmpdir)
+    dir_out = str(tmpdir.join("pycache"))
+    script = os.path.splitext(pycompile.__file__)[0] + ".py"
+    p = subprocess.Popen(
+        [sys.executable, script, "compile", dir_out],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    stdout, _ = p.communicate(json.dumps(to_compile_list).encode("utf-8"))
+    assert p.returncode == 0
+    pyc_list = json.loads(stdout.decode("utf-8"))
+    assert len(pyc_list) == 4
+    assert all(os.path.exists(cfile) for cfile, _ in pyc_list)
+
+    with pytest.raises(ValueError):
+        pycompile.main(["decompile"])
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import pytest
+from pygitrepo.pkg.fingerprint import HashingWriter, S3ETagHasher
+from pygitrepo.pkg.s3stream import (
+    StreamingUpload, TeeWriter, LocalDirTarget, Boto3Target, S3_MIN_PART_SIZE,
+)
+
+PART_SIZE = S3_MIN_PART_SIZE
+
+
+def stream(target, data, key_prefix="lambda/", chunk_size=1000 * 1000):
+    upload = StreamingUpload(target, key_prefix + "staging/tmp.zip", part_size=PART_SIZE)
+    buffer = io.BytesIO()
+    writer = HashingWriter(TeeWriter([buffer, upload]), ["md5"])
+    for i in range(0, len(data), chunk_size):
+        writer.write(data[i:i + chunk_size])
+    assert buffer.getvalue() == data
+    key = key_prefix + writer.digests["md5"].hex + ".zip"
+    hasher = S3ETagHasher(part_size=PART_SIZE, multipart_threshold=PART_SIZE)
+    hasher.update(data)
+    uploaded = upload.commit(key, metadata={"code-sha256": "abc"}, etag=hasher.hexdigest())
+    return upload, key, hasher.hexdigest(), uploaded
+
+
+@pytest.mark.parametrize("size,n_parts", [
+    (100, 0),
+    (PART_SIZE, 1),
+    (PART_SIZE * 2 + 123, 3),
+])
+def test_streaming_upload(tmpdir, size, n_parts):
+    target = LocalDirTarget(str(tmpdir))
+    data = os.urandom(size)
+    upload, key, etag, uploaded = stream(target, data)
+    assert uploaded is True
+    # parts are uploaded while bytes are written, the last one on commit
+    assert upload.n_parts == n_parts
+    with io.open(target.path(key), "rb") as f:
+        assert f.read() == data
+    assert target.head(key) == {"ETag": etag, "Metadata": {"code-sha256": "abc"}}
+    # nothing left behind
+    assert target.head_etag("lambda/staging/tmp.zip") is None
+    if n_parts:
+        assert os.listdir(str(tmpdir.join(".uploads"))) == []
+
+    # the same content is not uploaded again
+    upload, key, etag, uploaded = stream(target, data)
+    assert uploaded is False
+
+
+def test_abort(tmpdir):
+    target = LocalDirTarget(str(tmpdir))
+    upload = StreamingUpload(target, "staging.zip", part_size=PART_SIZE)
+    upload.write(os.urandom(PART_SIZE + 1))
+    assert upload.n_parts == 1
+    upload.abort()
+    assert os.listdir(str(tmpdir.join(".uploads"))) == []
+    with pytest.raises(ValueError):
+        StreamingUpload(target, "staging.zip", part_size=1024)
+
+
+class FailingCompleteTarget(LocalDirTarget):
+    def complete_multipart_upload(self, key, upload_id, part_etags):
+        raise IOError("complete failed")
+
+
+def test_commit_failure_aborts(tmpdir):
+    target = FailingCompleteTarget(str(tmpdir))
+    upload = StreamingUpload(target, "staging.zip", part_size=PART_SIZE)
+    upload.write(os.urandom(PART_SIZE + 1))
+    with pytest.raises(IOError):
+        upload.commit("final.zip")
+    assert upload.upload_id is None
+    assert os.listdir(str(tmpdir.join(".uploads"))) == []
+
+
+class CountingTarget(LocalDirTarget):
+    n_part_copy = 0
+
+    def upload_part_copy(self, *args):
+        self.n_part_copy += 1
+        return super(CountingTarget, self).upload_part_copy(*args)
+
+
+def test_final_key(tmpdir):
+    target = CountingTarget(str(tmpdir))
+    data = os.urandom(PART_SIZE * 2 + 123)
+    upload = StreamingUpload(
+        target, "staging.zip", part_size=PART_SIZE,
+        final_key="final.zip", metadata={"k": "v"},
+    )
+    upload.write(data)
+    with pytest.raises(ValueError):
+        upload.commit("other.zip")
+    assert upload.commit("final.zip") is True
+    assert target.n_part_copy == 0
+    assert upload.n_parts == 3
+    with io.open(target.path("final.zip"), "rb") as f:
+        assert f.read() == data
+    assert target.head("final.zip")["Metadata"] == {"k": "v"}
+    assert target.head_etag("staging.zip") is None
+
+
+def test_boto3_target_with_moto(tmpdir):
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    mock = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+    with mock():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="my-bucket")
+        target = Boto3Target(client, "my-bucket")
+        data = os.urandom(PART_SIZE * 2 + 123)
+        upload, key, etag, uploaded = stream(target, data)
+        assert uploaded is True
+        assert target.head_etag(key) == etag
+        response = client.get_object(Bucket="my-bucket", Key=key)
+        assert response["Body"].read() == data
+        assert response["Metadata"] == {"code-sha256": "abc"}
+        assert target.head_etag("lambda/staging/tmp.zip") is None
+        assert stream(target, data)[3] is False
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
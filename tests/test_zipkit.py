@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import time
+import shutil
+import subprocess
+import pytest
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
+from pygitrepo.pkg import zipkit
+from pygitrepo.pkg.zipkit import (
+    ZipWriter, compress_file, read_raw, build_zip, walk_dir, main,
+    source_date_epoch, DOS_EPOCH,
+    CompressionPolicy, compare_policies, ZIP_BZIP2, ZIP_LZMA,
+    zip_report, splice_zips, strip_layer_prefix, compress_files,
+)
+
+
+def make_tree(tmpdir):
+    dir_src = tmpdir.mkdir("src")
+    past = time.time() - 3600
+    to_zip_list = list()
+    for i in range(10):
+        p = dir_src.join("mod{}.py".format(i))
+        p.write_binary("x = {}\n".format(i).encode("utf-8") * (i * 100 + 1))
+        os.utime(str(p), (past, past))
+        to_zip_list.append((str(p), "pkg/mod{}.py".format(i)))
+    p = dir_src.join(u"文档.txt")
+    p.write_binary(b"hello")
+    os.utime(str(p), (past, past))
+    to_zip_list.append((str(p), u"pkg/文档.txt"))
+    return to_zip_list
+
+
+def read_zip(path):
+    with ZipFile(path) as f:
+        assert f.testzip() is None
+        return [(zinfo.filename, f.read(zinfo)) for zinfo in f.infolist()]
+
+
+def expected_content(to_zip_list):
+    content = list()
+    for source_path, arcname in to_zip_list:
+        with io.open(source_path, "rb") as f:
+            content.append((arcname, f.read()))
+    return content
+
+
+@pytest.mark.parametrize("compress_type", [ZIP_STORED, ZIP_DEFLATED])
+def test_build_zip(tmpdir, compress_type):
+    to_zip_list = make_tree(tmpdir)
+    path_v1 = str(tmpdir.join("v1.zip"))
+    with io.open(path_v1, "wb") as f:
+        stats = build_zip(f, to_zip_list, compress_type=compress_type)
+    assert stats == dict(n_members=11, n_reused=0, n_compressed=11)
+    assert read_zip(path_v1) == expected_content(to_zip_list)
+
+    # nothing changed, everything is reused, same bytes as a full build
+    path_v2 = str(tmpdir.join("v2.zip"))
+    with io.open(path_v2, "wb") as f:
+        stats = build_zip(
+            f, to_zip_list, compress_type=compress_type, previous=path_v1)
+    assert stats == dict(n_members=11, n_reused=11, n_compressed=0)
+    with io.open(path_v1, "rb") as f1, io.open(path_v2, "rb") as f2:
+        assert f1.read() == f2.read()
+
+    # one file changed, one file touched, one file removed
+    with io.open(to_zip_list[3][0], "ab") as f:
+        f.write(b"y = 1\n")
+    os.utime(to_zip_list[5][0], None)
+    del to_zip_list[7]
+    path_v3 = str(tmpdir.join("v3.zip"))
+    with io.open(path_v3, "wb") as f:
+        stats = build_zip(
+            f, to_zip_list, compress_type=compress_type, previous=path_v2)
+    assert stats == dict(n_members=10, n_reused=9, n_compressed=1)
+    assert read_zip(path_v3) == expected_content(to_zip_list)
+    path_v4 = str(tmpdir.join("v4.zip"))
+    with io.open(path_v4, "wb") as f:
+        build_zip(f, to_zip_list, compress_type=compress_type)
+    with io.open(path_v3, "rb") as f3, io.open(path_v4, "rb") as f4:
+        assert f3.read() == f4.read()
+
+    # a broken previous archive is ignored
+    broken = tmpdir.join("broken.zip")
+    broken.write_binary(b"not a zip")
+    with io.open(str(tmpdir.join("v5.zip")), "wb") as f:
+        stats = build_zip(f, to_zip_list, previous=str(broken))
+    assert stats["n_reused"] == 0
+
+
+def test_build_zip_level_change(tmpdir):
+    to_zip_list = make_tree(tmpdir)
+    path_v1 = str(tmpdir.join("v1.zip"))
+    with io.open(path_v1, "wb") as f:
+        build_zip(f, to_zip_list, compresslevel=1)
+
+    # members of an archive built at another level are not reused
+    path_v2 = str(tmpdir.join("v2.zip"))
+    with io.open(path_v2, "wb") as f:
+        stats = build_zip(f, to_zip_list, compresslevel=9, previous=path_v1)
+    assert stats["n_reused"] == 0
+    buffer = io.BytesIO()
+    build_zip(buffer, to_zip_list, compresslevel=9)
+    with io.open(path_v2, "rb") as f:
+        assert f.read() == buffer.getvalue()
+
+    # nor members of a policy change, or of an archive of unknown policy
+    policy = CompressionPolicy(rules=[("*.txt", ZIP_STORED, None)], default=(ZIP_DEFLATED, 9))
+    assert build_zip(io.BytesIO(), to_zip_list, policy=policy, previous=path_v2)["n_reused"] == 0
+    path_v3 = str(tmpdir.join("v3.zip"))
+    with ZipFile(path_v3, "w", ZIP_DEFLATED) as f:
+        for source_path, arcname in to_zip_list:
+            f.write(source_path, arcname)
+    assert build_zip(io.BytesIO(), to_zip_list, previous=path_v3)["n_reused"] == 0
+
+    assert build_zip(io.BytesIO(), to_zip_list, compresslevel=9, previous=path_v2)["n_reused"] \
+           == len(to_zip_list)
+
+
+def test_build_zip_parallel(tmpdir):
+    to_zip_list = make_tree(tmpdir)
+    contents = list()
+    for workers, executor in [(1, "thread"), (4, "thread"), (3, "process")]:
+        buffer = io.BytesIO()
+        build_zip(buffer, to_zip_list, workers=workers, executor=executor)
+        contents.append(buffer.getvalue())
+    assert contents[0] == contents[1] == contents[2]
+    with ZipFile(io.BytesIO(contents[0])) as f:
+        assert f.infolist()[0].compress_type == ZIP_DEFLATED
+
+    with pytest.raises(ValueError):
+        build_zip(io.BytesIO(), to_zip_list, executor="fiber")
+
+
+def test_build_zip_reproducible(tmpdir, monkeypatch):
+    monkeypatch.delenv("SOURCE_DATE_EPOCH", raising=False)
+    assert source_date_epoch() == (1980, 1, 1, 0, 0, 0)
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "1600000000")
+    assert source_date_epoch() == (2020, 9, 13, 12, 26, 40)
+
+    to_zip_list = make_tree(tmpdir)
+    buffer1 = io.BytesIO()
+    build_zip(buffer1, to_zip_list, reproducible=True)
+
+    # different order, mtime and permission
+    for source_path, _ in to_zip_list:
+        os.utime(source_path, None)
+        os.chmod(source_path, 0o600)
+    os.chmod(to_zip_list[0][0], 0o700)
+    path_v1 = str(tmpdir.join("v1.zip"))
+    with io.open(path_v1, "wb") as f:
+        build_zip(f, to_zip_list[::-1], reproducible=True)
+    with io.open(path_v1, "rb") as f:
+        content = f.read()
+    with ZipFile(path_v1) as f:
+        zinfo_list = f.infolist()
+        assert [zinfo.filename for zinfo in zinfo_list] \
+               == sorted(arcname for _, arcname in to_zip_list)
+        assert zinfo_list[0].date_time == (2020, 9, 13, 12, 26, 40)
+        assert zinfo_list[0].external_attr >> 16 == 0o100755
+        assert zinfo_list[1].external_attr >> 16 == 0o100644
+    os.chmod(to_zip_list[0][0], 0o600)
+    buffer2 = io.BytesIO()
+    build_zip(buffer2, to_zip_list, reproducible=True)
+    assert buffer1.getvalue() == buffer2.getvalue()
+
+    # members are reused by CRC, the date time is not the mtime
+    with io.open(to_zip_list[3][0], "ab") as f:
+        f.write(b"y = 1\n")
+    buffer3 = io.BytesIO()
+    stats = build_zip(buffer3, to_zip_list, reproducible=True, previous=path_v1)
+    assert stats == dict(n_members=11, n_reused=10, n_compressed=1)
+    buffer4 = io.BytesIO()
+    build_zip(buffer4, to_zip_list, reproducible=True)
+    assert buffer3.getvalue() == buffer4.getvalue() != content
+
+
+def test_build_zip_streaming(tmpdir, monkeypatch):
+    to_zip_list = make_tree(tmpdir)
+    big = tmpdir.join("src", "big.bin")
+    big.write_binary(os.urandom(3000) * 100)
+    to_zip_list.append((str(big), "big.bin"))
+    buffer1 = io.BytesIO()
+    build_zip(buffer1, to_zip_list, reproducible=True)
+
+    # large files are compressed into temp files, the output is the same
+    monkeypatch.setattr(zipkit, "STREAM_THRESHOLD", 1000)
+    monkeypatch.setattr(zipkit, "_CHUNK_SIZE", 4096)
+    dir_tmp = tmpdir.mkdir("tmp")
+    monkeypatch.setattr(zipkit.tempfile, "tempdir", str(dir_tmp))
+    for compress_type in [ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA]:
+        path = str(tmpdir.join("v1.zip"))
+        for workers in [1, 2]:
+            with io.open(path, "wb") as f:
+                build_zip(f, to_zip_list, compress_type=compress_type, workers=workers)
+            assert read_zip(path) == expected_content(to_zip_list)
+            # members are copied chunk by chunk from the previous build
+            buffer2 = io.BytesIO()
+            stats = build_zip(buffer2, to_zip_list, compress_type=compress_type, previous=path)
+            assert stats["n_reused"] == len(to_zip_list)
+            with io.open(path, "rb") as f:
+                assert f.read() == buffer2.getvalue()
+    buffer2 = io.BytesIO()
+    build_zip(buffer2, to_zip_list, reproducible=True)
+    assert buffer1.getvalue() == buffer2.getvalue()
+    assert dir_tmp.listdir() == []
+
+
+def test_compress_files_window(tmpdir, monkeypatch):
+    to_zip_list = make_tree(tmpdir)
+    n_started = [0]
+    compress_task = zipkit._compress_task
+
+    def counting_compress_task(task):
+        n_started[0] += 1
+        return compress_task(task)
+
+    monkeypatch.setattr(zipkit, "_compress_task", counting_compress_task)
+    for n_consumed, _ in enumerate(compress_files(to_zip_list, workers=2), 1):
+        time.sleep(0.01)
+        assert n_started[0] <= n_consumed + 4
+    assert n_started[0] == len(to_zip_list)
+
+
+def test_compression_policy(tmpdir):
+    policy = CompressionPolicy.from_config([
+        {"pattern": "*.png", "method": "stored"},
+        {"pattern": "pkg/mod1*", "method": "deflate", "level": 9},
+        {"pattern": "pkg/mod2*", "method": "bzip2"},
+        {"pattern": "pkg/mod3*", "method": "LZMA"},
+    ])
+    assert policy.match("a/b.png") == (ZIP_STORED, None)
+    assert policy.match("pkg/mod1.py") == (ZIP_DEFLATED, 9)
+    assert policy.match("pkg/mod4.py") == (ZIP_DEFLATED, None)
+    assert CompressionPolicy.default_policy().match("a.whl") == (ZIP_STORED, None)
+    with pytest.raises(ValueError):
+        CompressionPolicy.from_config([{"pattern": "*", "method": "zstd"}])
+
+    to_zip_list = make_tree(tmpdir)
+    path = str(tmpdir.join("a.zip"))
+    with io.open(path, "wb") as f:
+        build_zip(f, to_zip_list, policy=policy)
+    assert read_zip(path) == expected_content(to_zip_list)
+    with ZipFile(path) as f:
+        assert [zinfo.compress_type for zinfo in f.infolist()[:5]] \
+               == [ZIP_DEFLATED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA, ZIP_DEFLATED]
+
+    # changing the policy recompresses everything, the same as a clean build
+    with io.open(str(tmpdir.join("b.zip")), "wb") as f:
+        stats = build_zip(
+            f, to_zip_list, previous=path,
+            policy=CompressionPolicy.default_policy(),
+        )
+    assert stats["n_compressed"] == 11
+
+    report = compare_policies(to_zip_list, {
+        "stored": CompressionPolicy(default=(ZIP_STORED, None)),
+        "deflate": CompressionPolicy(),
+    })
+    assert [result["name"] for result in report] == ["stored", "deflate"]
+    assert report[0]["size"] > report[1]["size"]
+    assert report[0]["ratio"] > 1
+
+
+def test_zip_report(tmpdir):
+    path = str(tmpdir.join("layer.zip"))
+    with ZipFile(path, "w", ZIP_DEFLATED) as f:
+        f.writestr("python/requests/__init__.py", os.urandom(1000))
+        f.writestr("python/requests/api.py", os.urandom(3000))
+        f.writestr("python/lib/python3.8/site-packages/numpy/core/_multiarray.cpython-38-x86_64-linux-gnu.so", os.urandom(5000))
+        f.writestr("python/numpy.libs/libopenblas.so.0", os.urandom(2000))
+        f.writestr("python/six.py", os.urandom(10))
+        f.writestr("python/README", os.urandom(10))
+        f.writestr("python/empty/", b"")
+    report = zip_report(path, top=2)
+    assert report["n_members"] == 6
+    assert report["file_size"] == 11020
+    assert report["size"] == os.path.getsize(path)
+    assert [
+        (group["name"], group["n_members"], group["file_size"])
+        for group in report["by_package"]
+    ] == [
+        ("numpy", 1, 5000),
+        ("requests", 2, 4000),
+        ("numpy.libs", 1, 2000),
+        ("(top level)", 2, 20),
+    ]
+    assert {
+        group["name"]: group["n_members"] for group in report["by_file_type"]
+    } == {".py": 3, ".so": 2, "(none)": 1}
+    assert [member["name"] for member in report["largest"]] == [
+        "python/lib/python3.8/site-packages/numpy/core/_multiarray.cpython-38-x86_64-linux-gnu.so",
+        "python/requests/api.py",
+    ]
+
+
+def test_splice_zips(tmpdir):
+    assert strip_layer_prefix("python/six.py") == "six.py"
+    assert strip_layer_prefix("python/lib/python3.8/site-packages/six.py") == "six.py"
+    assert strip_layer_prefix("my_package/api.py") == "my_package/api.py"
+    # a top level package named lib
+    assert strip_layer_prefix("python/lib/foo.py") == "lib/foo.py"
+    assert strip_layer_prefix("python/lib/python/foo.py") == "lib/python/foo.py"
+
+    path_layer = str(tmpdir.join("layer.zip"))
+    with ZipFile(path_layer, "w", ZIP_DEFLATED) as f:
+        f.writestr("python/", b"")
+        f.writestr("python/six.py", b"six" * 100)
+        f.writestr("python/lib/python3.8/site-packages/requests/api.py", b"api" * 100)
+        f.writestr("python/my_package/__init__.py", b"old")
+    path_source = str(tmpdir.join("source.zip"))
+    with ZipFile(path_source, "w", ZIP_STORED) as f:
+        f.writestr("my_package/__init__.py", b"new")
+        f.writestr(u"my_package/文档.txt", b"hello")
+
+    buffer = io.BytesIO()
+    stats = splice_zips(buffer, [(path_layer, strip_layer_prefix), (path_source, None)])
+    assert stats == {"n_members": 4, "n_overridden": 1}
+    with ZipFile(io.BytesIO(buffer.getvalue())) as f:
+        assert f.testzip() is None
+        assert [(zinfo.filename, zinfo.compress_type) for zinfo in f.infolist()] == [
+            ("six.py", ZIP_DEFLATED),
+            ("requests/api.py", ZIP_DEFLATED),
+            ("my_package/__init__.py", ZIP_STORED),
+            (u"my_package/文档.txt", ZIP_STORED),
+        ]
+        assert f.read("my_package/__init__.py") == b"new"
+        assert f.read("six.py") == b"six" * 100
+
+
+def test_main(tmpdir):
+    to_zip_list = make_tree(tmpdir)
+    dir_src = str(tmpdir.join("src"))
+    assert [arcname for _, arcname in walk_dir(dir_src, exclude=["mod1*"])] \
+           == ["mod0.py"] + ["mod{}.py".format(i) for i in range(2, 10)] + [u"文档.txt"]
+
+    path = os.path.join(dir_src, "out.zip")
+    assert main([path, dir_src, "-x", "mod*", "-w", "2"]) == 0
+    assert read_zip(path) == [(u"文档.txt", b"hello")]
+
+    # a copy of the module runs where pygitrepo is not installed
+    script = str(tmpdir.join("zipkit.py"))
+    shutil.copyfile(os.path.splitext(zipkit.__file__)[0] + ".py", script)
+    path = str(tmpdir.join("layer.zip"))
+    subprocess.check_call([
+        sys.executable, "-S", script, path, dir_src, "-p", "python/", "-x", "python/mod*", "python/out.zip",
+    ])
+    assert read_zip(path) == [(u"python/文档.txt", b"hello")]
+
+
+def test_zip_writer(tmpdir):
+    to_zip_list = make_tree(tmpdir)
+    path = str(tmpdir.join("a.zip"))
+    with io.open(path, "wb") as f:
+        with ZipWriter(f) as writer:
+            for source_path, arcname in to_zip_list:
+                zinfo, raw = compress_file(source_path, arcname, ZIP_DEFLATED)
+                writer.write_member(zinfo, raw)
+        with pytest.raises(ValueError):
+            writer.write_member(zinfo, raw)
+    assert read_zip(path) == expected_content(to_zip_list)
+
+    with ZipFile(path) as zf, io.open(path, "rb") as f:
+        zinfo = zf.infolist()[0]
+        assert len(read_raw(f, zinfo)) == zinfo.compress_size
+
+
+def test_zip_writer_zip64_members(tmpdir):
+    path = str(tmpdir.join("a.zip"))
+    n = 0x10000 + 10
+    with io.open(path, "wb") as f:
+        with ZipWriter(f) as writer:
+            for i in range(n):
+                zinfo = ZipInfo("{}.txt".format(i), date_time=(1980, 1, 1, 0, 0, 0))
+                zinfo.CRC, zinfo.file_size, zinfo.compress_size = 0, 0, 0
+                writer.write_member(zinfo, b"")
+    with ZipFile(path) as zf:
+        assert len(zf.infolist()) == n
+        assert zf.read("{}.txt".format(n - 1)) == b""
+
+
+def test_zip_writer_zip64_sizes(tmpdir):
+    # a sparse file, the archive starts beyond 4GB
+    path = str(tmpdir.join("a.zip"))
+    big = 5 * 1024 ** 3
+    with io.open(path, "wb") as f:
+        f.seek(0xFFFFFFFF + 1)
+        writer = ZipWriter(f)
+        writer._offset = f.tell()
+        zinfo, raw = compress_file(__file__, "small.py", ZIP_DEFLATED)
+        writer.write_member(zinfo, raw)
+        # the sizes are only written to the headers, the data isn't checked
+        zinfo = ZipInfo("big.bin", date_time=(1980, 1, 1, 0, 0, 0))
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.CRC, zinfo.file_size, zinfo.compress_size = 0, big, 3
+        writer.write_member(zinfo, b"\x03\x00\x00")
+        writer.close()
+    with ZipFile(path) as zf:
+        zinfo_small, zinfo_big = zf.infolist()
+        assert zinfo_small.header_offset == 0xFFFFFFFF + 1
+        assert zinfo_big.file_size == big
+        with io.open(__file__, "rb") as f:
+            assert zf.read("small.py") == f.read()
+        with io.open(path, "rb") as f:
+            assert read_raw(f, zinfo_big) == b"\x03\x00\x00"
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])